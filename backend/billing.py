@@ -1,6 +1,10 @@
+import asyncio
 import datetime
+import time
+from typing import Optional
 
 import stripe
+from cachetools import TTLCache
 from config import settings
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -8,6 +12,26 @@ from crud import UserCRUD
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# Асинхронный клиент Stripe: запросы через общий пул соединений httpx и не блокируют event loop
+# Создаётся при первом обращении | STRIPE_API_BASE позволяет направить запросы на локальный stripe-mock
+_stripe_http_client = None
+_stripe_client = None
+
+def get_stripe_client() -> stripe.StripeClient:
+    global _stripe_http_client, _stripe_client
+    if _stripe_client is None:
+        _stripe_http_client = stripe.HTTPXClient()
+        base_addresses = {"api": settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {}
+        _stripe_client = stripe.StripeClient(settings.STRIPE_SECRET_KEY, http_client=_stripe_http_client, base_addresses=base_addresses)
+    return _stripe_client
+
+async def close_stripe_client():
+    global _stripe_http_client, _stripe_client
+    if _stripe_http_client is not None:
+        await _stripe_http_client.close_async()
+    _stripe_http_client = None
+    _stripe_client = None
+
 # Список тарифов (создаются один раз в Stripe Dashboard)
 price_IDS = {
     "pro_Weekly": "price_1SlCpP060rnebdaLFdX6oyOS",
@@ -16,43 +40,68 @@ price_IDS = {
 }
 
 
-async def get_user_subscription_price(user):
-    if not user.stripe_subscription_id:
-        return None
+# Кэш каталога цен: price_id → "4.00 USD / month" | Прогревается при старте, обновляется по webhook price.* или по TTL
+_price_catalogue = {}  # price_id → (строка цены, время загрузки)
+# Цена для старых подписок, у которых ещё нет subscription_price_id в БД: subscription_id → price_id
+_legacy_subscription_prices = TTLCache(maxsize=10000, ttl=settings.PRICE_CACHE_TTL)
 
-    try:
-        subscription = stripe.Subscription.retrieve(user.stripe_subscription_id)
 
-        if subscription.status != "active":
-            return None
+def format_price(price) -> str:
+    # price — объект Price из API или data.object из webhook (оба поддерживают доступ как к словарю)
+    amount = price["unit_amount"] / 100
+    currency = price["currency"].upper()
+    interval = price["recurring"]["interval"]
+
+    # Форматируем
+    if currency == "RUB":
+        amount_str = f"{int(amount)} ₽"
+    else:
+        amount_str = f"{amount:.2f} {currency}"
+
+    return f"{amount_str} / {interval}"
+
 
-        # Получаем список items через auto-pagination
-        items = subscription['items'].data  # Обращаемся как к словарю
+def update_price_catalogue(price) -> None:
+    _price_catalogue[price["id"]] = (format_price(price), time.monotonic())
 
-        if not items:
-            return None
 
-        # Первый элемент подписки
-        item = items[0]
+async def get_price_label(price_id: str) -> Optional[str]:
+    cached = _price_catalogue.get(price_id)
+    if cached and time.monotonic() - cached[1] < settings.PRICE_CACHE_TTL:
+        return cached[0]
 
-        # Получаем price_id из item
-        price_id = item.price.id
+    # Нет в кэше или устарело → один запрос к Stripe
+    price = await get_stripe_client().v1.prices.retrieve_async(price_id)
+    update_price_catalogue(price)
+    return _price_catalogue[price_id][0]
 
-        # Получаем объект Price
-        price = stripe.Price.retrieve(price_id)
 
-        amount = price.unit_amount / 100
-        currency = price.currency.upper()
-        interval = price.recurring.interval
+async def warm_price_catalogue() -> None:
+    # Тарифы из price_IDS загружаем параллельно при старте приложения
+    prices = await asyncio.gather(*(get_stripe_client().v1.prices.retrieve_async(price_id) for price_id in price_IDS.values()))
+    for price in prices:
+        update_price_catalogue(price)
 
-        # Форматируем
-        if currency == "RUB":
-            amount_str = f"{int(amount)} ₽"
-        else:
-            amount_str = f"{amount:.2f} {currency}"
 
-        print(f"{amount_str} / {interval}")
-        return f"{amount_str} / {interval}"
+async def get_user_subscription_price(user):
+    # Статус и тариф подписки синхронизируются webhook-ами в БД → /profile обходится без запросов к Stripe
+    if not user.stripe_subscription_id or user.subscription_status != "active":
+        return None
+
+    try:
+        price_id = user.subscription_price_id
+        if not price_id:
+            # Подписка оформлена до появления subscription_price_id — узнаём тариф один раз и кэшируем
+            price_id = _legacy_subscription_prices.get(user.stripe_subscription_id)
+            if price_id is None:
+                subscription = await get_stripe_client().v1.subscriptions.retrieve_async(user.stripe_subscription_id)
+                items = subscription['items'].data  # Обращаемся как к словарю
+                if not items:
+                    return None
+                price_id = items[0].price.id
+                _legacy_subscription_prices[user.stripe_subscription_id] = price_id
+
+        return await get_price_label(price_id)
 
     except stripe.error.StripeError as e:
         print(f"Stripe error: {e}")
@@ -62,35 +111,43 @@ async def get_user_subscription_price(user):
         return None
 
 
+def get_subscription_price_id(subscription) -> Optional[str]:
+    # price_id первого item подписки из data.object webhook-а
+    items = (subscription.get("items") or {}).get("data") or []
+    if not items:
+        return None
+    return items[0]["price"]["id"]
+
+
 # Создаём Stripe Customer, если это первая покупка
 async def create_or_retrieve_subscription(db: AsyncSession, user):
     if not user.stripe_customer_id:
-        customer = stripe.Customer.create(email=user.email)
+        customer = await get_stripe_client().v1.customers.create_async(params={"email": user.email})
         await UserCRUD.update_stripe_customer_id(db, user, customer.id)
+        await db.commit() # Customer в Stripe уже создан — сохраняем его, даже если checkout дальше упадёт
         print(f"user {user.email} created stripe_customer_id {customer.id}")
     return user.stripe_customer_id
 
 #Создаём сессию оплаты — пользователь перенаправляется на Stripe Checkout
 async def create_session_checkout(db: AsyncSession, user, price_id: str):
     customer_id = await create_or_retrieve_subscription(db, user)
-    session = stripe.checkout.Session.create(
-        customer=customer_id,
-        payment_method_types=["card"],
-        line_items=[{"price": price_id, "quantity": 1}],
-        mode='subscription',
-        success_url = "https://psychologyai-production.up.railway.app/payments/success",
-        cancel_url = "https://psychologyai-production.up.railway.app/payments/failed"
-    )
+    session = await get_stripe_client().v1.checkout.sessions.create_async(params={
+        "customer": customer_id,
+        "payment_method_types": ["card"],
+        "line_items": [{"price": price_id, "quantity": 1}],
+        "mode": 'subscription',
+        "success_url": "https://psychologyai-production.up.railway.app/payments/success",
+        "cancel_url": "https://psychologyai-production.up.railway.app/payments/failed"
+    })
     return session.url # ссылка, куда редиректим пользователя
 
 #Обрабатываем события от Stripe (самое важное!)
 async def handle_webhook_event(event: dict, db: AsyncSession):
     #Обрабатывает входящие webhook-события от Stripe | Синхронизирует статус подписки пользователя в базе данных.
+    # Вызывается из очереди (webhook_worker.py), а не из HTTP-обработчика
     event_type = event["type"]
-    print(f"event_type: {event_type}")
     data_object = event["data"]["object"]
-    print(f"data_object: {data_object}")
-    print(f"Получено событие Stripe: {event_type}")
+    print(f"Получено событие Stripe: {event_type} ({event.get('id')})")
 
     # 1. Успешная оплата счёта (invoice paid / payment succeeded)
     if event_type in ["invoice.paid", "invoice.payment_succeeded"]:
@@ -148,7 +205,8 @@ async def handle_webhook_event(event: dict, db: AsyncSession):
         period_end = datetime.datetime.fromtimestamp(period_end_ts) if period_end_ts else None
         print(f"Подписка СОЗДАНА для {user.email} | Status: {status} | period_end_ts: {period_end_ts} |period_end: {period_end}")
 
-        await UserCRUD.update_subscription(db, user, subscription_id = subscription_id, status = status, period_end = period_end)
+        await UserCRUD.update_subscription(db, user, subscription_id = subscription_id, status = status, period_end = period_end,
+                                           price_id = get_subscription_price_id(data_object))
 
     # 5. Подписка обновлена
     elif event_type == "customer.subscription.updated":
@@ -164,7 +222,13 @@ async def handle_webhook_event(event: dict, db: AsyncSession):
         period_end = datetime.datetime.fromtimestamp(period_end_ts) if period_end_ts else None
         print(f"Подписка ОБНОВЛЕНА для {user.email} | Новый статус: {status} | period_end_ts: {period_end_ts} |period_end: {period_end}")
 
-        await UserCRUD.update_subscription(db, user, subscription_id = subscription_id, status = status, period_end = period_end)
+        await UserCRUD.update_subscription(db, user, subscription_id = subscription_id, status = status, period_end = period_end,
+                                           price_id = get_subscription_price_id(data_object))
+
+    # 6. Цена изменена в Dashboard → обновляем каталог без запроса к API
+    elif event_type in ["price.created", "price.updated"]:
+        if data_object.get("recurring"):
+            update_price_catalogue(data_object)
 
     else:
         print(f"Необрабатываемое событие: {event_type}")
\ No newline at end of file
@@ -5,15 +5,110 @@ class Settings(BaseSettings):
 
     BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
     GROQ_API_KEY: str = os.getenv("GROQ_API_KEY", "")
+    GROQ_BASE_URL: str = os.getenv("GROQ_BASE_URL", "") # Пусто — api.groq.com
+    # Шлюз к LLM: параллельных запросов на роль (answer / classifier / summary) в воркере — все модели роли делят эти слоты,
+    # всего в воркере до 3 × LLM_MAX_CONCURRENCY | Таймаут одного запроса и общий дедлайн с повторами (секунды), число попыток
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "30"))
+    LLM_DEADLINE: float = float(os.getenv("LLM_DEADLINE", "45"))
+    LLM_MAX_ATTEMPTS: int = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+    # Circuit breaker: ошибок подряд до размыкания и через сколько секунд пробовать снова
+    LLM_BREAKER_FAILURES: int = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+    LLM_BREAKER_RESET: float = float(os.getenv("LLM_BREAKER_RESET", "30"))
+    # Провайдеры LLM: JSON-список OpenAI-совместимых API в дополнение к Groq (см. llm_router.build_router)
+    LLM_PROVIDERS: str = os.getenv("LLM_PROVIDERS", "")
+    # Кандидаты "провайдер:модель" через запятую для каждой роли | Классификатор и summary по умолчанию — те же модели, что и ответ
+    LLM_ANSWER_MODELS: str = os.getenv("LLM_ANSWER_MODELS", "groq:moonshotai/kimi-k2-instruct")
+    LLM_CLASSIFIER_MODELS: str = os.getenv("LLM_CLASSIFIER_MODELS", "")
+    LLM_SUMMARY_MODELS: str = os.getenv("LLM_SUMMARY_MODELS", "")
+    # Статистика маршрутизации: окно (секунды), минимум замеров для оценки, доля ошибок, после которой модель нездорова
+    LLM_STATS_WINDOW: float = float(os.getenv("LLM_STATS_WINDOW", "300"))
+    LLM_MIN_SAMPLES: int = int(os.getenv("LLM_MIN_SAMPLES", "5"))
+    LLM_MAX_ERROR_RATE: float = float(os.getenv("LLM_MAX_ERROR_RATE", "0.5"))
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     SECRET_KEY: str = os.getenv("SECRET_KEY", "default-secret-key-change-me")
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "") # Bearer-токен для /metrics | Пусто — эндпоинт выключен (404)
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
     STRIPE_SECRET_KEY: str = os.getenv("STRIPE_SECRET_KEY", "")
     STRIPE_WEBHOOK_SECRET: str = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+    # Очередь webhook-событий Stripe: число воркеров, интервал опроса (секунды), попыток до статуса failed
+    WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "2"))
+    WEBHOOK_POLL_INTERVAL: float = float(os.getenv("WEBHOOK_POLL_INTERVAL", "5"))
+    WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+    # Пауза перед повтором упавшего события: RETRY_BASE × 2^(попытка-1), не больше RETRY_MAX (секунды)
+    WEBHOOK_RETRY_BASE: float = float(os.getenv("WEBHOOK_RETRY_BASE", "5"))
+    WEBHOOK_RETRY_MAX: float = float(os.getenv("WEBHOOK_RETRY_MAX", "600"))
+    PRICE_CACHE_TTL: int = int(os.getenv("PRICE_CACHE_TTL", "21600")) # Кэш каталога цен Stripe (секунды)
+    STRIPE_API_BASE: str = os.getenv("STRIPE_API_BASE", "") # Например http://localhost:12111 для stripe-mock | Пусто — api.stripe.com
     REDIS_PUBLIC_URL: str = os.getenv("REDIS_PUBLIC_URL", "")
     REDIS_URL: str = os.getenv("REDIS_URL", "")
+    REDIS_HEALTH_INTERVAL: int = int(os.getenv("REDIS_HEALTH_INTERVAL", "10")) # Как часто фоновый монитор пингует Redis (секунды)
     SQLALCHEMY_DATABASE_URL: str = os.getenv("SQLALCHEMY_DATABASE_URL", "")
     LOCAL_SQLALCHEMY_DATABASE_URL: str = os.getenv("LOCAL_SQLALCHEMY_DATABASE_URL", "")
+    SQLALCHEMY_REPLICA_URLS: str = os.getenv("SQLALCHEMY_REPLICA_URLS", "") # Реплики для чтения через запятую | Пусто — всё читаем с primary
+    READ_YOUR_WRITES_SECONDS: int = int(os.getenv("READ_YOUR_WRITES_SECONDS", "30")) # Сколько после записи пользователь читает с primary (покрывает стрим ответа)
+    SQLALCHEMY_DIRECT_URL: str = os.getenv("SQLALCHEMY_DIRECT_URL", "") # Прямой адрес Postgres, если основной URL смотрит на PgBouncer
+    # Пул соединений с БД: размер, сверх размера, ожидание свободного соединения и пересоздание (секунды), SELECT 1 при выдаче
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500")) # Кэш prepared statements asyncpg на соединение
+    DB_PGBOUNCER: bool = os.getenv("DB_PGBOUNCER", "false").lower() == "true" # PgBouncer в режиме transaction: без пула и кэша statements
+    # alembic upgrade head при старте приложения — только для локальной разработки
+    # В проде миграции — отдельный шаг деплоя (см. Dockerfile): несколько воркеров не мигрируют схему одновременно, а долгая миграция не держит старт
+    AUTO_MIGRATE: bool = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+    # Спекулятивный режим: классификатор и генерация ответа запускаются одновременно
+    SPECULATIVE_CLASSIFICATION: bool = os.getenv("SPECULATIVE_CLASSIFICATION", "true").lower() == "true"
+    # Классификатор тематики: llm | local | hybrid (локальная модель, LLM только при низкой уверенности)
+    CLASSIFIER_BACKEND: str = os.getenv("CLASSIFIER_BACKEND", "hybrid")
+    # Порог уверенности локальной модели: 0 — подобрать при обучении так, чтобы точность уверенных ответов
+    # на отложенных фолдах была не ниже CLASSIFIER_TARGET_ACCURACY (остальные сообщения уходят в LLM)
+    CLASSIFIER_CONFIDENCE: float = float(os.getenv("CLASSIFIER_CONFIDENCE", "0"))
+    CLASSIFIER_TARGET_ACCURACY: float = float(os.getenv("CLASSIFIER_TARGET_ACCURACY", "0.97"))
+    CLASSIFIER_TRAINING_FILE: str = os.getenv("CLASSIFIER_TRAINING_FILE", "")
+    CLASSIFIER_TRAINING_MAX: int = int(os.getenv("CLASSIFIER_TRAINING_MAX", "5000")) # Сколько последних вердиктов LLM из файла берём в обучение
+    # Кэш вердиктов классификатора (секунды / количество фраз в памяти процесса)
+    VERDICT_CACHE_TTL: int = int(os.getenv("VERDICT_CACHE_TTL", "86400"))
+    VERDICT_CACHE_LOCAL_SIZE: int = int(os.getenv("VERDICT_CACHE_LOCAL_SIZE", "2048"))
+    # История чата для модели: бюджет токенов, максимум сообщений из БД, кэш собранного контекста
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    CONTEXT_MAX_MESSAGES: int = int(os.getenv("CONTEXT_MAX_MESSAGES", "40"))
+    CONTEXT_CACHE_TTL: int = int(os.getenv("CONTEXT_CACHE_TTL", "600"))
+    CONTEXT_CACHE_SIZE: int = int(os.getenv("CONTEXT_CACHE_SIZE", "1024"))
+    # Кэш строки пользователя между запросами (секунды / количество пользователей)
+    USER_CACHE_TTL: int = int(os.getenv("USER_CACHE_TTL", "30"))
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    # Rate limiting (политика: sliding_window | token_bucket, лимит, окно в секундах)
+    GUEST_RATE_POLICY: str = os.getenv("GUEST_RATE_POLICY", "sliding_window")
+    GUEST_RATE_LIMIT: int = int(os.getenv("GUEST_RATE_LIMIT", "3"))
+    GUEST_RATE_WINDOW: int = int(os.getenv("GUEST_RATE_WINDOW", "120"))
+    SEND_RATE_POLICY: str = os.getenv("SEND_RATE_POLICY", "token_bucket")
+    SEND_RATE_LIMIT: int = int(os.getenv("SEND_RATE_LIMIT", "10"))
+    SEND_RATE_WINDOW: int = int(os.getenv("SEND_RATE_WINDOW", "60"))
+    AUTH_RATE_POLICY: str = os.getenv("AUTH_RATE_POLICY", "sliding_window")
+    AUTH_RATE_LIMIT: int = int(os.getenv("AUTH_RATE_LIMIT", "10"))
+    AUTH_RATE_WINDOW: int = int(os.getenv("AUTH_RATE_WINDOW", "300"))
+    # Попытки входа в один аккаунт со всех адресов вместе (распределённый перебор пароля) | Выше лимита email + IP, чтобы чужой перебор не блокировал владельца надолго
+    LOGIN_ACCOUNT_RATE_LIMIT: int = int(os.getenv("LOGIN_ACCOUNT_RATE_LIMIT", "30"))
+    LOGIN_ACCOUNT_RATE_WINDOW: int = int(os.getenv("LOGIN_ACCOUNT_RATE_WINDOW", "900"))
+    # Семантический кэш ответов гостям: модель эмбеддингов (CPU), порог косинусной близости, TTL (секунды), максимум ответов в памяти
+    SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+    SEMANTIC_CACHE_MODEL: str = os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+    SEMANTIC_CACHE_TTL: int = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+    SEMANTIC_CACHE_SIZE: int = int(os.getenv("SEMANTIC_CACHE_SIZE", "5000"))
+    # Сколько сообщений чата рендерить за раз (остальные — по кнопке "Load earlier")
+    MESSAGES_PAGE_SIZE: int = int(os.getenv("MESSAGES_PAGE_SIZE", "30"))
+    # Сайдбар: сколько чатов показывать за раз (остальные — по кнопке "Load more") и TTL кэша списка в Redis (секунды)
+    SIDEBAR_PAGE_SIZE: int = int(os.getenv("SIDEBAR_PAGE_SIZE", "50"))
+    SIDEBAR_CACHE_TTL: int = int(os.getenv("SIDEBAR_CACHE_TTL", "300"))
+    # Сжатие ответов gzip: ответы короче GZIP_MINIMUM_SIZE байт отдаются как есть
+    GZIP_MINIMUM_SIZE: int = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+    # Скользящее summary: когда несжатых сообщений больше TRIGGER, старые сворачиваются, последние KEEP_RECENT остаются как есть
+    SUMMARY_TRIGGER_MESSAGES: int = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "30"))
+    SUMMARY_KEEP_RECENT: int = int(os.getenv("SUMMARY_KEEP_RECENT", "10"))
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,79 @@
+# Сборка истории чата для модели в рамках бюджета токенов
+# Хвост переписки грузим из БД один раз, дальше дописываем новые сообщения в кэш процесса.
+# Кэш у каждого воркера свой → перед использованием сверяем его с версией истории в БД (один лёгкий запрос):
+# если сообщение сохранил другой воркер или summary обновилось, собираем контекст заново.
+from typing import List
+
+from cachetools import TTLCache
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from crud import ChatCRUD
+
+_context_cache = TTLCache(maxsize=settings.CONTEXT_CACHE_SIZE, ttl=settings.CONTEXT_CACHE_TTL)
+
+
+def estimate_tokens(text: str) -> int:
+    # Быстрая оценка без токенизатора: ~3 символа на токен (с запасом для кириллицы) + служебные токены роли
+    return len(text) // 3 + 4
+
+
+def fit_to_budget(messages: List[dict], budget: int) -> List[dict]:
+    # Идём от новых сообщений к старым, пока не кончится бюджет | Старые реплики отбрасываются
+    fitted = []
+    used = 0
+    for message in reversed(messages):
+        cost = estimate_tokens(message["content"])
+        if used + cost > budget:
+            break
+        fitted.append(message)
+        used += cost
+    fitted.reverse()
+
+    # Контекст не должен начинаться с ответа ассистента без вопроса
+    while fitted and fitted[0]["role"] == "assistant":
+        fitted.pop(0)
+    return fitted
+
+
+async def build_context(db: AsyncSession, conversation_id: int) -> List[dict]:
+    # Вызывать ДО сохранения нового сообщения пользователя — оно уходит в модель отдельно
+    # Итог: [summary ранних сообщений (если есть)] + хвост переписки после него
+    version = await ChatCRUD.get_history_version(db, conversation_id)
+    cached = _context_cache.get(conversation_id)
+    if cached is None or cached[0] != version:
+        summary = await ChatCRUD.get_summary(db, conversation_id) # Одна строка вместо сотен сообщений
+        summary_message = None
+        after_id = 0
+        if summary and summary.summary:
+            summary_message = {"role": "system", "content": f"Summary of the earlier conversation with this user: {summary.summary}"}
+            after_id = summary.last_message_id
+
+        rows = await ChatCRUD.get_recent_messages(db, conversation_id, settings.CONTEXT_MAX_MESSAGES, after_id=after_id)
+        tail = fit_to_budget([{"role": role, "content": content} for role, content in rows], _tail_budget(summary_message))
+        cached = (version, summary_message, tail)
+        _context_cache[conversation_id] = cached
+
+    _, summary_message, tail = cached
+    return ([summary_message] if summary_message else []) + tail
+
+
+def _tail_budget(summary_message) -> int:
+    if summary_message is None:
+        return settings.CONTEXT_TOKEN_BUDGET
+    return max(settings.CONTEXT_TOKEN_BUDGET - estimate_tokens(summary_message["content"]), 0)
+
+
+def remember_exchange(conversation_id: int, user_text: str, reply: str, last_message_id: int) -> None:
+    # Дописываем новый обмен в кэш вместо повторного чтения из БД на следующем сообщении
+    # Версия сдвигается на наши два сообщения — если между ними вклинилось чужое, число сообщений не сойдётся и кэш пересоберётся
+    cached = _context_cache.get(conversation_id)
+    if cached is None:
+        return
+    (_, message_count, summary_id), summary_message, tail = cached
+    tail = tail + [{"role": "user", "content": user_text}, {"role": "assistant", "content": reply}]
+    _context_cache[conversation_id] = ((last_message_id, message_count + 2, summary_id), summary_message, fit_to_budget(tail, _tail_budget(summary_message)))
+
+
+def forget(conversation_id: int) -> None:
+    _context_cache.pop(conversation_id, None)
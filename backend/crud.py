@@ -1,10 +1,15 @@
 import datetime
-from typing import Optional, List
+from dataclasses import dataclass
+from typing import Optional, List, Tuple
 
-from models import User, Conversation, Message
+from models import User, Conversation, Message, ConversationSummary, StripeEvent
 from schemas import UserCreateSchema, UserSchema, UserLoginSchema
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update, func, text, tuple_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm.attributes import set_committed_value
+from utils import render_message_html, MESSAGE_HTML_VERSION
+import user_cache
 
 
 class UserCRUD:
@@ -22,8 +27,7 @@ class UserCRUD:
             password=user_data.password
         )
         db.add(new_user)
-        await db.commit()
-        await db.refresh(new_user)
+        await db.flush()
         return new_user
 
     @staticmethod
@@ -42,37 +46,51 @@ class UserCRUD:
         return result.scalar_one_or_none()
 
     @staticmethod
-    async def get_user_free_tokens(db, email: str):
-        result = await db.execute(select(User).where(User.email == email))
-        user = result.scalar_one_or_none()
-
-        return user.user_free_tokens
-
-    @staticmethod
-    async def update_user_tokens(db, email: str):
-        result = await db.execute(select(User).where(User.email == email))
-        user = result.scalar_one_or_none()
+    async def update_user_tokens(db, user: User):
+        # Проверка и списание одним запросом: UPDATE ... WHERE user_free_tokens > 0 RETURNING
+        # Условие проверяет сама БД под блокировкой строки — параллельные /send не уйдут в минус
+        result = await db.execute(
+            update(User)
+            .where(User.id == user.id, User.user_free_tokens > 0)
+            .values(user_free_tokens=User.user_free_tokens - 1)
+            .returning(User.user_free_tokens)
+            .execution_options(synchronize_session=False)
+        )
+        remaining = result.scalar_one_or_none() # Без commit — строка остаётся заблокированной до commit вызывающего кода
 
-        if user.user_free_tokens <= 0:
-            user.user_free_tokens = 0
+        if remaining is None:
             return False
 
-        user.user_free_tokens -= 1
-        await db.commit()
-        await db.refresh(user)
-
+        # Обновляем значение в объекте и в кэше без лишнего SELECT/refresh
+        set_committed_value(user, "user_free_tokens", remaining)
+        user_cache.set_committed(db, user, "user_free_tokens", remaining) # В кэш — после commit вызывающего кода
         return True
 
+    @staticmethod
+    async def refund_user_token(db, user: User) -> None:
+        # Возврат токена, списанного update_user_tokens, когда ответа не получилось (LLM недоступен / вернул ошибку)
+        result = await db.execute(
+            update(User)
+            .where(User.id == user.id)
+            .values(user_free_tokens=User.user_free_tokens + 1)
+            .returning(User.user_free_tokens)
+            .execution_options(synchronize_session=False)
+        )
+        remaining = result.scalar_one()
+        set_committed_value(user, "user_free_tokens", remaining)
+        user_cache.set_committed(db, user, "user_free_tokens", remaining) # В кэш — после commit вызывающего кода
+
     @staticmethod
     async def change_password(db, user, new_password):
         user.password = new_password
-        await db.commit()
-        await db.refresh(user)
+        user_cache.invalidate(db, user)
+        await db.flush()
 
     @staticmethod
     async def delete_account(db, user: User):
+        user_cache.invalidate(db, user)
         await db.delete(user)
-        await db.commit()
+        await db.flush()
 
 
     #================
@@ -86,20 +104,22 @@ class UserCRUD:
     async def update_stripe_customer_id(db, user:User, customer_id: str) -> Optional[User]:
         #Сохраняем customer_id после первого создания в Stripe
         user.stripe_customer_id = customer_id
-        await db.commit()
-        await db.refresh(user)
+        user_cache.invalidate(db, user)
+        await db.flush()
         return user
 
     @staticmethod
-    async def update_subscription(db, user: User, subscription_id: Optional[str], status: str, period_end: Optional[datetime]) -> Optional[User]:
+    async def update_subscription(db, user: User, subscription_id: Optional[str], status: str, period_end: Optional[datetime], price_id: Optional[str] = None) -> Optional[User]:
         #Обновляем статус подписки после webhook от Stripe
         if subscription_id is not None:
             user.stripe_subscription_id = subscription_id
+        if price_id is not None:
+            user.subscription_price_id = price_id # Текущий тариф храним локально — /profile не ходит в Stripe
         user.subscription_status = status
         print(f"subscription_status = {user.subscription_status}")
         user.subscription_current_period_end = period_end
-        await db.commit()
-        await db.refresh(user)
+        user_cache.invalidate(db, user)
+        await db.flush()
         return user
 
     @staticmethod
@@ -126,6 +146,14 @@ class UserCRUD:
 
     # ================
 
+@dataclass(slots=True)
+class ConversationItem:
+    # Строка сайдбара — только то, что нужно для рендера, без ORM-объекта
+    id: int
+    title: str
+    updated_at: datetime.datetime
+
+
 class ChatCRUD:
     @staticmethod # Находим последний чат пользователя или создаем новый при первом запуске
     async def get_or_create_conversation(db: AsyncSession, user_id:int) -> Optional[Conversation]:
@@ -136,59 +164,104 @@ class ChatCRUD:
             print("Чаты отсутствуют, создаем новый")
             conv = Conversation(user_id=user_id, title="New Conversation")
             db.add(conv)
-            await db.commit()
-            await db.refresh(conv)
+            await db.flush()
 
         return conv
 
-    @staticmethod  #Сохраняем сообщение в бд
-    async def add_message(db: AsyncSession,conversation_id: int, role:str, content: str) -> Message:
-        message = Message(conversation_id = conversation_id, role = role, content = content)
-        db.add(message)
+    @staticmethod  #Сохраняем вопрос пользователя и ответ ИИ одной транзакцией: UPDATE времени чата + один INSERT на оба сообщения + COMMIT
+    async def add_exchange(db: AsyncSession, conversation_id: int, user_text: str, reply: str) -> Tuple[Message, Message]:
+        # HTML сообщений (с markdown для ответа ИИ) рендерим сейчас — при открытии чата он только склеивается
+        user_message = Message(conversation_id = conversation_id, role = "user", content = user_text, html = render_message_html("user", user_text), html_version = MESSAGE_HTML_VERSION)
+        ai_message = Message(conversation_id = conversation_id, role = "assistant", content = reply, html = render_message_html("assistant", reply), html_version = MESSAGE_HTML_VERSION)
+        db.add_all([user_message, ai_message])
 
-        # Обновляем время диалога
         await ChatCRUD.update_conversation_time(db, conversation_id)
 
-        await db.commit()
-        await db.refresh(message)
-        return message
+        await db.flush() # Оба сообщения одним INSERT (insertmanyvalues) | commit — один на запрос, у вызывающего кода
+        return user_message, ai_message
 
-    @staticmethod
-    async def get_messages(db: AsyncSession, conversation:int) -> List[Message]:
-        result = await db.execute(select(Message).where(Message.conversation_id == conversation))
+    @staticmethod # Keyset-пагинация по (conversation_id, id): последние limit сообщений до before_id | Возвращает (сообщения от старых к новым, есть ли ещё более ранние)
+    async def get_messages_page(db: AsyncSession, conversation_id: int, limit: int, before_id: Optional[int] = None) -> Tuple[List[Message], bool]:
+        query = select(Message).where(Message.conversation_id == conversation_id)
+        if before_id is not None:
+            query = query.where(Message.id < before_id)
+        result = await db.execute(query.order_by(Message.id.desc()).limit(limit + 1)) # +1 — чтобы узнать, есть ли следующая страница
         messages = result.scalars().all()
 
-        return messages
+        has_more = len(messages) > limit
+        return list(reversed(messages[:limit])), has_more
+
+    @staticmethod # Последние N сообщений чата (от старых к новым) — для контекста модели | after_id отсекает то, что уже вошло в summary
+    async def get_recent_messages(db: AsyncSession, conversation_id: int, limit: int, after_id: int = 0) -> List[tuple]:
+        result = await db.execute(select(Message.role, Message.content).where(Message.conversation_id == conversation_id, Message.id > after_id).order_by(Message.id.desc()).limit(limit))
+        return list(reversed(result.all()))
+
+    @staticmethod # Версия истории чата: (id последнего сообщения, число сообщений, до какого сообщения свёрнуто summary) — одним запросом по индексу (conversation_id, id)
+    async def get_history_version(db: AsyncSession, conversation_id: int) -> Tuple[int, int, int]:
+        summary_id = select(ConversationSummary.last_message_id).where(ConversationSummary.conversation_id == conversation_id).scalar_subquery()
+        result = await db.execute(select(func.coalesce(func.max(Message.id), 0), func.count(Message.id), func.coalesce(summary_id, 0)).where(Message.conversation_id == conversation_id))
+        return tuple(result.one())
+
+    @staticmethod # Сколько сообщений ещё не вошло в summary — COUNT по индексу (conversation_id, id), без чтения текстов
+    async def count_unsummarized(db: AsyncSession, conversation_id: int) -> int:
+        summary_id = select(ConversationSummary.last_message_id).where(ConversationSummary.conversation_id == conversation_id).scalar_subquery()
+        result = await db.execute(select(func.count(Message.id)).where(Message.conversation_id == conversation_id, Message.id > func.coalesce(summary_id, 0)))
+        return result.scalar_one()
+
+    @staticmethod # Сообщения после after_id (от старых к новым) — для обновления summary
+    async def get_messages_after(db: AsyncSession, conversation_id: int, after_id: int) -> List[tuple]:
+        result = await db.execute(select(Message.id, Message.role, Message.content).where(Message.conversation_id == conversation_id, Message.id > after_id).order_by(Message.id))
+        return result.all()
+
+    @staticmethod
+    async def get_summary(db: AsyncSession, conversation_id: int, for_update: bool = False) -> Optional[ConversationSummary]:
+        query = select(ConversationSummary).where(ConversationSummary.conversation_id == conversation_id)
+        if for_update:
+            query = query.with_for_update() # Блокируем строку до commit — два воркера не сохранят summary поверх друг друга
+        result = await db.execute(query)
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def save_summary(db: AsyncSession, conversation_id: int, summary: str, last_message_id: int) -> None:
+        row = await db.get(ConversationSummary, conversation_id)
+        if row is None:
+            row = ConversationSummary(conversation_id=conversation_id)
+            db.add(row)
+        row.summary = summary
+        row.last_message_id = last_message_id
+        await db.flush()
+
+    @staticmethod # Сайдбар: keyset-пагинация по (updated_at, id) от новых к старым | Возвращает (чаты, есть ли ещё)
+    async def list_conversations(db: AsyncSession, user_id: int, limit: int, before: Optional[Tuple[datetime.datetime, int]] = None) -> Tuple[List[ConversationItem], bool]:
+        query = select(Conversation.id, Conversation.title, Conversation.updated_at).where(Conversation.user_id == user_id)
+        if before is not None:
+            query = query.where(tuple_(Conversation.updated_at, Conversation.id) < tuple_(*before))
+        result = await db.execute(query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit + 1)) # +1 — чтобы узнать, есть ли следующая страница
+        rows = result.all()
+
+        has_more = len(rows) > limit
+        return [ConversationItem(*row) for row in rows[:limit]], has_more
 
     @staticmethod
-    async def get_all_conversations(db: AsyncSession, user_id:int) -> List[Conversation]:
-        result = await db.execute(select(Conversation).where(Conversation.user_id == user_id).order_by(Conversation.updated_at.desc()))
-        return result.scalars().all()
+    async def count_conversations(db: AsyncSession, user_id: int) -> int:
+        result = await db.execute(select(func.count()).select_from(Conversation).where(Conversation.user_id == user_id))
+        return result.scalar_one()
 
     @staticmethod
     async def create_new_conversation(db: AsyncSession, user_id:int, title: str = "New Conversation") -> Optional[Conversation]:
         conversation = Conversation(user_id = user_id, title = title)
         db.add(conversation)
-        await db.commit()
-        await db.refresh(conversation)
+        await db.flush()
         return conversation
 
     @staticmethod
-    async def get_conversation_data(db: AsyncSession, conversation_id:int) -> Optional[Conversation]:
-        result = await db.execute(select(Conversation).where(Conversation.user_id == conversation_id))
+    async def get_conversation_data(db: AsyncSession, conversation_id:int, user_id: int) -> Optional[Conversation]:
+        result = await db.execute(select(Conversation).where(Conversation.id == conversation_id, Conversation.user_id == user_id))
         return result.scalar_one_or_none()
 
-    @staticmethod
-    async def update_conversation_time(db: AsyncSession, conversation_id:int) -> Optional[Conversation]:
-        result = await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(updated_at=func.now()).returning(Conversation))  # БД сама подставит текущее время
-        conversation = result.scalar_one_or_none()
-
-        if conversation:
-            await db.commit()
-            await db.refresh(conversation)
-            return conversation
-
-        return None
+    @staticmethod # Без RETURNING и без commit — коммитит вызывающий метод вместе с сообщениями
+    async def update_conversation_time(db: AsyncSession, conversation_id:int) -> None:
+        await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(updated_at=func.now()).execution_options(synchronize_session=False))  # БД сама подставит текущее время
 
 
 
@@ -207,7 +280,7 @@ class ChatCRUD:
             return False
 
         await db.delete(conversation)
-        await db.commit()
+        await db.flush()
 
         return True
 
@@ -217,8 +290,73 @@ class ChatCRUD:
         conversation = result.scalar_one_or_none()
         if conversation:
             conversation.title = new_title
-            await db.commit()
-            await db.refresh(conversation)
+            await db.flush()
             return True
 
-        return False
\ No newline at end of file
+        return False
+
+
+def utcnow() -> datetime.datetime:
+    # Наивное UTC-время, как в колонках DateTime без часового пояса
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class StripeEventCRUD:
+    @staticmethod # Кладём событие в очередь | ON CONFLICT DO NOTHING — повторы Stripe с тем же event.id отбрасываются
+    async def enqueue(db: AsyncSession, event: dict) -> bool:
+        data_object = event["data"]["object"]
+        result = await db.execute(
+            pg_insert(StripeEvent)
+            .values(id=event["id"], type=event["type"], customer_id=data_object.get("customer") or "", payload=event, created=event["created"])
+            .on_conflict_do_nothing(index_elements=[StripeEvent.id])
+        )
+        return result.rowcount > 0
+
+    @staticmethod # Самое раннее необработанное событие каждого клиента — только его можно брать в работу
+    async def get_pending_heads(db: AsyncSession, limit: int, now: Optional[datetime.datetime] = None) -> List[tuple]:
+        # Голова очереди клиента, даже если она ждёт повтора, — следующее событие клиента не обгоняет её
+        # Клиенты — в порядке поступления их головного события (старые первыми), а не по customer_id
+        now = now or utcnow()
+        position = func.row_number().over(partition_by=StripeEvent.customer_id, order_by=(StripeEvent.created, StripeEvent.received_at))
+        pending = (
+            select(StripeEvent.id, StripeEvent.customer_id, StripeEvent.received_at, StripeEvent.next_attempt_at, position.label("position"))
+            .where(StripeEvent.status == "pending")
+            .subquery()
+        )
+        result = await db.execute(
+            select(pending.c.id, pending.c.customer_id)
+            .where(pending.c.position == 1, or_(pending.c.next_attempt_at.is_(None), pending.c.next_attempt_at <= now))
+            .order_by(pending.c.received_at, pending.c.id)
+            .limit(limit)
+        )
+        return result.all()
+
+    @staticmethod # Advisory-лок на клиента (на уровне соединения): событие клиента обрабатывает только один воркер во всех процессах
+    async def try_lock_customer(db: AsyncSession, customer_id: str) -> bool:
+        result = await db.execute(text("SELECT pg_try_advisory_lock(hashtext(:key))"), {"key": f"stripe:{customer_id}"})
+        return bool(result.scalar())
+
+    @staticmethod
+    async def unlock_customer(db: AsyncSession, customer_id: str) -> None:
+        await db.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {"key": f"stripe:{customer_id}"})
+
+    @staticmethod
+    async def mark_done(db: AsyncSession, event: StripeEvent) -> None:
+        event.status = "done"
+        event.attempts += 1
+        event.processed_at = func.now()
+        await db.flush()
+
+    @staticmethod
+    async def mark_failed(db: AsyncSession, event_id: str, error: str, max_attempts: int, retry_base: float, retry_max: float) -> None:
+        # После max_attempts событие уходит в failed и перестаёт блокировать очередь клиента
+        # До этого — повтор с экспоненциальной паузой, а не сразу на следующем опросе
+        event = await db.get(StripeEvent, event_id)
+        event.attempts += 1
+        event.last_error = error
+        if event.attempts >= max_attempts:
+            event.status = "failed"
+        else:
+            delay = min(retry_base * 2 ** (event.attempts - 1), retry_max)
+            event.next_attempt_at = utcnow() + datetime.timedelta(seconds=delay)
+        await db.flush()
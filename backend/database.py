@@ -1,21 +1,125 @@
+import itertools
 import os
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine,async_sessionmaker
-from sqlalchemy.orm import DeclarativeBase
+import time
+import uuid
+
+from sqlalchemy import exc, event
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine,async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from fastapi import Request
 from dotenv import load_dotenv
 load_dotenv()
 
-import os
+from config import settings
 
 # 🔗 Подключение к PostgreSQL
 #LOCAL_SQLALCHEMY_DATABASE_URL = os.getenv("LOCAL_SQLALCHEMY_DATABASE_URL")
 SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
+# Прямое подключение к Postgres в обход PgBouncer — для advisory-локов (миграции, воркеры webhook) | Пусто — тот же URL
+SQLALCHEMY_DIRECT_URL = settings.SQLALCHEMY_DIRECT_URL or SQLALCHEMY_DATABASE_URL
+
+
+# 📊 Пул с метриками: сколько ждали свободного соединения, сколько раз вышли за pool_size, сколько раз не дождались
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {"checkouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "overflow_events": 0, "timeouts": 0}
+
+    def _do_get(self):
+        overflow_before = self._overflow
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        waited = time.perf_counter() - start
+
+        self.stats["checkouts"] += 1
+        self.stats["wait_seconds_total"] += waited
+        self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], waited)
+        if self._overflow > max(overflow_before, 0): # Открыто соединение сверх pool_size
+            self.stats["overflow_events"] += 1
+        return connection
+
+
+def _make_engine(url: str, pgbouncer: bool) -> AsyncEngine:
+    if pgbouncer:
+        # PgBouncer в режиме transaction: соединение с сервером меняется между транзакциями →
+        # без кэша prepared statements и с уникальными именами, пул держит сам PgBouncer
+        return create_async_engine(
+            url,
+            echo=False,
+            poolclass=NullPool,
+            connect_args={
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            },
+        )
+
+    return create_async_engine(
+        url,
+        echo=False,
+        poolclass=MeteredQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE, # Переоткрываем соединения старше N секунд — не натыкаемся на закрытые сервером/балансировщиком
+        pool_pre_ping=settings.DB_POOL_PRE_PING, # SELECT 1 при каждой выдаче соединения | Выключено — полагаемся на pool_recycle
+        pool_use_lifo=True, # Лишние соединения простаивают и закрываются по recycle
+        connect_args={"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+    )
+
 
 # 🚀 Создаём асинхронный движок
-engine =create_async_engine(
-    SQLALCHEMY_DATABASE_URL,
-    echo=False,
-    pool_pre_ping=True,
-)
+engine = _make_engine(SQLALCHEMY_DATABASE_URL, settings.DB_PGBOUNCER)
+
+# Движок для сессионных advisory-локов | Без PgBouncer это тот же engine
+direct_engine = engine if SQLALCHEMY_DIRECT_URL == SQLALCHEMY_DATABASE_URL else _make_engine(SQLALCHEMY_DIRECT_URL, pgbouncer=False)
+
+
+# 📚 Реплики для чтения (SQLALCHEMY_REPLICA_URLS через запятую) | Выбираются по кругу, без реплик читаем с primary
+replica_engines = [
+    _make_engine(url.strip(), settings.DB_PGBOUNCER).execution_options(postgresql_readonly=True)
+    for url in settings.SQLALCHEMY_REPLICA_URLS.split(",") if url.strip()
+]
+_replica_cycle = itertools.cycle(replica_engines)
+
+# Read-your-writes: после записи пользователь какое-то время читает с primary (cookie ставит middleware в main.py)
+READ_YOUR_WRITES_COOKIE = "db_primary_until"
+
+
+def wrote_recently(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def get_pool_stats() -> dict:
+    # Для /metrics
+    stats = _engine_pool_stats(engine)
+    if replica_engines:
+        stats["replicas"] = [_engine_pool_stats(replica) for replica in replica_engines]
+    return stats
+
+
+def _engine_pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.pool
+    if not isinstance(pool, MeteredQueuePool):
+        return {"pool": pool.status()} # NullPool (PgBouncer) — пул держит PgBouncer
+
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        **pool.stats,
+        "wait_seconds_avg": pool.stats["wait_seconds_total"] / pool.stats["checkouts"] if pool.stats["checkouts"] else 0.0,
+    }
 
 # 🎭 Фабрика асинхронных сессий
 async_session =async_sessionmaker(
@@ -26,18 +130,101 @@ async_session =async_sessionmaker(
     autocommit=False
 )
 
+# 📖 Сессии только для чтения: транзакция открывается как BEGIN READ ONLY (без лишнего запроса), commit не нужен
+read_engine = engine.execution_options(postgresql_readonly=True)
+async_read_session = async_sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autoflush=False,
+    autocommit=False
+)
+
 # 🏗️ Базовый класс для моделей
 class Base(DeclarativeBase):
     pass
 
-#Асинхронная функция для получения сессии БД
-async def get_db() -> AsyncSession:
-    async with async_session() as session:
+
+# CRUD-методы делают только flush — отмечаем в session.info, что в транзакции есть изменения
+@event.listens_for(Session, "after_flush")
+def _mark_flush(session, flush_context):
+    session.info["has_writes"] = True
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_dml(orm_execute_state):
+    # UPDATE / INSERT / DELETE через db.execute (например, списание токенов) flush не вызывают
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["has_writes"] = True
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # Запрос что-то записал → middleware переключит пользователя на primary для следующих чтений
+    request_state = session.info.get("request_state")
+    if request_state is not None and session.info.get("has_writes"):
+        request_state.db_written = True
+    session.info.pop("has_writes", None)
+
+@event.listens_for(Session, "after_rollback")
+def _reset_writes(session):
+    session.info.pop("has_writes", None)
+
+
+def has_pending_writes(session: AsyncSession) -> bool:
+    return bool(session.info.get("has_writes") or session.new or session.dirty or session.deleted)
+
+
+#Асинхронная функция для получения сессии БД (unit of work)
+# Обработчик может закоммитить сам (перед редиректом, перед долгим запросом к LLM) | Здесь commit только если что-то осталось
+# Только чтение → ни одного commit
+async def get_db(request: Request) -> AsyncSession:
+    async with async_session(info={"request_state": request.state}) as session:
         try:
             yield session
-            await session.commit()
+            if has_pending_writes(session):
+                await session.commit()
         except Exception:
             await session.rollback()
             raise
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+#Сессия только для чтения (страницы без изменений в БД) | Запись в ней БД отклонит
+# Реплика по кругу, если они настроены и пользователь недавно ничего не записывал | Иначе primary
+async def get_read_db(request: Request) -> AsyncSession:
+    bind = read_engine if not replica_engines or wrote_recently(request) else next(_replica_cycle)
+    async with async_read_session(bind=bind) as session:
+        yield session
+
+
+async def dispose_engines() -> None:
+    await engine.dispose()
+    if direct_engine is not engine:
+        await direct_engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
+
+# Миграции схемы (alembic, папка migrations/) | Синхронная функция — из приложения вызывается через asyncio.to_thread
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _alembic_config():
+    from alembic.config import Config
+
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "migrations")) # Приложение может стартовать не из папки backend
+    config.attributes["configure_logger"] = False
+    config.attributes["database_url"] = SQLALCHEMY_DIRECT_URL # Advisory-лок миграций не переживёт PgBouncer в режиме transaction
+    return config
+
+def upgrade_database(revision: str = "head") -> None:
+    from alembic import command
+    command.upgrade(_alembic_config(), revision)
+
+# Схема БД совпадает с моделями (применены все миграции)? | Иначе любой SELECT по новым колонкам падает уже на запросах пользователей
+async def get_schema_revisions() -> tuple:
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    head = ScriptDirectory.from_config(_alembic_config()).get_current_head()
+    async with direct_engine.connect() as conn:
+        current = await conn.run_sync(lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision())
+    return current, head
\ No newline at end of file
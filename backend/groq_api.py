@@ -1,14 +1,15 @@
-from groq import AsyncGroq
-from config import settings
+from typing import Optional, List
 
-client = AsyncGroq(api_key=settings.GROQ_API_KEY)
+from llm_router import router
 
-async def groq_ai_answer(text: str) -> str:
-    response =await client.chat.completions.create(
-        model='moonshotai/kimi-k2-instruct',
-        messages=[{'role': 'user', 'content': text}],
-        temperature=0.6,
-        max_tokens=1000
-    )
+# Запросы к LLM идут через llm_router: выбор провайдера/модели по роли и задержкам, шлюз с лимитами и повторами
 
-    return response.choices[0].message.content # ← ВОЗВРАЩАЕМ ОТВЕТ
\ No newline at end of file
+async def groq_ai_answer(text: str, history: Optional[List[dict]] = None, role: str = "answer") -> str:
+    # history — предыдущие сообщения чата в формате [{'role': ..., 'content': ...}] (см. context_builder)
+    # role — "answer" (ответ пользователю), "classifier" (короткий вердикт, может идти на модель поменьше) или "summary" (фоновое сжатие истории)
+    return await router.complete(role, [*(history or []), {'role': 'user', 'content': text}]) # ← ВОЗВРАЩАЕМ ОТВЕТ
+
+async def groq_ai_stream(text: str, history: Optional[List[dict]] = None, role: str = "answer"):
+    # Тот же запрос, но ответ приходит по кусочкам (stream=True) | Отдаём текст каждого чанка сразу
+    async for chunk in router.stream(role, [*(history or []), {'role': 'user', 'content': text}]):
+        yield chunk
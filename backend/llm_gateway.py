@@ -0,0 +1,186 @@
+# Шлюз к LLM: ограничение параллельных запросов на воркер, повторы с джиттером в пределах дедлайна, circuit breaker
+# Свой шлюз (breaker, повторы, статистика) у каждого провайдера/модели, слоты — общие на роль в воркере (см. llm_router)
+# Если провайдер лежит — не копим зависшие запросы, а сразу отвечаем пользователю (LLMUnavailable)
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import groq
+import httpx
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, stop_after_delay, wait_random_exponential
+
+T = TypeVar("T")
+
+# Временные ошибки — их имеет смысл повторить | 4xx (кроме 429) повтор не исправит
+RETRYABLE_ERRORS = (
+    groq.APIConnectionError, # включает APITimeoutError
+    groq.RateLimitError,
+    groq.InternalServerError,
+    httpx.TransportError, # OpenAI-совместимые провайдеры (llm_router) — соединение, таймауты
+    asyncio.TimeoutError,
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class LLMUnavailable(Exception):
+    # Отказ без обращения к провайдеру: цепь разомкнута или очередь не дождалась свободного слота
+    pass
+
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+
+# Всё, чем может закончиться запрос к LLM (кроме багов в нашем коде) — для обработчиков, которым нужен запасной вариант
+LLM_ERRORS = (LLMUnavailable, groq.APIError, httpx.HTTPError, asyncio.TimeoutError)
+
+
+class CircuitBreaker:
+    # closed → (failure_threshold ошибок подряд) → open → (reset_timeout секунд) → half_open: один пробный запрос
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        # Пробный запрос отменён (не успех и не ошибка) — следующий запрос сможет стать пробным
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"⚠️ LLM circuit breaker: разомкнут после {self.failures} ошибок")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int, deadline: float, max_attempts: int, breaker: CircuitBreaker, semaphore: Optional[asyncio.Semaphore] = None):
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline # Общий бюджет на запрос: ожидание слота + все попытки + паузы между ними
+        self.max_attempts = max_attempts
+        self.breaker = breaker
+        self._semaphore = semaphore or asyncio.Semaphore(max_concurrency) # Общий семафор → лимит на все шлюзы, которые его делят
+        self._stats = {"in_flight": 0, "waiting": 0, "max_waiting": 0, "calls": 0, "failures": 0, "retries": 0, "rejected": 0}
+
+    @asynccontextmanager
+    async def _slot(self, deadline: float):
+        # Ждём свободный слот не дольше оставшегося дедлайна | waiting — глубина очереди для /metrics
+        self._stats["waiting"] += 1
+        self._stats["max_waiting"] = max(self._stats["max_waiting"], self._stats["waiting"])
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self._stats["rejected"] += 1
+            raise LLMUnavailable("LLM queue is full")
+        finally:
+            self._stats["waiting"] -= 1
+
+        self._stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            self._stats["in_flight"] -= 1
+            self._semaphore.release()
+
+    def _check_circuit(self) -> None:
+        if not self.breaker.allow():
+            self._stats["rejected"] += 1
+            raise CircuitOpenError("LLM circuit is open")
+
+    def _retrying(self) -> AsyncRetrying:
+        return AsyncRetrying(
+            stop=stop_after_attempt(self.max_attempts) | stop_after_delay(self.deadline),
+            wait=wait_random_exponential(multiplier=0.5, max=4), # Полный джиттер — воркеры не повторяют синхронно
+            retry=retry_if_exception(is_retryable),
+            before_sleep=lambda state: self._count_retry(),
+            reraise=True,
+        )
+
+    def _count_retry(self) -> None:
+        self._stats["retries"] += 1
+
+    async def call(self, request: Callable[[], Awaitable[T]]) -> T:
+        # request — фабрика корутины: на каждую попытку создаётся новый запрос
+        self._check_circuit()
+        self._stats["calls"] += 1
+        deadline = time.monotonic() + self.deadline
+        succeeded = None
+        try:
+            async for attempt in self._retrying():
+                with attempt:
+                    async with self._slot(deadline): # Слот держим только на время запроса, не на паузу между попытками
+                        result = await asyncio.wait_for(request(), timeout=max(deadline - time.monotonic(), 0))
+            succeeded = True
+            return result
+        except LLMUnavailable:
+            raise
+        except Exception:
+            succeeded = False
+            self._stats["failures"] += 1
+            raise
+        finally:
+            self._record(succeeded)
+
+    async def stream(self, open_stream: Callable[[], Awaitable]):
+        # Потоковый ответ: слот занят на всё время стрима | Повторяем только открытие стрима — после первого чанка повтор уже невозможен
+        self._check_circuit()
+        self._stats["calls"] += 1
+        deadline = time.monotonic() + self.deadline
+        succeeded = None
+        try:
+            async with self._slot(deadline):
+                async for attempt in self._retrying():
+                    with attempt:
+                        stream = await asyncio.wait_for(open_stream(), timeout=max(deadline - time.monotonic(), 0))
+                async for chunk in stream:
+                    yield chunk
+            succeeded = True
+        except LLMUnavailable:
+            raise
+        except Exception:
+            succeeded = False
+            self._stats["failures"] += 1
+            raise
+        finally:
+            self._record(succeeded)
+
+    def _record(self, succeeded: Optional[bool]) -> None:
+        # None — запрос отменён (классификатор сказал NO, клиент ушёл) или не дождался слота: провайдер тут ни при чём
+        if succeeded is True:
+            self.breaker.record_success()
+        elif succeeded is False:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_probe()
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "max_concurrency": self.max_concurrency, "circuit": self.breaker.state}
+
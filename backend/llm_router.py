@@ -0,0 +1,284 @@
+# Реестр LLM-провайдеров и выбор модели под задачу
+# Провайдеры: Groq + любые OpenAI-совместимые API (через httpx). Для каждой пары провайдер/модель считаем
+# скользящие p50/p95 задержки и долю ошибок; запрос уходит к самой быстрой здоровой, при ошибке — к следующей.
+# Роли: answer — ответ пользователю, classifier — короткий вердикт YES/NO (можно отдать модели поменьше и побыстрее),
+# summary — фоновое сжатие истории (свои слоты и статистика, не мешает ответам)
+import asyncio
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+from groq import AsyncGroq
+
+from config import settings
+from llm_gateway import LLMGateway, CircuitBreaker, LLMUnavailable
+
+# Параметры генерации для каждой роли
+ROLE_PARAMS = {
+    "answer": {"temperature": 0.6, "max_tokens": 1000},
+    "classifier": {"temperature": 0.0, "max_tokens": 5}, # Ответ — одно слово
+    "summary": {"temperature": 0.3, "max_tokens": 600}, # До 250 слов
+}
+
+
+class GroqProvider:
+    def __init__(self, name: str, api_key: str, base_url: Optional[str]):
+        self.name = name
+        # Повторы и таймауты — в llm_gateway, у SDK свои повторы отключены
+        self.client = AsyncGroq(api_key=api_key, base_url=base_url, timeout=settings.LLM_TIMEOUT, max_retries=0)
+
+    async def complete(self, model: str, messages: List[dict], **params) -> str:
+        response = await self.client.chat.completions.create(model=model, messages=messages, **params)
+        return response.choices[0].message.content
+
+    async def open_stream(self, model: str, messages: List[dict], **params) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+        return self._iter_text(stream)
+
+    @staticmethod
+    async def _iter_text(stream):
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def close(self):
+        await self.client.close()
+
+
+class OpenAICompatibleProvider:
+    # Любой сервер с POST {base_url}/chat/completions в формате OpenAI (vLLM, Ollama, OpenRouter, локальный стаб)
+    def __init__(self, name: str, base_url: str, api_key: str = ""):
+        self.name = name
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(base_url=base_url.rstrip("/"), headers=headers, timeout=settings.LLM_TIMEOUT)
+
+    async def complete(self, model: str, messages: List[dict], **params) -> str:
+        response = await self.client.post("/chat/completions", json={"model": model, "messages": messages, **params})
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def open_stream(self, model: str, messages: List[dict], **params) -> AsyncIterator[str]:
+        # Ошибка соединения / статуса — здесь, до первого чанка (шлюз может повторить), дальше только чтение
+        request = self.client.build_request("POST", "/chat/completions", json={"model": model, "messages": messages, "stream": True, **params})
+        response = await self.client.send(request, stream=True)
+        if response.is_error:
+            await response.aread()
+            await response.aclose()
+            response.raise_for_status()
+        return self._iter_text(response)
+
+    @staticmethod
+    async def _iter_text(response: httpx.Response):
+        # Server-Sent Events: строки "data: {...}", конец — "data: [DONE]"
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                content = choices[0].get("delta", {}).get("content") if choices else None
+                if content:
+                    yield content
+        finally:
+            await response.aclose()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class RollingStats:
+    # Задержки и ошибки за последние window секунд | Старые данные выпадают → медленный провайдер со временем пробуется снова
+    def __init__(self, window: float):
+        self.window = window
+        self._samples = deque() # (время, задержка, успех)
+
+    def record(self, latency: float, ok: bool) -> None:
+        self._samples.append((time.monotonic(), latency, ok))
+        self._prune()
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def snapshot(self) -> dict:
+        self._prune()
+        latencies = sorted(latency for _, latency, ok in self._samples if ok)
+        errors = sum(1 for _, _, ok in self._samples if not ok)
+        total = len(self._samples)
+        return {
+            "samples": total,
+            "p50": _percentile(latencies, 0.50),
+            "p95": _percentile(latencies, 0.95),
+            "error_rate": errors / total if total else 0.0,
+        }
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class Target:
+    # Конкретная модель у конкретного провайдера для конкретной роли + свой шлюз (лимит, повторы, breaker) и своя статистика
+    # Та же модель в другой роли — отдельный Target: короткие вердикты классификатора не смешиваются с задержками ответов и не занимают их слоты
+    def __init__(self, provider, model: str, role: str, semaphore: asyncio.Semaphore):
+        self.provider = provider
+        self.model = model
+        self.role = role
+        self.name = f"{role}:{provider.name}:{model}"
+        self.gateway = LLMGateway(
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            deadline=settings.LLM_DEADLINE,
+            max_attempts=settings.LLM_MAX_ATTEMPTS,
+            breaker=CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET),
+            semaphore=semaphore, # Общий для всех моделей роли: переключение на запасного провайдера не удваивает лимит
+        )
+        self.latency = RollingStats(settings.LLM_STATS_WINDOW) # Полный ответ
+        self.first_token = RollingStats(settings.LLM_STATS_WINDOW) # Стрим: время до первого токена
+        self.streams = RollingStats(settings.LLM_STATS_WINDOW) # Стрим целиком: дошёл до конца или оборвался (до или после первого токена)
+
+    def is_healthy(self) -> bool:
+        if self.gateway.breaker.state == "open":
+            return False
+        # Ошибки полных ответов и стримов вместе — роль answer ходит в основном через стрим
+        completions, streams = self.latency.snapshot(), self.streams.snapshot()
+        samples = completions["samples"] + streams["samples"]
+        errors = completions["error_rate"] * completions["samples"] + streams["error_rate"] * streams["samples"]
+        return samples < settings.LLM_MIN_SAMPLES or errors / samples <= settings.LLM_MAX_ERROR_RATE
+
+    def rank(self, streaming: bool) -> tuple:
+        # Меньше — лучше: здоровые раньше, без статистики — раньше (нужно померить), дальше по p50
+        stats = (self.first_token if streaming else self.latency).snapshot()
+        measured = stats["samples"] >= settings.LLM_MIN_SAMPLES and stats["p50"] is not None
+        return (not self.is_healthy(), measured, stats["p50"] or 0.0)
+
+
+class LLMRouter:
+    def __init__(self):
+        self.providers: Dict[str, object] = {}
+        self.targets: Dict[str, Target] = {}
+        self.roles: Dict[str, List[Target]] = {}
+        # LLM_MAX_CONCURRENCY — на роль в воркере | Всего в воркере до (число ролей) × LLM_MAX_CONCURRENCY запросов
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def register_provider(self, provider) -> None:
+        self.providers[provider.name] = provider
+
+    def set_role(self, role: str, spec: str) -> None:
+        # spec: "provider:model,provider:model" — кандидаты для роли
+        candidates = []
+        for item in spec.split(","):
+            provider_name, _, model = item.strip().partition(":")
+            if provider_name not in self.providers or not model:
+                print(f"⚠️ LLM router: пропускаем неизвестный провайдер/модель '{item.strip()}' для роли {role}")
+                continue
+            key = f"{role}:{provider_name}:{model}"
+            if key not in self.targets:
+                semaphore = self.semaphores.setdefault(role, asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY))
+                self.targets[key] = Target(self.providers[provider_name], model, role, semaphore)
+            candidates.append(self.targets[key])
+        self.roles[role] = candidates
+
+    def _candidates(self, role: str, streaming: bool) -> List[Target]:
+        candidates = self.roles.get(role) or self.roles["answer"]
+        return sorted(candidates, key=lambda target: target.rank(streaming))
+
+    async def complete(self, role: str, messages: List[dict]) -> str:
+        params = ROLE_PARAMS.get(role, ROLE_PARAMS["answer"])
+        last_error: Exception = LLMUnavailable("No LLM targets configured")
+        for target in self._candidates(role, streaming=False):
+            started = time.perf_counter()
+            try:
+                reply = await target.gateway.call(lambda: target.provider.complete(target.model, messages, **params))
+            except LLMUnavailable as e:
+                last_error = e # Цепь разомкнута / очередь полна — к провайдеру не ходили, статистику не трогаем
+                continue
+            except Exception as e:
+                target.latency.record(time.perf_counter() - started, ok=False)
+                print(f"⚠️ LLM {target.name}: {e!r}, пробуем следующего провайдера")
+                last_error = e
+                continue
+            target.latency.record(time.perf_counter() - started, ok=True)
+            return reply
+        raise last_error
+
+    async def stream(self, role: str, messages: List[dict]) -> AsyncIterator[str]:
+        # Переключиться на другого провайдера можно только до первого токена
+        params = ROLE_PARAMS.get(role, ROLE_PARAMS["answer"])
+        last_error: Exception = LLMUnavailable("No LLM targets configured")
+        for target in self._candidates(role, streaming=True):
+            started = time.perf_counter()
+            chunks = target.gateway.stream(lambda: target.provider.open_stream(target.model, messages, **params))
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                target.first_token.record(time.perf_counter() - started, ok=True)
+                target.streams.record(time.perf_counter() - started, ok=True)
+                return
+            except LLMUnavailable as e:
+                last_error = e
+                continue
+            except Exception as e:
+                target.first_token.record(time.perf_counter() - started, ok=False)
+                target.streams.record(time.perf_counter() - started, ok=False)
+                print(f"⚠️ LLM {target.name}: {e!r}, пробуем следующего провайдера")
+                last_error = e
+                continue
+
+            target.first_token.record(time.perf_counter() - started, ok=True)
+            try:
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+            except Exception as e:
+                # Оборвался посреди ответа — переключиться уже нельзя, но здоровье провайдера это учитывает
+                # Отмена клиентом (CancelledError / GeneratorExit) — не Exception и ошибкой провайдера не считается
+                target.streams.record(time.perf_counter() - started, ok=False)
+                print(f"⚠️ LLM {target.name}: стрим оборвался: {e!r}")
+                raise
+            else:
+                target.streams.record(time.perf_counter() - started, ok=True)
+            finally:
+                await chunks.aclose()
+            return
+        raise last_error
+
+    def get_stats(self) -> dict:
+        return {
+            target.name: {
+                "latency": target.latency.snapshot(),
+                "first_token": target.first_token.snapshot(),
+                "streams": target.streams.snapshot(),
+                "healthy": target.is_healthy(),
+                **target.gateway.get_stats(),
+            }
+            for target in self.targets.values()
+        }
+
+    async def close(self) -> None:
+        for provider in self.providers.values():
+            await provider.close()
+
+
+def build_router() -> LLMRouter:
+    router = LLMRouter()
+    router.register_provider(GroqProvider("groq", settings.GROQ_API_KEY, settings.GROQ_BASE_URL or None))
+
+    # LLM_PROVIDERS — JSON-список OpenAI-совместимых провайдеров: [{"name": "local", "base_url": "http://localhost:8001/v1", "api_key": ""}]
+    if settings.LLM_PROVIDERS:
+        for item in json.loads(settings.LLM_PROVIDERS):
+            router.register_provider(OpenAICompatibleProvider(item["name"], item["base_url"], item.get("api_key", "")))
+
+    router.set_role("answer", settings.LLM_ANSWER_MODELS)
+    router.set_role("classifier", settings.LLM_CLASSIFIER_MODELS or settings.LLM_ANSWER_MODELS)
+    router.set_role("summary", settings.LLM_SUMMARY_MODELS or settings.LLM_ANSWER_MODELS)
+    return router
+
+
+router = build_router()
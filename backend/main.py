@@ -1,11 +1,16 @@
 # main.py
+import asyncio
+import json
 import os
+import secrets
+import time
 from contextlib import asynccontextmanager
+from datetime import datetime
 
-from redis.asyncio import Redis, RedisError
 import stripe
 from fastapi import FastAPI, Request, Form, Depends, HTTPException
 from fastapi.responses import RedirectResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, Dict
 from pydantic import ValidationError
@@ -13,14 +18,25 @@ from pydantic import ValidationError
 from dotenv import load_dotenv
 from config import settings # ← settings берёт значения уже из os.environ и занет все ключи
 
-from database import engine, get_db
-from models import Base  # Base уже с зарегистрированными моделями
-from crud import UserCRUD, UserCreateSchema, UserLoginSchema, ChatCRUD
+from database import get_db, get_read_db, has_pending_writes, upgrade_database, get_schema_revisions, get_pool_stats, dispose_engines, READ_YOUR_WRITES_COOKIE
+from models import User
+from crud import UserCRUD, UserCreateSchema, UserLoginSchema, ChatCRUD, StripeEventCRUD
 from auth import create_access_token, decode_token
-from billing import create_session_checkout, price_IDS, handle_webhook_event
-from utils import templates
+from billing import create_session_checkout, price_IDS, close_stripe_client, warm_price_catalogue
+from webhook_worker import webhook_workers
+from utils import templates, get_healthy_redis
+from redis_monitor import RedisHealthMonitor
+from rate_limiter import auth_limiter, login_limiter, login_account_limiter, login_identity, account_identity
 import message_handler
 import profile_handler
+import topic_classifier
+import verdict_cache
+import context_builder
+import user_cache
+from llm_router import router as llm_router
+from semantic_cache import semantic_cache
+import sidebar_cache
+from page_cache import page_cache
 
 load_dotenv()
 
@@ -28,51 +44,87 @@ load_dotenv()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("✅ Инициализация приложения")
-
-    # 1. Подключаемся к БД и создаем таблицы
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("✅ Таблицы созданы/проверены")
+    if os.getenv("FORWARDED_ALLOW_IPS", "").strip() == "*":
+        # uvicorn берёт тогда самый левый X-Forwarded-For, а его задаёт клиент → лимиты по IP обходятся подменой заголовка
+        print("⚠️ FORWARDED_ALLOW_IPS=* — IP клиента можно подделать, укажите адреса/подсеть прокси")
+
+    # 1. Схема БД: миграции — шаг деплоя (alembic upgrade head) | AUTO_MIGRATE=true — применяем сами (локальная разработка)
+    if settings.AUTO_MIGRATE:
+        await asyncio.to_thread(upgrade_database)
+        print("✅ Миграции БД применены")
+    else:
+        # Миграции запускаются при деплое — не стартуем на старой схеме (модели читают колонки, которых в ней ещё нет)
+        current, head = await get_schema_revisions()
+        if current != head:
+            raise RuntimeError(f"Схема БД на ревизии {current}, код ожидает {head}: выполните alembic upgrade head")
 
     # 2. Загружаем конфигурацию
+    if settings.CLASSIFIER_BACKEND in ("local", "hybrid") and topic_classifier.get_classifier():
+        print("✅ Локальный классификатор тематики обучен")
+
+    # Модель эмбеддингов для семантического кэша гостевых ответов (загрузка — в отдельном потоке)
+    if settings.SEMANTIC_CACHE_ENABLED and await semantic_cache.warm_up():
+        print("✅ Семантический кэш ответов готов")
+
+    # Прогреваем каталог цен Stripe, чтобы /profile не ходил в Stripe
+    try:
+        await warm_price_catalogue()
+        print("✅ Каталог цен Stripe загружен")
+    except Exception as e:
+        print(f"⚠️ Не удалось загрузить каталог цен Stripe: {e}")
+
+    # Воркеры очереди webhook-событий Stripe
+    webhook_workers.start()
+    print(f"✅ Запущено воркеров Stripe webhook: {settings.WEBHOOK_WORKERS}")
 
     # 3. Подключаемся к облачному Redis
     redis_url = os.getenv("REDIS_URL")
+    app.state.redis = None
+    app.state.redis_monitor = None
 
     if not redis_url:
         print("⚠️ ВНИМАНИЕ: Redis URL не найден! Инициализация без Redis.")
-        app.state.redis = None
     else:
-        try:
-            app.state.redis = Redis.from_url(
-                redis_url,
-                encoding="utf-8",
-                decode_responses=True,
-                socket_timeout=5,
-                socket_connect_timeout=5,
-                retry_on_timeout=True,
-                health_check_interval=30
-            )
-            await app.state.redis.ping() # проверяем коннект сразу
+        # Монитор проверяет коннект сразу и дальше в фоне | Если Redis сейчас недоступен — переподключится, когда он вернётся
+        app.state.redis_monitor = RedisHealthMonitor(app, redis_url, interval=settings.REDIS_HEALTH_INTERVAL)
+        if await app.state.redis_monitor.check():
             print("✅ Redis успешно подключен")
-        except RedisError as e:
-            print(f"⚠️ Не удалось подключиться к Redis: {e}")
-            app.state.redis = None
+        else:
+            print("⚠️ Не удалось подключиться к Redis, повторим в фоне")
+        app.state.redis_monitor.start()
+        user_cache.start_listener(app, retry_interval=settings.REDIS_HEALTH_INTERVAL) # Сбросы кэша пользователей от других процессов
 
 
     yield #Здесь приложение работает
 
     # Shutdown
     print("🛑 Очистка ресурсов...")
-    # 1. Закрываем Redis
-    if hasattr(app.state, 'redis') and app.state.redis is not None:
-        await app.state.redis.close()
+    # 1. Останавливаем мониторинг и закрываем Redis
+    if app.state.redis_monitor is not None:
+        await user_cache.stop_listener()
+        await app.state.redis_monitor.stop()
         print("Redis соединение закрыто")
-    # 2. Закрываем соединения с БД
+    # 2. Останавливаем воркеров webhook и закрываем пул соединений Stripe
+    await webhook_workers.stop()
+    await close_stripe_client()
+    await llm_router.close()
+    # 3. Закрываем соединения с БД
+    await dispose_engines()
 
     print("👋 Приложение остановлено...")
 
 app = FastAPI(lifespan=lifespan)
+# Сжимаем HTML/JSON (text/event-stream GZipMiddleware не трогает — стрим ответа ИИ идёт как раньше)
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE)
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    # Запрос закоммитил изменения → ближайшие READ_YOUR_WRITES_SECONDS читаем с primary, пока реплики догоняют
+    response = await call_next(request)
+    if getattr(request.state, "db_written", False):
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, value=str(time.time() + settings.READ_YOUR_WRITES_SECONDS), httponly=True, samesite='lax',
+                            secure=True, max_age=settings.READ_YOUR_WRITES_SECONDS)
+    return response
 
 async def auth_check(request: Request) -> Optional[Dict]: # auth_payload может быть либо словарем (dict), либо None
     token = request.cookies.get("access_token")
@@ -85,6 +137,18 @@ async def auth_check(request: Request) -> Optional[Dict]: # auth_payload мож
 
     return payload
 
+async def get_current_user(auth_payload: Optional[Dict] = Depends(auth_check), db: AsyncSession = Depends(get_db)) -> Optional[User]:
+    # Пользователь из токена — один раз на запрос (FastAPI кэширует зависимость), между запросами — из user_cache
+    if not auth_payload:
+        return None
+    return await user_cache.get_user(db, auth_payload["sub"])
+
+async def get_current_reader(auth_payload: Optional[Dict] = Depends(auth_check), db: AsyncSession = Depends(get_read_db)) -> Optional[User]:
+    # То же для страниц только на чтение — пользователь в той же read-only сессии, что и обработчик
+    if not auth_payload:
+        return None
+    return await user_cache.get_user(db, auth_payload["sub"])
+
 async def create_token(user_email: str, redirect_url: str = '/conversations'):
     access_token = create_access_token(data={'sub': user_email})
     response = RedirectResponse(url=redirect_url, status_code=303)
@@ -100,29 +164,34 @@ async def show_home(request: Request, auth_payload: Optional[Dict] = Depends(aut
         header_template = "partials/header_guest.html"
         content_template = "partials/promo.html"
 
-    return templates.TemplateResponse("home_page.html", {"request": request, "header_template": header_template, "content_template": content_template})
+    # Страница зависит только от шапки → готовый HTML из page_cache (+ 304 по ETag)
+    return page_cache.response(request, "home_page.html", {"header_template": header_template, "content_template": content_template})
 @app.get("/conversations")
-async def root(request: Request, active_chat_id: Optional[int] = None, auth_payload: Optional[Dict] = Depends(auth_check), db: AsyncSession = Depends(get_db)):
-    if auth_payload:
+async def root(request: Request, active_chat_id: Optional[int] = None, user_data: Optional[User] = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if user_data:
         header_template = "partials/header_user.html"
         content_template = "partials/user_chat.html"
 
-        user_email = auth_payload["sub"]
-        user_data = await UserCRUD.get_user_by_email(db, user_email)
-        all_conversations = await ChatCRUD.get_all_conversations(db, user_data.id) # Получаем все чаты пользователя
+        redis = get_healthy_redis(request)
 
-        if active_chat_id:
-            if await ChatCRUD.delete_conversation(db, active_chat_id, user_data.id):
-                active_conversation = await ChatCRUD.get_conversation_data(db, active_chat_id)
-                messages = await ChatCRUD.get_messages(db, active_chat_id)
-        else:
-                active_conversation = await ChatCRUD.get_or_create_conversation(db, user_data.id)
-                messages = await ChatCRUD.get_messages(db, active_conversation.id)
+        # ?active_chat_id= открывает указанный чат пользователя (чужой или несуществующий — как без параметра), ничего не удаляя
+        active_conversation = await ChatCRUD.get_conversation_data(db, active_chat_id, user_data.id) if active_chat_id else None
+        if active_conversation is None:
+            active_conversation = await ChatCRUD.get_or_create_conversation(db, user_data.id)
+        messages, has_more = await ChatCRUD.get_messages_page(db, active_conversation.id, settings.MESSAGES_PAGE_SIZE)
 
+        if has_pending_writes(db): # Первый чат пользователя создан только что
+            await db.commit()
+
+        # Первая страница чатов для сайдбара (после get_or_create — новый чат уже в списке) | Из кэша Redis, если есть
+        conversations, conversations_has_more, conversations_total = await sidebar_cache.get_sidebar(db, redis, user_data.id)
 
         return templates.TemplateResponse("main_page.html",{"request": request, "header_template": header_template, "content_template": content_template,
-                                                                "conversations": all_conversations, # ← передаем все чаты
-                                                                "messages":messages, # ← List сообщений с полями role и content активного чата
+                                                                "conversations": conversations, # ← первая страница чатов (id, title, updated_at)
+                                                                "conversations_has_more": conversations_has_more, # ← есть ли ещё чаты (кнопка "Load more")
+                                                                "conversations_total": conversations_total,
+                                                                "messages":messages, # ← List последних сообщений активного чата (поля id, role, content)
+                                                                "has_more": has_more, # ← есть ли более ранние сообщения (кнопка "Load earlier")
                                                                 "active_conversation_id": active_conversation.id
                                                                 })
 
@@ -140,22 +209,33 @@ async def show_pricing_page(request: Request, auth_payload: Optional[Dict] = Dep
         header_template = "partials/header_guest.html"
         content_template = "partials/pricing.html"
 
-    return templates.TemplateResponse("main_page.html", {"request": request, "header_template": header_template, "content_template": content_template})
+    return page_cache.response(request, "main_page.html", {"header_template": header_template, "content_template": content_template})
 
 @app.post("/guest/send")
 async def guest_send(request: Request, text: str = Form(...)):
     return await message_handler.free_conversation(request, text)
 @app.post("/send")
-async def send (request: Request, db: AsyncSession = Depends(get_db), text: str = Form(...), chat_id: int = Form(...), auth_payload: Optional[Dict] = Depends(auth_check)):
+async def send (request: Request, db: AsyncSession = Depends(get_db), text: str = Form(...), chat_id: int = Form(...), user_data: Optional[User] = Depends(get_current_user)):
     print("Отправка сообщения")
-    return await message_handler.user_conversation(request, db, chat_id, text, auth_payload)
+    return await message_handler.user_conversation(request, db, chat_id, text, user_data)
+
+@app.post("/send/stream") # То же, что /send, но ответ ИИ приходит по токенам через Server-Sent Events
+async def send_stream(request: Request, db: AsyncSession = Depends(get_db), text: str = Form(...), chat_id: int = Form(...), user_data: Optional[User] = Depends(get_current_user)):
+    return await message_handler.user_conversation_stream(request, db, chat_id, text, user_data)
 
 @app.get("/login")
 async def show_login_page(request: Request):
-    return templates.TemplateResponse("login_page.html", {"request": request})
+    return page_cache.response(request, "login_page.html", {})
 
 @app.post("/login")
-async def login_user(request: Request, db: AsyncSession = Depends(get_db), email: str = Form(...), password: str = Form(...)):
+async def login_user(request: Request, db: AsyncSession = Depends(get_read_db), email: str = Form(...), password: str = Form(...)):
+    # 0. Защита от перебора паролей: лимит на пару email + IP (чужие попытки не блокируют вход остальным)
+    # и общий лимит на аккаунт — перебор одного пароля с тысяч адресов упирается в него | Попытки с уже заблокированного IP аккаунт не тратят
+    redis = get_healthy_redis(request)
+    if not (await login_limiter.hit(redis, login_identity(email, request.client.host))).allowed \
+            or not (await login_account_limiter.hit(redis, account_identity(email))).allowed:
+        return templates.TemplateResponse("login_page.html", {"request": request, "error_message": "Too many attempts. Please try again later."}, status_code=429)
+
     # 1. Пытаемся авторизоваться
     user = await UserCRUD.login_user(db, UserLoginSchema(email=email, password=password))
     if not user:
@@ -164,11 +244,16 @@ async def login_user(request: Request, db: AsyncSession = Depends(get_db), email
 
 @app.get("/register")
 async def show_register_page(request: Request):
-    return templates.TemplateResponse("register_page.html", {"request": request})
+    return page_cache.response(request, "register_page.html", {})
 
 @app.post("/register")
 async def register_user(request: Request, db: AsyncSession = Depends(get_db), email: str = Form(...), password: str = Form(...)):
     context = {"request": request, "email": email}
+    # 0. Защита от массовых регистраций
+    if not (await auth_limiter.hit(get_healthy_redis(request), request.client.host)).allowed:
+        context["error_message"] = "Too many attempts. Please try again later."
+        return templates.TemplateResponse("register_page.html", context, status_code=429)
+
     # 1. Валидация через Pydantic
     try:
        user_data = UserCreateSchema(email=email, password=password)
@@ -190,6 +275,7 @@ async def register_user(request: Request, db: AsyncSession = Depends(get_db), em
 
     #3. Создаём пользователя
     await UserCRUD.create_new_user(db, user_data)
+    await db.commit()
 
     return await create_token(user_email=email)
 
@@ -202,15 +288,13 @@ async def show_about_us(request: Request, auth_payload: Optional[Dict] = Depends
         header_template = "partials/header_guest.html"
         content_template = "partials/company_info.html"
 
-    return templates.TemplateResponse("contacts_page.html", {"request": request, "header_template": header_template, "content_template": content_template})
+    return page_cache.response(request, "contacts_page.html", {"header_template": header_template, "content_template": content_template})
 
 @app.get("/profile")
-async def show_profile_page(request: Request, auth_payload: Optional[Dict] = Depends(auth_check), db: AsyncSession = Depends(get_db)):
-    if not auth_payload:
+async def show_profile_page(request: Request, user_data: Optional[User] = Depends(get_current_reader), db: AsyncSession = Depends(get_read_db)):
+    if not user_data:
         return templates.TemplateResponse("login_page.html", {"request": request})
 
-    user_email = auth_payload["sub"]
-    user_data = await UserCRUD.get_user_by_email(db, user_email)
     profile_data = await profile_handler.get_profile_data(request, db, user_data)
 
     header_template = "partials/header_user.html"
@@ -220,15 +304,13 @@ async def show_profile_page(request: Request, auth_payload: Optional[Dict] = Dep
                                                             "profile_data": profile_data})
 
 @app.post("/profile/delete")
-async def delete_profile(request: Request, db: AsyncSession = Depends(get_db), auth_payload: Optional[Dict] = Depends(auth_check)):
-    if not auth_payload:
+async def delete_profile(request: Request, db: AsyncSession = Depends(get_db), user_data: Optional[User] = Depends(get_current_user)):
+    if not user_data:
         return templates.TemplateResponse("login_page.html", {"request": request})
 
-    user_email = auth_payload["sub"]
-    user_data = await UserCRUD.get_user_by_email(db, user_email)
-
     # Удаляем пользователя из базы
     await UserCRUD.delete_account(db, user_data)
+    await db.commit()
 
     response = templates.TemplateResponse("home_page.html", {"request": request, "header_template": "partials/header_guest.html",
                                                              "content_template": "partials/promo.html" })
@@ -236,15 +318,14 @@ async def delete_profile(request: Request, db: AsyncSession = Depends(get_db), a
     return response
 
 @app.post("/profile/change_password")
-async def change_user_password(request: Request, db: AsyncSession = Depends(get_db), auth_payload: Optional[Dict] = Depends(auth_check),new_password: str = Form(...)):
-    if not auth_payload:
+async def change_user_password(request: Request, db: AsyncSession = Depends(get_db), user_data: Optional[User] = Depends(get_current_user),new_password: str = Form(...)):
+    if not user_data:
         return templates.TemplateResponse("login_page.html", {"request": request})
 
-    user_email = auth_payload["sub"]
-    user_data = await UserCRUD.get_user_by_email(db, user_email)
     profile_data = await profile_handler.get_profile_data(request, db, user_data)
 
     await UserCRUD.change_password(db, user_data, new_password)
+    await db.commit()
 
     header_template = "partials/header_user.html"
     content_template = "partials/user_info.html"
@@ -267,39 +348,37 @@ async def logout(request: Request, auth_payload: Optional[Dict] = Depends(auth_c
 # =====================
 @app.get("/payments/success")
 async def show_payment_info(request: Request):
-    return templates.TemplateResponse("success_payment.html", {"request": request})
+    return page_cache.response(request, "success_payment.html", {})
 
 @app.get("/payments/failed")
 async def show_payment_info(request: Request):
-    return templates.TemplateResponse("failed_payment.html", {"request": request})
+    return page_cache.response(request, "failed_payment.html", {})
 
 # =====================
 @app.post("/conversations/new")
-async def create_new_conversation(request: Request,auth_payload: Optional[Dict] = Depends(auth_check), db: AsyncSession = Depends(get_db)):
-    if auth_payload is None:
+async def create_new_conversation(request: Request,user: Optional[User] = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if user is None:
         return RedirectResponse(url="/login", status_code=303)
 
-    user_email = auth_payload.get("sub")
-    user = await UserCRUD.get_user_by_email(db, user_email)
     new_conversation = await ChatCRUD.create_new_conversation(db, user.id)
+    await db.commit() # До редиректа — следующий запрос должен увидеть новый чат
+    await sidebar_cache.invalidate(get_healthy_redis(request), user.id)
 
     return RedirectResponse(url=f"/conversations?chat_id={new_conversation.id}", status_code=303)
 
 @app.post("/conversations/switch-chat")
-async def switch_chat(request: Request, chat_id: int = Form(...), db: AsyncSession = Depends(get_db), auth_payload: Optional[Dict] = Depends(auth_check)):
-    if not auth_payload:
+async def switch_chat(request: Request, chat_id: int = Form(...), db: AsyncSession = Depends(get_read_db), user_data: Optional[User] = Depends(get_current_reader)):
+    if not user_data:
         return RedirectResponse(url="/login", status_code=303)
 
-    user_email = auth_payload.get("sub")
-    user_data = await UserCRUD.get_user_by_email(db, user_email)
 
     # Проверяем, что чат принадлежит пользователю
     is_owner = await ChatCRUD.is_conversation_owner(db, chat_id, user_data.id)
     if not is_owner:
         return RedirectResponse(url="/conversations", status_code=303)
 
-    # Получаем сообщения выбранного чата
-    messages = await ChatCRUD.get_messages(db, chat_id)
+    # Получаем последнюю страницу сообщений выбранного чата
+    messages, has_more = await ChatCRUD.get_messages_page(db, chat_id, settings.MESSAGES_PAGE_SIZE)
 
     # Возвращаем ТОЛЬКО блок чата (не всю страницу!)
     return templates.TemplateResponse(
@@ -307,38 +386,79 @@ async def switch_chat(request: Request, chat_id: int = Form(...), db: AsyncSessi
         {
             "request": request,
             "messages": messages,
+            "has_more": has_more,
+            "active_conversation_id": chat_id
+        }
+    )
+
+@app.get("/conversations/{chat_id}/messages") # Более ранние сообщения по кнопке "Load earlier" (htmx)
+async def load_earlier_messages(request: Request, chat_id: int, before_id: int, db: AsyncSession = Depends(get_read_db), user_data: Optional[User] = Depends(get_current_reader)):
+    if not user_data:
+        return RedirectResponse(url="/login", status_code=303)
+
+    if not await ChatCRUD.is_conversation_owner(db, chat_id, user_data.id):
+        raise HTTPException(status_code=404, detail="Chat not found or access denied")
+
+    messages, has_more = await ChatCRUD.get_messages_page(db, chat_id, settings.MESSAGES_PAGE_SIZE, before_id=before_id)
+
+    return templates.TemplateResponse(
+        "partials/messages_page.html",
+        {
+            "request": request,
+            "messages": messages,
+            "has_more": has_more,
             "active_conversation_id": chat_id
         }
     )
 
+@app.get("/conversations/list") # Следующая страница чатов сайдбара по кнопке "Load more" (htmx)
+async def load_more_conversations(request: Request, before_updated_at: datetime, before_id: int, active_chat_id: Optional[int] = None,
+                                  db: AsyncSession = Depends(get_read_db), user_data: Optional[User] = Depends(get_current_reader)):
+    if not user_data:
+        return RedirectResponse(url="/login", status_code=303)
+
+    conversations, has_more = await ChatCRUD.list_conversations(db, user_data.id, settings.SIDEBAR_PAGE_SIZE, before=(before_updated_at, before_id))
+
+    return templates.TemplateResponse(
+        "partials/chat_list_page.html",
+        {
+            "request": request,
+            "conversations": conversations,
+            "conversations_has_more": has_more,
+            "active_conversation_id": active_chat_id
+        }
+    )
+
 @app.post("/conversations/delete")
-async def delete_conversation(request: Request, conversation_id: int = Form(...), db: AsyncSession = Depends(get_db), auth_payload: Optional[Dict] = Depends(auth_check)):
-    if not auth_payload:
+async def delete_conversation(request: Request, conversation_id: int = Form(...), db: AsyncSession = Depends(get_db), user: Optional[User] = Depends(get_current_user)):
+    if not user:
         return RedirectResponse(url="/login", status_code=303)
-    user = await UserCRUD.get_user_by_email(db, auth_payload.get("sub"))
     success = await ChatCRUD.delete_conversation(db, conversation_id, user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Chat not found or access denied")
+    await db.commit()
+    context_builder.forget(conversation_id)
+    await sidebar_cache.invalidate(get_healthy_redis(request), user.id)
 
     return RedirectResponse(url="/conversations", status_code=303)
 
 @app.post("/conversations/rename_conversation")
-async def rename_conversation(conversation_id: int = Form(...), new_name: str = Form(...), db: AsyncSession = Depends(get_db), auth_payload: Optional[Dict] = Depends(auth_check)):
-    if not auth_payload:
+async def rename_conversation(request: Request, conversation_id: int = Form(...), new_name: str = Form(...), db: AsyncSession = Depends(get_db), user: Optional[User] = Depends(get_current_user)):
+    if not user:
         return RedirectResponse(url="/login", status_code=303)
-    user = await UserCRUD.get_user_by_email(db, auth_payload.get("sub"))
     success = await ChatCRUD.rename_conversation(db, conversation_id, user.id, new_name)
     if not success:
         raise HTTPException(status_code=404, detail="Chat not found or access denied")
+    await db.commit()
+    await sidebar_cache.invalidate(get_healthy_redis(request), user.id)
 
     return RedirectResponse(url="/conversations", status_code=303)
 
 @app.post("/create-checkout-session")
-async def create_checkout(request: Request,db: AsyncSession = Depends(get_db), auth_payload: Optional[Dict] = Depends(auth_check), plan_type: str = Form("plan_type"), ):
-    if not auth_payload:
+async def create_checkout(request: Request,db: AsyncSession = Depends(get_db), user: Optional[User] = Depends(get_current_user), plan_type: str = Form("plan_type"), ):
+    if not user:
         return RedirectResponse(url="/login", status_code=303)
 
-    user = await UserCRUD.get_user_by_email(db, auth_payload["sub"])
     price_id = price_IDS.get(plan_type)
     if not price_id:
         raise HTTPException(404, "Invalid plan")
@@ -346,16 +466,39 @@ async def create_checkout(request: Request,db: AsyncSession = Depends(get_db), a
     checkout_url = await create_session_checkout(db, user, price_id)
     return RedirectResponse(checkout_url, status_code=303)
 
+async def require_metrics_token(request: Request):
+    # /metrics только для мониторинга: Authorization: Bearer <METRICS_TOKEN> | Без настроенного токена эндпоинта как будто нет
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(404)
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+        raise HTTPException(401, headers={"WWW-Authenticate": "Bearer"})
+
+@app.get("/metrics", dependencies=[Depends(require_metrics_token)]) # Внутренние счётчики производительности (кэши, очереди)
+async def show_metrics():
+    return {
+        "classifier_cache": verdict_cache.get_stats(),
+        "user_cache": user_cache.get_stats(),
+        "db_pool": get_pool_stats(),
+        "llm": llm_router.get_stats(),
+        "semantic_cache": semantic_cache.get_stats(),
+        "page_cache": page_cache.get_stats(),
+    }
+
 @app.post("/webhook/stripe") # Webhook для Stripe | единственный надёжный способ синхронизировать состояние подписки в Stripe с БД.
 async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_db)):
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, settings.STRIPE_WEBHOOK_SECRET)
+        stripe.Webhook.construct_event(payload, sig_header, settings.STRIPE_WEBHOOK_SECRET) # Только проверка подписи
     except:
         raise HTTPException(400)
 
-    await handle_webhook_event(event, db)
+    # Кладём событие в очередь (повтор того же event.id игнорируется) и сразу отвечаем Stripe 200
+    # Обработка — в webhook_workers, по порядку для каждого клиента
+    await StripeEventCRUD.enqueue(db, json.loads(payload))
+    await db.commit() # Воркер должен увидеть событие сразу после notify
+    webhook_workers.notify()
     return {"status": "ok"}
 
 
@@ -1,11 +1,51 @@
 from fastapi import Request
-from fastapi.responses import HTMLResponse
-from groq_api import groq_ai_answer
-from utils import get_redis, templates
+from fastapi.responses import HTMLResponse, StreamingResponse
+from groq_api import groq_ai_answer, groq_ai_stream
+from llm_gateway import LLM_ERRORS
+from semantic_cache import semantic_cache
+from utils import get_redis, get_healthy_redis, templates
 from crud import UserCRUD, ChatCRUD
 from question_control import is_psychology_related
+import context_builder
+import summarizer
+import sidebar_cache
+from config import settings
+from rate_limiter import guest_limiter, send_limiter
 
+import asyncio
 import hashlib
+import json
+
+OFF_TOPIC_REPLY = "Sorry, I specialize only in topics related to psychology, emotions, relationships, and personal growth. 😊 Tell me what's bothering or worrying you — I'm here to support you."
+
+RATE_LIMIT_REPLY = "You're sending messages a bit too fast. Take a breath — I'll be ready to continue in a moment. 🌿"
+
+LLM_UNAVAILABLE_REPLY = "I'm getting a lot of messages right now and need a short pause. Please try again in a minute — I'll be here. 🌿"
+
+
+async def get_ai_reply(text: str, redis=None, history=None) -> str:
+    # Обычный режим: сначала классификатор, потом генерация ответа (два запроса к LLM подряд)
+    if not settings.SPECULATIVE_CLASSIFICATION:
+        if not await is_psychology_related(text, redis):
+            return OFF_TOPIC_REPLY
+        return await groq_ai_answer(text, history)
+
+    # Спекулятивный режим: запускаем генерацию ответа одновременно с классификатором
+    answer_task = asyncio.create_task(groq_ai_answer(text, history))
+    answer_task.add_done_callback(lambda task: task.cancelled() or task.exception()) # Забираем исключение отменённой задачи, чтобы asyncio не ругался в лог
+
+    try:
+        is_related = await is_psychology_related(text, redis)
+    except BaseException:
+        answer_task.cancel()
+        raise
+
+    # Классификатор сказал NO → отменяем генерацию и возвращаем стандартный отказ
+    if not is_related:
+        answer_task.cancel()
+        return OFF_TOPIC_REPLY
+
+    return await answer_task
 
 # async def free_conversation(request: Request, text: str):
 #     message_count = int(request.cookies.get("guest_messages", "0"))  # Читаем cookie с счётчиком (по умолчанию 0)
@@ -36,25 +76,28 @@ async def free_conversation(request: Request, text: str):
     ua = request.headers.get("user-agent", "unknown") # Берём User-Agent — строку, которую браузер/приложение сообщает о себе.
     fingerprint = hashlib.sha256(f"{ip}:{ua}".encode()).hexdigest()[:16] # Создаём отпечаток из двух значений: IP + User-Agent | Превращаем в строку → кодируем в байты → считаем SHA-256| Берём только первые 16 символов хэша (64-битное значение)
 
-    redis_key = f"guest:msg_count:{fingerprint}" # Формируем ключ в Redis в пространстве имён, чтобы не засорять всё пространство ключей
-
-    count = await redis.get(redis_key)
-    count = int(count) if count else 0
-
-    if count >= 3:
+    # Проверка лимита, увеличение счётчика и TTL — атомарно, одним Lua-скриптом (параллельные запросы не проскочат)
+    limit = await guest_limiter.hit(redis, fingerprint)
+    if not limit.allowed:
         return HTMLResponse(""" <script>
                         var modal = new bootstrap.Modal(document.getElementById('guestLimitModal'));
                         modal.show();
                                 </script>  """)
-    # === ФИЛЬТР ===
-    if not await is_psychology_related(text):
-        reply = "Sorry, I specialize only in topics related to psychology, emotions, relationships, and personal growth. 😊 Tell me what's bothering or worrying you — I'm here to support you."
-    else:
-        reply = await groq_ai_answer(text)
+    # Похожий вопрос уже задавали → готовый ответ без LLM (у гостя нет истории, ответ зависит только от текста)
+    cached_reply, question_vector = await semantic_cache.get(text) if settings.SEMANTIC_CACHE_ENABLED else (None, None)
 
-    # Увеличиваем счётчик и ставим TTL = 5 минут | Если в течение таймера пользователь не пишет → ключ автоматически удаляется Redis-ом
-    await redis.incr(redis_key) # Атомарно увеличиваем значение счётчика на 1 (если ключа не существовало → создастся со значением 1)
-    await redis.expire(redis_key, 120) # Устанавливаем ключ на N секунд
+    # === ФИЛЬТР + ОТВЕТ ===
+    if cached_reply is not None:
+        reply = cached_reply
+    else:
+        try:
+            reply = await get_ai_reply(text, redis)
+        except LLM_ERRORS:
+            reply = LLM_UNAVAILABLE_REPLY # Все провайдеры перегружены, лежат или вернули ошибку — отвечаем сразу, без ожидания
+        else:
+            # Отказ не кэшируем: иначе близкий по смыслу вопрос по теме получит отказ без проверки классификатором
+            if reply != OFF_TOPIC_REPLY:
+                semantic_cache.put(question_vector, reply)
 
     response = templates.TemplateResponse(
         "message.html",
@@ -65,18 +108,15 @@ async def free_conversation(request: Request, text: str):
 
 
 
-async def user_conversation(request, db, chat_id, text, auth_payload):
-    # Проверка авторизации
-    if not auth_payload:
-        return templates.TemplateResponse("login_page.html", {"request": request})
-
-    # Получаем email из токена
-    user_email = auth_payload.get("sub")
-
-    # Находим пользователя по email
-    user = await UserCRUD.get_user_by_email(db, user_email)
+async def prepare_user_conversation(db, chat_id, user, redis=None):
+    # Общая подготовка для /send и /send/stream | Возвращает (ID чата, None) или (None, причина отказа: "login" / "rate_limit" / "tokens")
+    # Проверка авторизации (user уже найден зависимостью get_current_user)
     if not user:
-        return templates.TemplateResponse("login_page.html", {"request": request})
+        return None, "login"
+
+    # Защита от слишком частых сообщений (до списания токенов)
+    if not (await send_limiter.hit(redis, str(user.id))).allowed:
+        return None, "rate_limit"
 
     # Переменная для хранения ID чата
     conversation_id_to_use = None
@@ -98,32 +138,157 @@ async def user_conversation(request, db, chat_id, text, auth_payload):
     subscription = await UserCRUD.is_subscription_active(db, user)
 
     if not subscription:
-        user_email = auth_payload.get("sub")
-        if_conversation_possible = await UserCRUD.update_user_tokens(db, user_email)
+        if_conversation_possible = await UserCRUD.update_user_tokens(db, user)
         if not if_conversation_possible:
-            # Токены закончились → показываем модалку
-            return HTMLResponse("""
-                        <script>
-                            var modal = new bootstrap.Modal(document.getElementById('tokensEndedModal'));
-                            modal.show();
-                        </script>
-                    """)
+            return None, "tokens"
 
-    return await process_message(db, conversation_id_to_use, text, request)
+    return conversation_id_to_use, None
 
 
+async def refund_token(db, user) -> None:
+    # Ответа нет — токен, списанный в prepare_user_conversation, возвращаем (иначе каждый повтор при разомкнутой цепи стоит токен)
+    # Подписчикам токен не списывался
+    if user is not None and user.subscription_status != "active":
+        await UserCRUD.refund_user_token(db, user)
+        await db.commit()
 
-async def process_message(db, conversation_id, text, request):
-    # Сохраняем сообщение пользователя
-    await ChatCRUD.add_message(db=db, conversation_id=conversation_id, role="user", content=text)
 
-    # === ФИЛЬТР ===
-    if not await is_psychology_related(text):
-        reply = "Sorry, I specialize only in topics related to psychology, emotions, relationships, and personal growth. 😊 Tell me what's bothering or worrying you — I'm here to support you."
-    else:
-        reply = await groq_ai_answer(text)
+async def release_before_llm(db) -> None:
+    # Запрос к LLM идёт секунды — транзакцию (списание токена, новый чат или только чтения) завершаем заранее,
+    # чтобы соединение вернулось в пул, а не простаивало "idle in transaction" всё это время
+    # commit, а не rollback: expire_on_commit=False → загруженные объекты (user) остаются доступными
+    await db.commit()
+
+
+async def user_conversation(request, db, chat_id, text, user):
+    conversation_id, error = await prepare_user_conversation(db, chat_id, user, get_healthy_redis(request))
+
+    if error == "login":
+        return templates.TemplateResponse("login_page.html", {"request": request})
+    if error == "rate_limit":
+        return templates.TemplateResponse("message.html", {"request": request, "user_text": text, "ai_reply": RATE_LIMIT_REPLY})
+    if error == "tokens":
+        # Токены закончились → показываем модалку
+        return HTMLResponse("""
+                    <script>
+                        var modal = new bootstrap.Modal(document.getElementById('tokensEndedModal'));
+                        modal.show();
+                    </script>
+                """)
+
+    return await process_message(db, conversation_id, text, request, user)
+
+
+async def user_conversation_stream(request, db, chat_id, text, user):
+    conversation_id, error = await prepare_user_conversation(db, chat_id, user, get_healthy_redis(request))
+
+    if error == "login":
+        return StreamingResponse(iter([sse_event("redirect", "/login")]), media_type="text/event-stream")
+    if error == "rate_limit":
+        return StreamingResponse(iter([sse_event("error", RATE_LIMIT_REPLY)]), media_type="text/event-stream")
+    if error == "tokens":
+        return StreamingResponse(iter([sse_event("modal", "tokensEndedModal")]), media_type="text/event-stream")
+
+    # История чата в рамках бюджета токенов
+    history = await context_builder.build_context(db, conversation_id)
+    await release_before_llm(db) # get_db остаётся открытой до конца стрима, соединение — нет
+    request.state.db_written = True # Обмен коммитится уже после отправки заголовков → cookie read-your-writes ставим заранее
+
+    # Вопрос и ответ сохраняются вместе одной транзакцией в конце стрима (в той же сессии запроса, новое соединение берётся только на запись)
+    return StreamingResponse(
+        stream_message(db, conversation_id, text, get_healthy_redis(request), history, user),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Отключаем буферизацию в прокси, иначе токены придут пачкой
+    )
+
+
+async def process_message(db, conversation_id, text, request, user=None):
+    # История чата в рамках бюджета токенов (собирается до сохранения нового сообщения)
+    history = await context_builder.build_context(db, conversation_id)
+    await release_before_llm(db)
+
+    # === ФИЛЬТР + ОТВЕТ ===
+    try:
+        reply = await get_ai_reply(text, get_healthy_redis(request), history)
+    except LLM_ERRORS:
+        # Все провайдеры перегружены, лежат или вернули ошибку — отвечаем сразу, ничего не сохраняем и возвращаем токен
+        await refund_token(db, user)
+        return templates.TemplateResponse("message.html", {"request": request, "user_text": text, "ai_reply": LLM_UNAVAILABLE_REPLY})
+
+    # Сохраняем сообщение пользователя и ответ AI одной транзакцией
+    _, ai_message = await ChatCRUD.add_exchange(db=db, conversation_id=conversation_id, user_text=text, reply=reply)
+    await db.commit()
+    context_builder.remember_exchange(conversation_id, text, reply, ai_message.id)
+    summarizer.schedule(conversation_id) # Фоново сворачиваем старые сообщения в summary
+    if user is not None:
+        await sidebar_cache.invalidate(get_healthy_redis(request), user.id) # Чат поднимается наверх списка
+
+    return templates.TemplateResponse("message.html", {"request": request, "user_text": text, "ai_reply": reply})
+
+
+def sse_event(event: str, data: str) -> str:
+    # Формат Server-Sent Events | data кодируем в JSON, чтобы переносы строк не ломали поток
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _pump_stream(text: str, queue: asyncio.Queue, history=None):
+    # Читаем стрим Groq в очередь, чтобы он шёл параллельно с классификатором
+    try:
+        async for chunk in groq_ai_stream(text, history):
+            await queue.put(chunk)
+    except Exception as e:
+        await queue.put(e)
+    finally:
+        await queue.put(None)
+
+
+async def stream_ai_reply(text: str, redis=None, history=None):
+    # Потоковая версия get_ai_reply | Токены отдаются только после вердикта классификатора
+    if not settings.SPECULATIVE_CLASSIFICATION and not await is_psychology_related(text, redis):
+        yield OFF_TOPIC_REPLY
+        return
+
+    queue = asyncio.Queue()
+    pump_task = asyncio.create_task(_pump_stream(text, queue, history))
+    try:
+        # Спекулятивный режим: пока классификатор думает, первые токены уже копятся в очереди
+        if settings.SPECULATIVE_CLASSIFICATION and not await is_psychology_related(text, redis):
+            yield OFF_TOPIC_REPLY
+            return
+
+        while (chunk := await queue.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        pump_task.cancel()
+
+
+async def stream_message(db, conversation_id, text, redis, history=None, user=None):
+    reply_parts = []
+    try:
+        async for chunk in stream_ai_reply(text, redis, history):
+            reply_parts.append(chunk)
+            yield sse_event("token", chunk)
+    except LLM_ERRORS:
+        await refund_token(db, user) # Ответ не сохраняется — токен возвращаем
+        yield sse_event("error", LLM_UNAVAILABLE_REPLY)
+        return
+    except Exception as e:
+        print(f"Ошибка стрима ответа: {e}")
+        await refund_token(db, user)
+        yield sse_event("error", "Something went wrong, please try again in a moment.")
+        return
+
+    reply = "".join(reply_parts)
 
-    # Сохраняем сообщение AI
-    await ChatCRUD.add_message(db=db, conversation_id=conversation_id, role="assistant", content=reply)
+    # Сессия запроса живёт до конца стрима (FastAPI закрывает зависимость после ответа) | Соединение берётся только на эту транзакцию
+    _, ai_message = await ChatCRUD.add_exchange(db=db, conversation_id=conversation_id, user_text=text, reply=reply)
+    await db.commit()
+    context_builder.remember_exchange(conversation_id, text, reply, ai_message.id)
+    summarizer.schedule(conversation_id) # Фоново сворачиваем старые сообщения в summary
+    if user is not None:
+        await sidebar_cache.invalidate(redis, user.id) # Чат поднимается наверх списка
 
-    return templates.TemplateResponse("message.html", {"request": request, "user_text": text, "ai_reply": reply})
\ No newline at end of file
+    # Финальный HTML с уже отрендеренным markdown заменяет «сырой» текст в пузыре
+    yield sse_event("done", templates.env.filters["markdown"](reply))
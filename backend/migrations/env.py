@@ -0,0 +1,65 @@
+# Окружение alembic: асинхронный движок (asyncpg), метаданные моделей из models.py
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import SQLALCHEMY_DIRECT_URL
+from models import Base  # Base уже с зарегистрированными моделями
+
+config = context.config
+
+# При запуске из приложения (database.upgrade_database) логирование не перенастраиваем
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+# URL передаёт database.upgrade_database | При запуске через CLI — прямое подключение из настроек
+DATABASE_URL = config.attributes.get("database_url", SQLALCHEMY_DIRECT_URL)
+
+# Несколько процессов приложения стартуют одновременно → миграции выполняет только один, остальные ждут
+MIGRATION_LOCK_ID = 7_301_016
+
+
+def run_migrations_offline() -> None:
+    # alembic upgrade head --sql → SQL-скрипт без подключения к БД
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection) -> None:
+    connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+    connection.commit() # Лок сессионный — держится на соединении, миграции идут в своей транзакции
+    try:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+        connection.commit()
+
+
+async def run_async_migrations() -> None:
+    connectable = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await connectable.dispose()
+
+
+def run_migrations_online() -> None:
+    asyncio.run(run_async_migrations())
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
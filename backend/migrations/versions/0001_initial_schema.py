@@ -0,0 +1,75 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+Схема, которую раньше создавал Base.metadata.create_all при старте.
+Базы, созданные до появления миграций, уже содержат эти таблицы — их не трогаем.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_table(name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade() -> None:
+    if not _has_table('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('email', sa.String(length=255), nullable=False),
+            sa.Column('password', sa.String(length=255), nullable=False),
+            sa.Column('user_cash', sa.Float(), nullable=True),
+            sa.Column('stripe_customer_id', sa.String(length=255), nullable=True),
+            sa.Column('stripe_subscription_id', sa.String(length=255), nullable=True),
+            sa.Column('subscription_status', sa.String(length=50), nullable=True),
+            sa.Column('subscription_current_period_end', sa.DateTime(), nullable=True),
+            sa.Column('user_free_tokens', sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email', name='users_email_key'),
+            sa.UniqueConstraint('stripe_customer_id', name='users_stripe_customer_id_key'),
+            sa.UniqueConstraint('stripe_subscription_id', name='users_stripe_subscription_id_key'),
+        )
+        op.create_index('ix_users_id', 'users', ['id'])
+
+    if not _has_table('conversations'):
+        op.create_table(
+            'conversations',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(length=255), nullable=True),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_conversations_id', 'conversations', ['id'])
+
+    if not _has_table('messages'):
+        op.create_table(
+            'messages',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('role', sa.String(length=255), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('conversation_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_messages_id', 'messages', ['id'])
+
+
+def downgrade() -> None:
+    op.drop_table('messages')
+    op.drop_table('conversations')
+    op.drop_table('users')
@@ -0,0 +1,88 @@
+"""lookup indexes, summaries, stripe outbox
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:10:00
+
+Составные индексы под горячие запросы:
+  - сайдбар: WHERE user_id = ? ORDER BY updated_at DESC → (user_id, updated_at DESC)
+  - чат: WHERE conversation_id = ? ORDER BY id → (conversation_id, id)
+Плюс всё, что раньше добавлялось только через create_all: conversation_summaries,
+users.subscription_price_id, очередь stripe_events.
+Индексы на больших таблицах строятся CONCURRENTLY — без блокировки записи.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Базы, поднятые через create_all, уже могут содержать часть объектов → каждый шаг проверяем
+def _has_table(name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(name)
+
+def _has_column(table: str, column: str) -> bool:
+    return any(c['name'] == column for c in sa.inspect(op.get_bind()).get_columns(table))
+
+def _has_index(table: str, index: str) -> bool:
+    return any(i['name'] == index for i in sa.inspect(op.get_bind()).get_indexes(table))
+
+
+def upgrade() -> None:
+    # users: price_id тарифа | Поиск по email уже идёт по индексу уникального ограничения users_email_key
+    if not _has_column('users', 'subscription_price_id'):
+        op.add_column('users', sa.Column('subscription_price_id', sa.String(length=255), nullable=True))
+
+    if not _has_table('conversation_summaries'):
+        op.create_table(
+            'conversation_summaries',
+            sa.Column('conversation_id', sa.Integer(), nullable=False),
+            sa.Column('summary', sa.Text(), nullable=False),
+            sa.Column('last_message_id', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('conversation_id'),
+        )
+
+    if not _has_table('stripe_events'):
+        op.create_table(
+            'stripe_events',
+            sa.Column('id', sa.String(length=255), nullable=False),
+            sa.Column('type', sa.String(length=100), nullable=False),
+            sa.Column('customer_id', sa.String(length=255), nullable=False),
+            sa.Column('payload', sa.JSON(), nullable=False),
+            sa.Column('created', sa.BigInteger(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=True),
+            sa.Column('attempts', sa.Integer(), nullable=True),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('received_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+            sa.Column('processed_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_stripe_events_status_customer', 'stripe_events', ['status', 'customer_id', 'created', 'received_at'])
+
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        if not _has_index('conversations', 'ix_conversations_user_id_updated_at'):
+            op.create_index('ix_conversations_user_id_updated_at', 'conversations', ['user_id', sa.text('updated_at DESC')],
+                            postgresql_concurrently=True)
+        if not _has_index('messages', 'ix_messages_conversation_id_id'):
+            op.create_index('ix_messages_conversation_id_id', 'messages', ['conversation_id', 'id'],
+                            postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_conversation_id_id', table_name='messages', postgresql_concurrently=True)
+        op.drop_index('ix_conversations_user_id_updated_at', table_name='conversations', postgresql_concurrently=True)
+
+    op.drop_index('ix_stripe_events_status_customer', table_name='stripe_events')
+    op.drop_table('stripe_events')
+    op.drop_table('conversation_summaries')
+    op.drop_column('users', 'subscription_price_id')
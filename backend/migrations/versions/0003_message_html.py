@@ -0,0 +1,34 @@
+"""message html
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 15:40:00
+
+messages.html — готовый HTML-блок сообщения (markdown ответа ИИ уже применён).
+Заполняется при сохранении новых сообщений; у старых остаётся NULL и они
+рендерятся через partials/message_block.html, как раньше. Колонка nullable
+без default → ALTER TABLE без перезаписи таблицы.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    return any(c['name'] == column for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def upgrade() -> None:
+    if not _has_column('messages', 'html'):
+        op.add_column('messages', sa.Column('html', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'html')
@@ -0,0 +1,33 @@
+"""stripe event retry backoff
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 17:20:00
+
+stripe_events.next_attempt_at — время, раньше которого упавшее событие
+не берётся повторно (экспоненциальная пауза между попытками).
+NULL — событие можно брать сразу; nullable без default → без перезаписи таблицы.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    return any(c['name'] == column for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def upgrade() -> None:
+    if not _has_column('stripe_events', 'next_attempt_at'):
+        op.add_column('stripe_events', sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('stripe_events', 'next_attempt_at')
@@ -0,0 +1,42 @@
+"""sidebar index with id tiebreak
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 19:40:00
+
+Сайдбар сортирует по (updated_at DESC, id DESC) — id нужен keyset-пагинации как
+тайбрейк. Индекс (user_id, updated_at DESC) этот порядок не покрывал, и Postgres
+добавлял Sort поверх Bitmap Heap Scan → заменяем на (user_id, updated_at DESC, id DESC).
+Новый индекс строится CONCURRENTLY до удаления старого — сайдбар всё время на индексе.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_index(table: str, index: str) -> bool:
+    return any(i['name'] == index for i in sa.inspect(op.get_bind()).get_indexes(table))
+
+
+def upgrade() -> None:
+    # CREATE/DROP INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        if not _has_index('conversations', 'ix_conversations_user_id_updated_at_id'):
+            op.create_index('ix_conversations_user_id_updated_at_id', 'conversations',
+                            ['user_id', sa.text('updated_at DESC'), sa.text('id DESC')], postgresql_concurrently=True)
+        if _has_index('conversations', 'ix_conversations_user_id_updated_at'):
+            op.drop_index('ix_conversations_user_id_updated_at', table_name='conversations', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_conversations_user_id_updated_at', 'conversations', ['user_id', sa.text('updated_at DESC')],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_conversations_user_id_updated_at_id', table_name='conversations', postgresql_concurrently=True)
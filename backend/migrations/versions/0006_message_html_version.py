@@ -0,0 +1,34 @@
+"""message html version
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 21:10:00
+
+messages.html_version — версия рендера (utils.MESSAGE_HTML_VERSION), с которой
+сохранён messages.html. Строки с другой версией (в том числе NULL — HTML,
+отрендеренный до экранирования сырого HTML в markdown) при показе рендерятся
+заново из content. Колонка nullable без default → ALTER TABLE без перезаписи таблицы.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    return any(c['name'] == column for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def upgrade() -> None:
+    if not _has_column('messages', 'html_version'):
+        op.add_column('messages', sa.Column('html_version', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'html_version')
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Float, Text, func
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, ForeignKey, Float, Text, JSON, Index, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from database import Base
 
@@ -9,7 +9,7 @@ from database import Base
 class User(Base):
     __tablename__ = 'users'
     id:Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    email:Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    email:Mapped[str] = mapped_column(String(255), unique=True, nullable=False) # Уникальное ограничение users_email_key уже даёт индекс для поиска по email
     password:Mapped[str] = mapped_column(String(255), nullable=False)
     user_cash:Mapped[float] = mapped_column(Float, default=0.0)
     # Подписка на Stripe
@@ -17,6 +17,7 @@ class User(Base):
     stripe_subscription_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, unique=True) # ID активной подписки
     subscription_status: Mapped[str] = mapped_column(String(50),default="inactive")  # active, trialing, past_due, canceled и т.д.
     subscription_current_period_end: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    subscription_price_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True) # price_id текущего тарифа (из webhook)
     # Токены
     user_free_tokens:Mapped[float] = mapped_column(Integer, default=5)
     # Связь с чатами
@@ -32,12 +33,50 @@ class Conversation(Base):
     user_id:Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=False)
     user: Mapped[User] = relationship("User", back_populates="conversations")
     messages: Mapped[list["Message"]] = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    summary: Mapped[Optional["ConversationSummary"]] = relationship("ConversationSummary", back_populates="conversation", cascade="all, delete-orphan", uselist=False)
+
+# Сайдбар: чаты пользователя по убыванию (updated_at, id) → индекс-скан без сортировки | id — тайбрейк keyset-пагинации
+Index('ix_conversations_user_id_updated_at_id', Conversation.user_id, Conversation.updated_at.desc(), Conversation.id.desc())
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_conversation_id_id', 'conversation_id', 'id'), # Для keyset-пагинации и хвоста переписки
+    )
     id:Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     role:Mapped[str] = mapped_column(String(255), nullable=False) # "user" или "assistant"
     content:Mapped[str] = mapped_column(Text, nullable=False)
+    html: Mapped[Optional[str]] = mapped_column(Text, nullable=True) # Готовый HTML-блок сообщения (markdown уже применён) | Рендерится один раз при сохранении
+    html_version: Mapped[Optional[int]] = mapped_column(Integer, nullable=True) # utils.MESSAGE_HTML_VERSION на момент рендера | Другая версия → html не используется
     conversation_id: Mapped[int] = mapped_column(Integer, ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
     # Связи
-    conversation: Mapped[Conversation] = relationship("Conversation", back_populates="messages")
\ No newline at end of file
+    conversation: Mapped[Conversation] = relationship("Conversation", back_populates="messages")
+
+class ConversationSummary(Base):
+    # Скользящее краткое содержание длинного чата | Обновляется инкрементально в фоне (summarizer.py)
+    __tablename__ = 'conversation_summaries'
+    conversation_id: Mapped[int] = mapped_column(Integer, ForeignKey('conversations.id', ondelete='CASCADE'), primary_key=True)
+    summary: Mapped[str] = mapped_column(Text, nullable=False, default="")
+    last_message_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0) # ID последнего сообщения, уже вошедшего в summary
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+    # Связи
+    conversation: Mapped[Conversation] = relationship("Conversation", back_populates="summary")
+
+
+class StripeEvent(Base):
+    # Очередь (outbox) webhook-событий Stripe | id события — первичный ключ, повторная доставка не создаёт дубль
+    __tablename__ = 'stripe_events'
+    __table_args__ = (
+        Index('ix_stripe_events_status_customer', 'status', 'customer_id', 'created', 'received_at'), # Поиск следующего события по каждому клиенту
+    )
+    id: Mapped[str] = mapped_column(String(255), primary_key=True) # evt_...
+    type: Mapped[str] = mapped_column(String(100), nullable=False)
+    customer_id: Mapped[str] = mapped_column(String(255), nullable=False, default="") # События одного клиента обрабатываются строго по порядку
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    created: Mapped[int] = mapped_column(BigInteger, nullable=False) # Время создания события в Stripe (unix)
+    status: Mapped[str] = mapped_column(String(20), default="pending") # pending, done, failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    received_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True) # После ошибки — не раньше этого времени (UTC) | NULL — можно брать сразу
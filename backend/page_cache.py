@@ -0,0 +1,80 @@
+# Кэш отрендеренных "статичных" страниц (/, /pricing, /about_us, /login, /register, /payments/*)
+# HTML таких страниц зависит только от шаблонов и от того, гость это или пользователь (header_template) →
+# каждый вариант рендерится один раз на процесс и дальше отдаётся готовыми байтами.
+# Браузеру отдаём ETag + Last-Modified: повторный заход с If-None-Match / If-Modified-Since получает 304 без тела.
+import hashlib
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from utils import templates
+
+
+class CachedPage:
+    __slots__ = ("body", "etag", "last_modified", "last_modified_header")
+
+    def __init__(self, body: bytes, last_modified: float):
+        self.body = body
+        # Слабый ETag: GZipMiddleware меняет байты ответа, но смысл страницы тот же
+        self.etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+        self.last_modified = int(last_modified) # HTTP-дата с точностью до секунды
+        self.last_modified_header = formatdate(self.last_modified, usegmt=True)
+
+
+class PageCache:
+    def __init__(self):
+        self._pages: Dict[Tuple, CachedPage] = {} # (шаблон, контекст) → готовая страница | Вариантов единицы, TTL не нужен
+        self._stats = {"hits": 0, "renders": 0, "not_modified": 0}
+
+    def _get_page(self, template_name: str, context: dict) -> CachedPage:
+        key = (template_name, tuple(sorted(context.items())))
+        page = self._pages.get(key)
+        if page is None:
+            self._stats["renders"] += 1
+            body = templates.get_template(template_name).render(context).encode("utf-8")
+            page = self._pages[key] = CachedPage(body, time.time())
+        else:
+            self._stats["hits"] += 1
+        return page
+
+    @staticmethod
+    def _not_modified(request: Request, page: CachedPage) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # If-None-Match главнее If-Modified-Since | Сравнение слабое: W/"x" == "x"
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or page.etag.removeprefix("W/") in tags
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= page.last_modified
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def response(self, request: Request, template_name: str, context: dict) -> Response:
+        # context — только строки, от которых зависит страница (request в шаблонах не используется)
+        page = self._get_page(template_name, context)
+        headers = {
+            "ETag": page.etag,
+            "Last-Modified": page.last_modified_header,
+            "Cache-Control": "no-cache", # Браузер хранит копию, но каждый раз сверяет её с сервером (дёшево — 304)
+            "Vary": "Cookie", # Гость и пользователь получают разные шапки по одному URL
+        }
+        if self._not_modified(request, page):
+            self._stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=page.body, media_type="text/html", headers=headers)
+
+    def clear(self) -> None:
+        self._pages.clear()
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "pages": len(self._pages)}
+
+
+page_cache = PageCache()
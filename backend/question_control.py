@@ -1,7 +1,51 @@
+import time
+from typing import Optional
+
+from redis.asyncio import Redis
 
 from groq_api import groq_ai_answer
+from llm_gateway import LLM_ERRORS
+from config import settings
+import topic_classifier
+import verdict_cache
+
+async def is_psychology_related(query: str, redis: Optional[Redis] = None) -> bool:
+    # 1. Горячие фразы ("привет", "спасибо", "пока") отвечаем из памяти процесса
+    cached = verdict_cache.get_local(query)
+    if cached is not None:
+        return cached
+
+    backend = settings.CLASSIFIER_BACKEND
+
+    # 2. Локальная модель (доли миллисекунды), LLM — только если модель не уверена (порог калибруется при обучении)
+    local_verdict = None
+    if backend in ("local", "hybrid"):
+        local_verdict = topic_classifier.classify(query)
+        if local_verdict is not None:
+            is_related, confidence, is_confident = local_verdict
+            if backend == "local" or is_confident:
+                verdict_cache.set_local(query, is_related)
+                return is_related
+
+    # 3. Общий кэш в Redis
+    cached = await verdict_cache.get_remote(redis, query)
+    if cached is not None:
+        return cached
+
+    # 4. Запрос к LLM
+    started = time.perf_counter()
+    is_related = await llm_is_psychology_related(query)
+    verdict_cache.record_llm_call(time.perf_counter() - started)
+
+    if is_related is None:
+        return True # Ошибку не кэшируем и пропускаем сообщение
+
+    await verdict_cache.set_remote(redis, query, is_related)
+    if local_verdict is not None:
+        await topic_classifier.record_label(query, is_related) # Модель сомневалась → вердикт LLM станет примером для дообучения
+    return is_related
 
-async def is_psychology_related(query: str) -> bool:
+async def llm_is_psychology_related(query: str) -> Optional[bool]:
     classification_prompt = f"""
     You are a classifier for a psychological support chatbot. 
     Your task is to determine if the user's message is appropriate for conversation with this bot.
@@ -50,8 +94,8 @@ async def is_psychology_related(query: str) -> bool:
     The answer (YES or NO):
     """
     try:
-        responce = await groq_ai_answer(classification_prompt.strip())
+        responce = await groq_ai_answer(classification_prompt.strip(), role="classifier")
         return responce.strip().upper() == "YES"
-    except:
-        print("Ошибка Запроса")
-        return True
\ No newline at end of file
+    except LLM_ERRORS as e:
+        print(f"Ошибка Запроса: {e!r}")
+        return None
\ No newline at end of file
@@ -0,0 +1,109 @@
+# Атомарный rate limiter на Redis: проверка + увеличение + TTL одним Lua-скриптом (один round-trip)
+# Политики: sliding_window (не больше limit запросов за window секунд) и token_bucket (limit токенов, пополняются за window секунд)
+import hashlib
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from redis.asyncio import Redis, RedisError
+
+from config import settings
+
+# Скользящее окно на ZSET: храним время каждого запроса, старые удаляем
+SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local window_ms = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local member = ARGV[3]
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window_ms)
+local count = redis.call('ZCARD', key)
+if count >= limit then
+    return {0, 0}
+end
+redis.call('ZADD', key, now, member)
+redis.call('PEXPIRE', key, window_ms)
+return {1, limit - count - 1}
+"""
+
+# Token bucket на HASH: запас токенов + время последнего пополнения
+TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local window_ms = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = capacity / window_ms
+
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', key, window_ms)
+return {allowed, math.floor(tokens)}
+"""
+
+_SCRIPTS = {"sliding_window": SLIDING_WINDOW_LUA, "token_bucket": TOKEN_BUCKET_LUA}
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    remaining: int
+
+
+class RateLimiter:
+    def __init__(self, name: str, policy: str, limit: int, window_seconds: int, fail_open: bool = True):
+        if policy not in _SCRIPTS:
+            raise ValueError(f"Unknown rate limit policy: {policy}")
+        self.name = name
+        self.policy = policy
+        self.limit = limit
+        self.window_ms = window_seconds * 1000
+        self.fail_open = fail_open # Если Redis недоступен — пропускаем (True) или блокируем (False)
+
+    async def hit(self, redis: Optional[Redis], identity: str) -> RateLimitResult:
+        if redis is None:
+            return RateLimitResult(self.fail_open, 0)
+
+        key = f"ratelimit:{self.name}:{identity}"
+        # register_script только считает SHA локально | Вызов идёт через EVALSHA (при NOSCRIPT — EVAL), это один round-trip
+        script = redis.register_script(_SCRIPTS[self.policy])
+        args = [self.window_ms, self.limit]
+        if self.policy == "sliding_window":
+            args.append(uuid.uuid4().hex)
+
+        try:
+            allowed, remaining = await script(keys=[key], args=args)
+        except RedisError as e:
+            print(f"⚠️ Rate limiter {self.name}: Redis недоступен: {e}")
+            return RateLimitResult(self.fail_open, 0)
+
+        return RateLimitResult(bool(allowed), int(remaining))
+
+
+def account_identity(email: str) -> str:
+    # email хэшируем — в ключах Redis не храним адреса пользователей
+    return hashlib.sha256(email.strip().lower().encode()).hexdigest()[:16]
+
+
+def login_identity(email: str, ip: str) -> str:
+    # Перебор паролей к одному аккаунту с одного адреса
+    return f"{account_identity(email)}:{ip}"
+
+
+# Лимитеры приложения | IP клиента — из X-Forwarded-For, только если запрос пришёл от доверенного прокси (FORWARDED_ALLOW_IPS, см. Dockerfile)
+guest_limiter = RateLimiter("guest", settings.GUEST_RATE_POLICY, settings.GUEST_RATE_LIMIT, settings.GUEST_RATE_WINDOW) # /guest/send по отпечатку IP + User-Agent
+send_limiter = RateLimiter("send", settings.SEND_RATE_POLICY, settings.SEND_RATE_LIMIT, settings.SEND_RATE_WINDOW) # /send и /send/stream по ID пользователя
+login_limiter = RateLimiter("login", settings.AUTH_RATE_POLICY, settings.AUTH_RATE_LIMIT, settings.AUTH_RATE_WINDOW) # /login по email + IP
+login_account_limiter = RateLimiter("login_account", settings.AUTH_RATE_POLICY, settings.LOGIN_ACCOUNT_RATE_LIMIT, settings.LOGIN_ACCOUNT_RATE_WINDOW) # /login по email со всех IP
+auth_limiter = RateLimiter("auth", settings.AUTH_RATE_POLICY, settings.AUTH_RATE_LIMIT, settings.AUTH_RATE_WINDOW) # /register по IP
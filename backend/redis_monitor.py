@@ -0,0 +1,62 @@
+# Фоновый мониторинг Redis: один PING раз в N секунд вместо PING на каждый запрос
+# Запросы читают только флаг healthy в памяти. Если Redis упал при старте или позже — монитор сам переподключится.
+import asyncio
+from typing import Optional
+
+from fastapi import FastAPI
+from redis.asyncio import Redis, RedisError
+
+
+class RedisHealthMonitor:
+    def __init__(self, app: FastAPI, redis_url: str, interval: float = 10):
+        self.app = app
+        self.redis_url = redis_url
+        self.interval = interval
+        self.healthy = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _create_client(self) -> Redis:
+        return Redis.from_url(
+            self.redis_url,
+            encoding="utf-8",
+            decode_responses=True,
+            socket_timeout=5,
+            socket_connect_timeout=5,
+            retry_on_timeout=True,
+            health_check_interval=30
+        )
+
+    async def check(self) -> bool:
+        # Клиент создаётся заново, если его ещё нет (например, Redis был недоступен при старте)
+        if self.app.state.redis is None:
+            self.app.state.redis = self._create_client()
+
+        try:
+            await self.app.state.redis.ping()
+            if not self.healthy:
+                print("✅ Redis доступен")
+            self.healthy = True
+        except (RedisError, OSError) as e:
+            if self.healthy:
+                print(f"⚠️ Redis недоступен: {e}")
+            self.healthy = False
+        return self.healthy
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.app.state.redis is not None:
+            await self.app.state.redis.close()
+            self.app.state.redis = None
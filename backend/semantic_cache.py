@@ -0,0 +1,101 @@
+# Семантический кэш ответов для гостей (/guest/send): похожий вопрос → готовый ответ без запроса к LLM
+# У гостя нет истории, ответ зависит только от текста → "Я волнуюсь перед экзаменом" и "волнуюсь перед экзаменами" получают один ответ.
+# Эмбеддинги — локальная модель sentence-transformers на CPU, индекс — матрица NumPy в памяти процесса (косинусная близость).
+# Включается SEMANTIC_CACHE_ENABLED=true | Если пакета/модели нет — кэш просто не используется
+import asyncio
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+
+class SemanticCache:
+    def __init__(self, model_name: str, threshold: float, ttl: float, max_size: int):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._model = None
+        self._unavailable = False
+        self._load_lock = threading.Lock() # Модель грузится в потоке — два первых запроса не должны грузить её дважды
+        # Индекс: строка матрицы = нормированный эмбеддинг вопроса | Слоты переиспользуются после истечения TTL / вытеснения
+        self._vectors: Optional[np.ndarray] = None
+        self._answers = [None] * max_size
+        self._expires_at = np.zeros(max_size) # 0 — слот пуст
+        self._last_used = np.zeros(max_size) # Для вытеснения давно не используемых (LRU), когда свободных слотов нет
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _load_model(self):
+        # Импортируем лениво — без sentence-transformers приложение работает как раньше
+        with self._load_lock:
+            if self._model is not None or self._unavailable:
+                return self._model
+            try:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(self.model_name, device="cpu")
+                self._vectors = np.zeros((self.max_size, model.get_sentence_embedding_dimension()), dtype=np.float32)
+                self._model = model
+            except Exception as e:
+                print(f"⚠️ Семантический кэш недоступен: {e}")
+                self._unavailable = True
+            return self._model
+
+    async def warm_up(self) -> bool:
+        return await asyncio.to_thread(self._load_model) is not None
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        model = self._load_model()
+        if model is None:
+            return None
+        return model.encode(text.strip().lower(), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+    async def get(self, text: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        # Возвращает (ответ или None, эмбеддинг вопроса — передать в put после ответа LLM, чтобы не считать его дважды)
+        vector = await asyncio.to_thread(self._embed, text) # Модель на CPU — не блокируем event loop
+        if vector is None:
+            return None, None
+
+        now = time.time()
+        alive = self._expires_at > now
+        if alive.any():
+            similarity = self._vectors @ vector # Векторы нормированы → скалярное произведение = косинусная близость
+            similarity[~alive] = -1.0
+            best = int(np.argmax(similarity))
+            if similarity[best] >= self.threshold:
+                self._last_used[best] = now
+                self._stats["hits"] += 1
+                return self._answers[best], vector
+
+        self._stats["misses"] += 1
+        return None, vector
+
+    def put(self, vector: Optional[np.ndarray], answer: str) -> None:
+        if vector is None:
+            return
+        now = time.time()
+        free = np.flatnonzero(self._expires_at <= now) # Пустые и просроченные слоты
+        if free.size:
+            slot = int(free[0])
+        else:
+            slot = int(np.argmin(self._last_used))
+            self._stats["evictions"] += 1
+
+        self._vectors[slot] = vector
+        self._answers[slot] = answer
+        self._expires_at[slot] = now + self.ttl
+        self._last_used[slot] = now
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "size": int((self._expires_at > time.time()).sum()), "max_size": self.max_size,
+                "enabled": settings.SEMANTIC_CACHE_ENABLED and not self._unavailable}
+
+
+semantic_cache = SemanticCache(
+    model_name=settings.SEMANTIC_CACHE_MODEL,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+    max_size=settings.SEMANTIC_CACHE_SIZE,
+)
@@ -0,0 +1,87 @@
+# Кэш списка чатов для сайдбара (первая страница + общее количество) в Redis, по ключу на пользователя
+# Сбрасывается при создании / переименовании / удалении чата и новом сообщении (порядок по updated_at меняется)
+# Redis недоступен → читаем из БД напрямую
+# Сброс не теряется, даже если Redis в этот момент недоступен: процесс помнит, когда менял список пользователя (версия, сверяется при чтении),
+# и удаляет ключ, как только Redis снова отвечает. Дольше SIDEBAR_CACHE_TTL устаревший список не живёт ни в одном процессе
+import json
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from cachetools import TTLCache
+from redis.asyncio import Redis, RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from crud import ChatCRUD, ConversationItem
+
+# user_id → когда этот процесс последний раз менял список чатов | Записи старше TTL кэша не нужны — их ключи уже истекли
+_changed_at = TTLCache(maxsize=100_000, ttl=settings.SIDEBAR_CACHE_TTL)
+# Пользователи, чей ключ не удалось удалить (Redis был недоступен) — удаляем при следующем обращении к Redis
+_pending_deletes = TTLCache(maxsize=100_000, ttl=settings.SIDEBAR_CACHE_TTL)
+
+
+def cache_key(user_id: int) -> str:
+    return f"sidebar:{user_id}"
+
+
+def _dump(items: List[ConversationItem], has_more: bool, total: int, cached_at: float) -> str:
+    return json.dumps({
+        "items": [[item.id, item.title, item.updated_at.isoformat()] for item in items],
+        "has_more": has_more,
+        "total": total,
+        "cached_at": cached_at,
+    })
+
+
+def _load(raw: str) -> Tuple[List[ConversationItem], bool, int, float]:
+    data = json.loads(raw)
+    items = [ConversationItem(id, title, datetime.fromisoformat(updated_at)) for id, title, updated_at in data["items"]]
+    return items, data["has_more"], data["total"], data.get("cached_at", 0.0)
+
+
+async def _flush_pending(redis: Redis) -> None:
+    # Отложенные сбросы — одним DEL | Ошибка пробрасывается вызывающему, записи остаются до следующей попытки
+    if _pending_deletes:
+        user_ids = list(_pending_deletes)
+        await redis.delete(*(cache_key(user_id) for user_id in user_ids))
+        for user_id in user_ids:
+            _pending_deletes.pop(user_id, None)
+
+
+async def get_sidebar(db: AsyncSession, redis: Optional[Redis], user_id: int) -> Tuple[List[ConversationItem], bool, int]:
+    # Возвращает (первая страница чатов, есть ли ещё, всего чатов)
+    if redis is not None:
+        try:
+            await _flush_pending(redis)
+            raw = await redis.get(cache_key(user_id))
+            if raw is not None:
+                items, has_more, total, cached_at = _load(raw)
+                if cached_at > _changed_at.get(user_id, 0.0): # Список закэширован раньше нашего изменения → промах
+                    return items, has_more, total
+        except RedisError as e:
+            print(f"⚠️ Sidebar cache: Redis недоступен: {e}")
+            redis = None
+
+    cached_at = time.time() # До чтения из БД: изменение во время чтения сделает эту запись устаревшей
+    items, has_more = await ChatCRUD.list_conversations(db, user_id, settings.SIDEBAR_PAGE_SIZE)
+    # Меньше страницы → количество уже известно, COUNT не нужен
+    total = await ChatCRUD.count_conversations(db, user_id) if has_more else len(items)
+
+    if redis is not None:
+        try:
+            await redis.set(cache_key(user_id), _dump(items, has_more, total, cached_at), ex=settings.SIDEBAR_CACHE_TTL)
+        except RedisError as e:
+            print(f"⚠️ Sidebar cache: Redis недоступен: {e}")
+    return items, has_more, total
+
+
+async def invalidate(redis: Optional[Redis], user_id: int) -> None:
+    _changed_at[user_id] = time.time()
+    _pending_deletes[user_id] = True
+    if redis is None:
+        return # Redis помечен недоступным — ключ удалим при следующем обращении к нему
+    try:
+        await _flush_pending(redis)
+    except RedisError as e:
+        print(f"⚠️ Sidebar cache: не удалось сбросить кэш пользователя {user_id}: {e}")
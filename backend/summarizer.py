@@ -0,0 +1,82 @@
+# Фоновое инкрементальное summary длинных чатов
+# После каждого обмена сообщениями: если несжатых сообщений накопилось много, старые сворачиваются
+# в краткое содержание (предыдущее summary + новые реплики → новое summary). Запрос пользователя этого не ждёт.
+import asyncio
+
+from config import settings
+from crud import ChatCRUD
+from database import async_session
+from groq_api import groq_ai_answer
+import context_builder
+
+_running = set() # ID чатов, для которых summary уже обновляется (не запускаем дважды)
+_tasks = set() # Держим ссылки на задачи, чтобы их не собрал GC
+
+
+def schedule(conversation_id: int) -> None:
+    if conversation_id in _running:
+        return
+    _running.add(conversation_id)
+    task = asyncio.create_task(update_summary(conversation_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def summarize(previous_summary: str, messages: list) -> str:
+    dialogue = "\n".join(f"{role}: {content}" for _, role, content in messages)
+    prompt = f"""
+    You maintain a running summary of a conversation between a user and a psychological support assistant.
+    Update the summary with the new messages. Keep what matters for future support: the user's situation,
+    feelings, important people and events, goals and advice already given. Write in the language of the conversation.
+    Keep it under 250 words. Answer with the updated summary only.
+
+    Current summary:
+    {previous_summary or "(empty)"}
+
+    New messages:
+    {dialogue}
+
+    Updated summary:
+    """
+    return (await groq_ai_answer(prompt.strip(), role="summary")).strip() # Своя роль: фоновые summary не занимают слоты и статистику ответов
+
+
+async def update_summary(conversation_id: int) -> None:
+    try:
+        # Читаем и закрываем сессию до запросов к LLM — соединение не простаивает в транзакции всё время суммаризации
+        async with async_session() as db:
+            # Обычно сворачивать нечего — решаем по одному COUNT, тексты сообщений читаем только когда пора
+            if await ChatCRUD.count_unsummarized(db, conversation_id) <= settings.SUMMARY_TRIGGER_MESSAGES:
+                return
+
+            row = await ChatCRUD.get_summary(db, conversation_id)
+            summary = row.summary if row else ""
+            folded_until = last_message_id = row.last_message_id if row else 0
+            pending = await ChatCRUD.get_messages_after(db, conversation_id, last_message_id)
+
+        # Последние KEEP_RECENT сообщений остаются в контексте дословно, всё что раньше — сворачиваем порциями
+        # (срез [:-0] был бы пустым — при KEEP_RECENT=0 сворачиваем всё)
+        to_fold = pending[:max(len(pending) - settings.SUMMARY_KEEP_RECENT, 0)]
+        if not to_fold:
+            return
+        for start in range(0, len(to_fold), settings.SUMMARY_TRIGGER_MESSAGES):
+            batch = to_fold[start:start + settings.SUMMARY_TRIGGER_MESSAGES]
+            summary = await summarize(summary, batch)
+            last_message_id = batch[-1][0]
+
+        async with async_session() as db:
+            # Пока шли запросы к LLM, summary мог обновить другой воркер — его более новое summary не затираем
+            row = await ChatCRUD.get_summary(db, conversation_id, for_update=True)
+            if (row.last_message_id if row else 0) != folded_until:
+                print(f"Summary чата {conversation_id} уже обновлено другим процессом, пропускаем")
+                return
+            await ChatCRUD.save_summary(db, conversation_id, summary, last_message_id)
+            await db.commit()
+
+        # Кэш контекста собран без нового summary — пересоберётся на следующем сообщении
+        context_builder.forget(conversation_id)
+        print(f"Summary чата {conversation_id} обновлено (до сообщения {last_message_id})")
+    except Exception as e:
+        print(f"Ошибка обновления summary для чата {conversation_id}: {e}")
+    finally:
+        _running.discard(conversation_id)
@@ -0,0 +1,56 @@
+# Минимальный локальный HTTP/1.1 сервер для тестов (заглушки Stripe и OpenAI-совместимых LLM)
+# handler(method, path, body) → (status, dict | bytes) | Задержки и ошибки задаются внутри handler
+import asyncio
+import json
+from typing import Awaitable, Callable, Tuple, Union
+
+Handler = Callable[[str, str, bytes], Awaitable[Tuple[int, Union[dict, bytes]]]]
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class StubServer:
+    def __init__(self, handler: Handler):
+        self.handler = handler
+        self.requests = [] # (method, path) всех запросов — для проверок в тестах
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True: # keep-alive: клиенты с пулом соединений шлют несколько запросов подряд
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                self.requests.append((method, path))
+                status, payload = await self.handler(method, path, body)
+                if isinstance(payload, dict):
+                    content, content_type = json.dumps(payload).encode(), "application/json"
+                else:
+                    content, content_type = payload, "text/event-stream"
+                writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, 'Status')}\r\nContent-Type: {content_type}\r\n"
+                             f"Content-Length: {len(content)}\r\n\r\n".encode() + content)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,68 @@
+# Вызовы Stripe не блокируют event loop: медленный Stripe (локальная заглушка) не задерживает остальные запросы воркера
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import billing
+from config import settings
+from tests.stub_server import StubServer
+
+STRIPE_DELAY = 0.3
+
+
+async def stripe_stub(method, path, body):
+    await asyncio.sleep(STRIPE_DELAY)
+    if path.startswith("/v1/subscriptions/"):
+        subscription_id = path.rsplit("/", 1)[-1]
+        return 200, {"id": subscription_id, "object": "subscription",
+                     "items": {"object": "list", "data": [{"id": "si_1", "object": "subscription_item", "price": {"id": f"price_{subscription_id}", "object": "price"}}]}}
+    if path.startswith("/v1/prices/"):
+        return 200, {"id": path.rsplit("/", 1)[-1], "object": "price", "unit_amount": 400, "currency": "usd", "recurring": {"interval": "month"}}
+    return 404, {"error": {"message": "not found"}}
+
+
+@pytest.fixture
+async def stripe_server(monkeypatch):
+    async with StubServer(stripe_stub) as server:
+        monkeypatch.setattr(settings, "STRIPE_API_BASE", server.url)
+        monkeypatch.setattr(settings, "STRIPE_SECRET_KEY", "sk_test_stub")
+        monkeypatch.setattr(billing, "_price_catalogue", {})
+        billing._legacy_subscription_prices.clear()
+        await billing.close_stripe_client()
+        yield server
+        await billing.close_stripe_client()
+
+
+def legacy_subscriber(number: int):
+    # Подписка без subscription_price_id → /profile идёт в Stripe за подпиской и ценой
+    return SimpleNamespace(stripe_subscription_id=f"sub_{number}", subscription_status="active", subscription_price_id=None)
+
+
+async def test_concurrent_profile_requests_are_not_serialized(stripe_server):
+    started = time.perf_counter()
+    labels = await asyncio.gather(*(billing.get_user_subscription_price(legacy_subscriber(n)) for n in range(5)))
+    elapsed = time.perf_counter() - started
+
+    assert labels == ["4.00 USD / month"] * 5
+    assert len(stripe_server.requests) == 10
+    # Последовательно было бы 5 × 2 × STRIPE_DELAY = 3 с; параллельно — два последовательных запроса на пользователя
+    assert elapsed < 5 * STRIPE_DELAY
+
+
+async def test_event_loop_keeps_serving_during_stripe_call(stripe_server):
+    ticks = 0
+
+    async def other_request(): # Имитация /send: короткие шаги на том же event loop
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(other_request())
+    await billing.get_user_subscription_price(legacy_subscriber(1))
+    ticker.cancel()
+
+    # Два запроса к Stripe по 0.3 с — event loop всё это время обслуживал другие задачи
+    assert ticks >= 20
@@ -0,0 +1,37 @@
+import context_builder
+from crud import ChatCRUD
+
+
+async def test_cached_context_is_extended_by_own_exchange(db, conversation):
+    assert await context_builder.build_context(db, conversation.id) == []
+
+    _, ai_message = await ChatCRUD.add_exchange(db, conversation.id, "hi", "hello")
+    await db.commit()
+    context_builder.remember_exchange(conversation.id, "hi", "hello", ai_message.id)
+
+    # Версия в кэше совпадает с БД → контекст берётся из кэша
+    assert context_builder._context_cache[conversation.id][0] == await ChatCRUD.get_history_version(db, conversation.id)
+    assert [m["content"] for m in await context_builder.build_context(db, conversation.id)] == ["hi", "hello"]
+
+
+async def test_exchange_saved_by_another_worker_invalidates_cache(db, conversation):
+    await context_builder.build_context(db, conversation.id)
+
+    # Другой воркер сохранил обмен — до нашего кэша remember_exchange не дошёл
+    await ChatCRUD.add_exchange(db, conversation.id, "question", "answer")
+    await db.commit()
+
+    context = await context_builder.build_context(db, conversation.id)
+    assert [m["content"] for m in context] == ["question", "answer"]
+
+
+async def test_interleaved_message_is_not_hidden_by_remember_exchange(db, conversation):
+    await context_builder.build_context(db, conversation.id)
+
+    await ChatCRUD.add_exchange(db, conversation.id, "from other tab", "reply 1") # Чужой обмен
+    _, ai_message = await ChatCRUD.add_exchange(db, conversation.id, "mine", "reply 2")
+    await db.commit()
+    context_builder.remember_exchange(conversation.id, "mine", "reply 2", ai_message.id)
+
+    context = await context_builder.build_context(db, conversation.id)
+    assert [m["content"] for m in context] == ["from other tab", "reply 1", "mine", "reply 2"]
@@ -0,0 +1,192 @@
+# Шлюз к LLM: повторы, circuit breaker, ограничение очереди | OpenAI-совместимый провайдер — против локальной заглушки
+import asyncio
+import json
+
+import httpx
+import pytest
+from tenacity import wait_none
+
+import llm_gateway
+from llm_gateway import CircuitBreaker, CircuitOpenError, LLMGateway, LLMUnavailable
+from llm_router import OpenAICompatibleProvider
+from tests.stub_server import StubServer
+
+
+@pytest.fixture(autouse=True)
+def no_retry_pause(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "wait_random_exponential", lambda **kwargs: wait_none())
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_gateway(max_concurrency=4, deadline=5.0, max_attempts=3, failure_threshold=3, reset_timeout=30.0) -> LLMGateway:
+    return LLMGateway(max_concurrency, deadline, max_attempts, CircuitBreaker(failure_threshold, reset_timeout))
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://llm/chat/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def test_breaker_opens_after_threshold_and_probes_once(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_gateway.time, "monotonic", clock)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow() # Один пробный запрос
+    assert breaker.state == "half_open" and not breaker.allow()
+
+    breaker.record_failure() # Проба не удалась → снова open
+    assert breaker.state == "open" and not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0 and breaker.allow()
+
+
+def test_breaker_cancelled_probe_frees_the_slot(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_gateway.time, "monotonic", clock)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+
+
+async def test_transient_errors_are_retried():
+    gateway = make_gateway()
+    errors = [status_error(503), httpx.ConnectError("refused")]
+
+    async def request():
+        if errors:
+            raise errors.pop(0)
+        return "answer"
+
+    assert await gateway.call(request) == "answer"
+    stats = gateway.get_stats()
+    assert stats["retries"] == 2 and stats["failures"] == 0 and stats["circuit"] == "closed"
+
+
+async def test_client_errors_are_not_retried():
+    gateway = make_gateway()
+    calls = []
+
+    async def request():
+        calls.append(1)
+        raise status_error(400)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await gateway.call(request)
+    assert len(calls) == 1
+    assert gateway.breaker.failures == 1
+
+
+async def test_open_circuit_fails_fast_without_calling_provider():
+    gateway = make_gateway(max_attempts=1, failure_threshold=2)
+    calls = []
+
+    async def request():
+        calls.append(1)
+        raise status_error(500)
+
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            await gateway.call(request)
+
+    with pytest.raises(CircuitOpenError):
+        await gateway.call(request)
+    assert len(calls) == 2
+    assert gateway.get_stats()["rejected"] == 1
+
+
+async def test_full_queue_is_rejected_within_deadline():
+    gateway = make_gateway(max_concurrency=1, deadline=5.0)
+    release = asyncio.Event()
+
+    async def slow():
+        await release.wait()
+        return "slow"
+
+    holder = asyncio.create_task(gateway.call(slow)) # Дедлайн берётся в момент вызова — держатель слота ждёт до 5 с
+    await asyncio.sleep(0)
+    gateway.deadline = 0.1
+
+    with pytest.raises(LLMUnavailable):
+        await gateway.call(slow)
+    assert gateway.get_stats()["rejected"] == 1
+    assert gateway.breaker.state == "closed" # Очередь — не вина провайдера
+
+    release.set()
+    assert await holder == "slow"
+
+
+async def test_stream_releases_slot_when_consumer_stops_early():
+    gateway = make_gateway(max_concurrency=1)
+
+    async def chunks():
+        for chunk in ("a", "b", "c"):
+            yield chunk
+
+    async def open_stream():
+        return chunks()
+
+    stream = gateway.stream(open_stream)
+    assert await stream.__anext__() == "a"
+    await stream.aclose() # Классификатор сказал NO / клиент ушёл
+
+    stats = gateway.get_stats()
+    assert stats["in_flight"] == 0 and stats["circuit"] == "closed"
+
+
+def completion_stub(failures: int):
+    # Первые failures запросов — 503, дальше ответ (обычный или SSE-стрим)
+    async def handler(method, path, body):
+        if failures > len([r for r in handler.seen]):
+            handler.seen.append(path)
+            return 503, {"error": {"message": "overloaded"}}
+        handler.seen.append(path)
+        if json.loads(body).get("stream"):
+            events = [{"choices": [{"delta": {"content": part}}]} for part in ("Hel", "lo")]
+            return 200, b"".join(f"data: {json.dumps(event)}\n\n".encode() for event in events) + b"data: [DONE]\n\n"
+        return 200, {"choices": [{"message": {"content": "Hello"}}]}
+    handler.seen = []
+    return handler
+
+
+async def test_openai_compatible_provider_retries_through_gateway():
+    async with StubServer(completion_stub(failures=1)) as server:
+        provider = OpenAICompatibleProvider("stub", server.url)
+        gateway = make_gateway()
+        messages = [{"role": "user", "content": "hi"}]
+
+        assert await gateway.call(lambda: provider.complete("model", messages)) == "Hello"
+        assert server.requests == [("POST", "/chat/completions")] * 2
+        await provider.close()
+
+
+async def test_openai_compatible_provider_streams_sse():
+    async with StubServer(completion_stub(failures=1)) as server:
+        provider = OpenAICompatibleProvider("stub", server.url)
+        gateway = make_gateway()
+        messages = [{"role": "user", "content": "hi"}]
+
+        chunks = [chunk async for chunk in gateway.stream(lambda: provider.open_stream("model", messages))]
+        assert chunks == ["Hel", "lo"]
+        assert gateway.get_stats()["retries"] == 1
+        await provider.close()
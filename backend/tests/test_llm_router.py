@@ -0,0 +1,165 @@
+# Роутер LLM с фейковыми провайдерами: переключение при ошибках, выбор по задержке, раздельная статистика ролей
+import asyncio
+
+import httpx
+import pytest
+from tenacity import wait_none
+
+import llm_gateway
+from config import settings
+from llm_router import LLMRouter
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture(autouse=True)
+def fast_router(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "wait_random_exponential", lambda **kwargs: wait_none())
+    monkeypatch.setattr(settings, "LLM_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(settings, "LLM_MIN_SAMPLES", 2)
+    monkeypatch.setattr(settings, "LLM_BREAKER_FAILURES", 100) # Здесь проверяем статистику, а не breaker
+
+
+def server_error() -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://llm/chat/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(500, request=request))
+
+
+class FakeProvider:
+    def __init__(self, name: str, delay: float = 0.0, fail: bool = False, break_stream: bool = False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.break_stream = break_stream # Отдаёт первый токен и падает
+        self.calls = []
+
+    async def complete(self, model, messages, **params):
+        self.calls.append((model, params["max_tokens"]))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise server_error()
+        return f"{self.name}:{model}"
+
+    async def open_stream(self, model, messages, **params):
+        self.calls.append((model, params["max_tokens"]))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise server_error()
+        return self._chunks()
+
+    async def _chunks(self):
+        yield f"{self.name}-"
+        if self.break_stream:
+            raise server_error()
+        yield "done"
+
+    async def close(self):
+        pass
+
+
+def make_router(*providers, answer: str, classifier: str = "") -> LLMRouter:
+    router = LLMRouter()
+    for provider in providers:
+        router.register_provider(provider)
+    router.set_role("answer", answer)
+    router.set_role("classifier", classifier or answer)
+    return router
+
+
+async def test_roles_do_not_share_targets():
+    provider = FakeProvider("a")
+    router = make_router(provider, answer="a:big")
+
+    await router.complete("classifier", MESSAGES)
+    await router.complete("classifier", MESSAGES)
+
+    stats = router.get_stats()
+    assert stats["classifier:a:big"]["latency"]["samples"] == 2
+    assert stats["answer:a:big"]["latency"]["samples"] == 0
+    assert router.roles["answer"][0].gateway is not router.roles["classifier"][0].gateway
+    assert provider.calls == [("big", 5), ("big", 5)] # Параметры роли classifier
+
+
+async def test_complete_fails_over_to_next_provider():
+    broken, backup = FakeProvider("broken", fail=True), FakeProvider("backup")
+    router = make_router(broken, backup, answer="broken:m,backup:m")
+
+    assert await router.complete("answer", MESSAGES) == "backup:m"
+    stats = router.get_stats()
+    assert stats["answer:broken:m"]["latency"]["error_rate"] == 1.0
+    assert stats["answer:backup:m"]["latency"]["error_rate"] == 0.0
+
+
+async def test_all_providers_failing_raises_last_error():
+    router = make_router(FakeProvider("a", fail=True), FakeProvider("b", fail=True), answer="a:m,b:m")
+
+    with pytest.raises(llm_gateway.LLM_ERRORS):
+        await router.complete("answer", MESSAGES)
+
+
+async def test_faster_provider_is_preferred_once_measured():
+    slow, fast = FakeProvider("slow", delay=0.05), FakeProvider("fast")
+    router = make_router(slow, fast, answer="slow:m,fast:m")
+
+    for _ in range(4): # Пока статистики мало, пробуются оба
+        await router.complete("answer", MESSAGES)
+    slow.calls.clear()
+    fast.calls.clear()
+
+    for _ in range(3):
+        assert await router.complete("answer", MESSAGES) == "fast:m"
+    assert slow.calls == []
+
+
+async def test_broken_streams_make_target_unhealthy():
+    flaky, steady = FakeProvider("flaky", break_stream=True), FakeProvider("steady", delay=0.01)
+    router = make_router(flaky, steady, answer="flaky:m")
+    flaky_target = router.roles["answer"][0]
+
+    for _ in range(2): # Первый токен приходит быстро, потом стрим обрывается
+        with pytest.raises(httpx.HTTPStatusError):
+            async for _ in router.stream("answer", MESSAGES):
+                pass
+    # Быстрый первый токен не спасает: стрим не доходит до конца → провайдер нездоров
+    assert flaky_target.first_token.snapshot()["error_rate"] == 0.0
+    assert not flaky_target.is_healthy()
+
+    router.set_role("answer", "flaky:m,steady:m") # Статистика flaky сохраняется — Target тот же
+    assert router._candidates("answer", streaming=True)[-1] is flaky_target
+    chunks = [chunk async for chunk in router.stream("answer", MESSAGES)]
+    assert chunks == ["steady-", "done"]
+
+
+async def test_stream_fails_over_before_first_token():
+    router = make_router(FakeProvider("down", fail=True), FakeProvider("up"), answer="down:m,up:m")
+
+    chunks = [chunk async for chunk in router.stream("answer", MESSAGES)]
+    assert chunks == ["up-", "done"]
+    stats = router.get_stats()
+    assert stats["answer:down:m"]["streams"]["error_rate"] == 1.0
+    assert stats["answer:up:m"]["streams"]["error_rate"] == 0.0
+
+
+async def test_role_targets_share_one_concurrency_limit(monkeypatch):
+    # Запасной провайдер роли не добавляет слотов: лимит — на роль в воркере
+    monkeypatch.setattr(settings, "LLM_MAX_CONCURRENCY", 1)
+    router = make_router(FakeProvider("a"), FakeProvider("b"), answer="a:m,b:m", classifier="a:small")
+    first, second = router.roles["answer"]
+    classifier = router.roles["classifier"][0]
+
+    assert first.gateway._semaphore is second.gateway._semaphore
+    assert classifier.gateway._semaphore is not first.gateway._semaphore
+
+    release = asyncio.Event()
+    async def slow():
+        await release.wait()
+        return "slow"
+
+    holder = asyncio.create_task(first.gateway.call(slow))
+    await asyncio.sleep(0)
+    second.gateway.deadline = 0.05
+    with pytest.raises(llm_gateway.LLMUnavailable): # Слот роли занят первым провайдером
+        await second.gateway.call(slow)
+    assert await router.complete("classifier", MESSAGES) == "a:small" # Другая роль — свои слоты
+    release.set()
+    assert await holder == "slow"
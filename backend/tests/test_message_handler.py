@@ -0,0 +1,189 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+from starlette.requests import Request
+
+import message_handler
+import question_control
+import verdict_cache
+from config import settings
+from crud import ChatCRUD, UserCRUD
+from models import User
+
+
+def make_request() -> Request:
+    app = SimpleNamespace(state=SimpleNamespace(redis_monitor=None, redis=None))
+    return Request({"type": "http", "method": "POST", "path": "/send", "headers": [], "query_string": b"", "app": app})
+
+
+async def test_connection_is_released_during_llm_call(db, conversation, monkeypatch):
+    seen = {}
+
+    async def fake_reply(text, redis=None, history=None):
+        seen["in_transaction"] = db.in_transaction() # Пока LLM думает, сессия не должна держать соединение
+        return "answer"
+
+    monkeypatch.setattr(message_handler, "get_ai_reply", fake_reply)
+    monkeypatch.setattr(message_handler.summarizer, "schedule", lambda conversation_id: None)
+
+    await ChatCRUD.get_history_version(db, conversation.id) # Открываем транзакцию, как get_current_user / is_conversation_owner
+    response = await message_handler.process_message(db, conversation.id, "question", make_request())
+
+    assert response.status_code == 200
+    assert seen["in_transaction"] is False
+    messages, _ = await ChatCRUD.get_messages_page(db, conversation.id, limit=10)
+    assert [m.content for m in messages] == ["question", "answer"]
+
+
+async def test_stream_saves_exchange_in_request_session(db, conversation, monkeypatch):
+    async def fake_stream(text, redis=None, history=None):
+        assert not db.in_transaction()
+        for chunk in ("ans", "wer"):
+            yield chunk
+
+    monkeypatch.setattr(message_handler, "stream_ai_reply", fake_stream)
+    monkeypatch.setattr(message_handler.summarizer, "schedule", lambda conversation_id: None)
+
+    await db.commit()
+    events = [event async for event in message_handler.stream_message(db, conversation.id, "question", None)]
+
+    assert events[-1].startswith("event: done")
+    messages, _ = await ChatCRUD.get_messages_page(db, conversation.id, limit=10)
+    assert [m.content for m in messages] == ["question", "answer"]
+
+
+def provider_error() -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://llm/chat/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(502, request=request))
+
+
+async def charged_user(db, conversation) -> User:
+    # Как в prepare_user_conversation: токен списан и закоммичен до запроса к LLM
+    user = await db.get(User, conversation.user_id)
+    assert await UserCRUD.update_user_tokens(db, user)
+    await db.commit()
+    return user
+
+
+async def stored_tokens(db, user) -> int:
+    await db.refresh(user)
+    return user.user_free_tokens
+
+
+async def test_provider_error_gets_friendly_reply_and_refund(db, conversation, monkeypatch):
+    # Последний провайдер вернул 5xx (не LLMUnavailable) — пользователь получает ответ, а не 500, и токен назад
+    async def failing_reply(text, redis=None, history=None):
+        raise provider_error()
+
+    monkeypatch.setattr(message_handler, "get_ai_reply", failing_reply)
+    user = await charged_user(db, conversation)
+
+    response = await message_handler.process_message(db, conversation.id, "question", make_request(), user)
+
+    assert message_handler.LLM_UNAVAILABLE_REPLY in response.body.decode()
+    messages, _ = await ChatCRUD.get_messages_page(db, conversation.id, limit=10)
+    assert messages == []
+    assert await stored_tokens(db, user) == 5
+
+
+async def test_failed_stream_refunds_token(db, conversation, monkeypatch):
+    async def failing_stream(text, redis=None, history=None):
+        raise provider_error()
+        yield
+
+    monkeypatch.setattr(message_handler, "stream_ai_reply", failing_stream)
+    user = await charged_user(db, conversation)
+
+    events = [event async for event in message_handler.stream_message(db, conversation.id, "question", None, user=user)]
+
+    assert events[-1].startswith("event: error")
+    assert await stored_tokens(db, user) == 5
+
+
+async def test_subscriber_is_not_refunded(db, conversation, monkeypatch):
+    async def failing_reply(text, redis=None, history=None):
+        raise provider_error()
+
+    monkeypatch.setattr(message_handler, "get_ai_reply", failing_reply)
+    user = await db.get(User, conversation.user_id)
+    user.subscription_status = "active" # Подписчику токен не списывался
+    await db.commit()
+
+    await message_handler.process_message(db, conversation.id, "question", make_request(), user)
+    assert await stored_tokens(db, user) == 5
+
+
+class RecordingCache:
+    def __init__(self):
+        self.stored = []
+
+    async def get(self, text):
+        return None, f"vector:{text}"
+
+    def put(self, vector, answer):
+        self.stored.append((vector, answer))
+
+
+async def test_guest_off_topic_reply_is_not_cached(monkeypatch):
+    cache = RecordingCache()
+    replies = {"off topic": message_handler.OFF_TOPIC_REPLY, "anxious": "answer"}
+
+    async def fake_reply(text, redis=None, history=None):
+        return replies[text]
+
+    async def no_redis(request):
+        return None # guest_limiter без Redis пропускает
+
+    monkeypatch.setattr(message_handler, "semantic_cache", cache)
+    monkeypatch.setattr(message_handler, "get_ai_reply", fake_reply)
+    monkeypatch.setattr(message_handler, "get_redis", no_redis)
+    monkeypatch.setattr(message_handler.settings, "SEMANTIC_CACHE_ENABLED", True)
+    request = Request({"type": "http", "method": "POST", "path": "/guest/send", "headers": [], "query_string": b"", "client": ("127.0.0.1", 1)})
+
+    await message_handler.free_conversation(request, "off topic")
+    await message_handler.free_conversation(request, "anxious")
+
+    assert cache.stored == [("vector:anxious", "answer")]
+
+
+async def test_speculative_no_verdict_cancels_answer(monkeypatch):
+    monkeypatch.setattr(settings, "SPECULATIVE_CLASSIFICATION", True)
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def slow_answer(text, history=None):
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def off_topic(text, redis=None):
+        await started.wait() # Генерация уже идёт параллельно с классификатором
+        return False
+
+    monkeypatch.setattr(message_handler, "groq_ai_answer", slow_answer)
+    monkeypatch.setattr(message_handler, "is_psychology_related", off_topic)
+
+    assert await message_handler.get_ai_reply("Как приготовить борщ?") == message_handler.OFF_TOPIC_REPLY
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+
+async def test_speculative_classifier_error_fails_open(monkeypatch):
+    monkeypatch.setattr(settings, "SPECULATIVE_CLASSIFICATION", True)
+    monkeypatch.setattr(settings, "CLASSIFIER_BACKEND", "llm")
+    verdict_cache._local_cache.clear()
+
+    async def answer(text, history=None):
+        return "answer"
+
+    async def classifier_down(prompt, role=None):
+        raise provider_error()
+
+    monkeypatch.setattr(message_handler, "groq_ai_answer", answer)
+    monkeypatch.setattr(question_control, "groq_ai_answer", classifier_down)
+
+    # Классификатор недоступен → сообщение пропускаем, пользователь получает ответ, вердикт не кэшируется
+    assert await message_handler.get_ai_reply("Мне тревожно") == "answer"
+    assert verdict_cache.get_local("Мне тревожно") is None
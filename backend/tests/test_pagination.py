@@ -0,0 +1,38 @@
+import datetime
+
+from crud import ChatCRUD
+from models import Conversation, Message
+
+
+async def test_messages_keyset_pages_walk_back_without_gaps(db, conversation):
+    db.add_all([Message(conversation_id=conversation.id, role="user", content=f"m{number}") for number in range(7)])
+    await db.commit()
+
+    page, has_more = await ChatCRUD.get_messages_page(db, conversation.id, limit=3)
+    assert [m.content for m in page] == ["m4", "m5", "m6"] and has_more
+
+    page, has_more = await ChatCRUD.get_messages_page(db, conversation.id, limit=3, before_id=page[0].id)
+    assert [m.content for m in page] == ["m1", "m2", "m3"] and has_more
+
+    page, has_more = await ChatCRUD.get_messages_page(db, conversation.id, limit=3, before_id=page[0].id)
+    assert [m.content for m in page] == ["m0"] and not has_more
+
+
+async def test_conversation_keyset_handles_equal_updated_at(db, conversation):
+    # Одинаковое updated_at у нескольких чатов — порядок и граница страницы определяются id
+    same_time = datetime.datetime(2026, 1, 1, 12, 0, 0)
+    db.add_all([Conversation(user_id=conversation.user_id, title=f"c{number}", updated_at=same_time) for number in range(4)])
+    conversation.updated_at = same_time + datetime.timedelta(minutes=1)
+    await db.commit()
+
+    seen = []
+    before = None
+    while True:
+        items, has_more = await ChatCRUD.list_conversations(db, conversation.user_id, limit=2, before=before)
+        seen.extend(item.title for item in items)
+        if not has_more:
+            break
+        before = (items[-1].updated_at, items[-1].id)
+
+    assert seen == ["Test", "c3", "c2", "c1", "c0"]
+    assert await ChatCRUD.count_conversations(db, conversation.user_id) == 5
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import MeteredQueuePool, _engine_pool_stats
+
+
+@pytest.fixture
+async def pool_engine(tmp_path):
+    # Файловая SQLite: у каждого соединения из пула своё подключение, как у asyncpg
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", poolclass=MeteredQueuePool,
+                                 pool_size=2, max_overflow=1, pool_timeout=0.3)
+    yield engine
+    await engine.dispose()
+
+
+async def test_counters_track_overflow_waits_and_timeouts(pool_engine):
+    held = [await pool_engine.connect() for _ in range(2)] # Весь pool_size
+    stats = pool_engine.pool.stats
+    assert (stats["checkouts"], stats["overflow_events"]) == (2, 0)
+
+    held.append(await pool_engine.connect()) # Сверх pool_size — одно соединение из max_overflow
+    assert (stats["checkouts"], stats["overflow_events"]) == (3, 1)
+
+    # Пул исчерпан: следующий ждёт, пока кто-то вернёт соединение
+    async def release_later():
+        await asyncio.sleep(0.1)
+        await held.pop(0).close()
+
+    releaser = asyncio.create_task(release_later())
+    held.append(await pool_engine.connect())
+    await releaser
+    assert stats["checkouts"] == 4
+    assert stats["overflow_events"] == 1 # Дождался возвращённого соединения, новое не открывал
+    assert stats["wait_seconds_max"] >= 0.09
+
+    with pytest.raises(exc.TimeoutError): # Никто не вернул соединение за pool_timeout
+        await pool_engine.connect()
+    assert stats["timeouts"] == 1
+    assert stats["checkouts"] == 4
+
+    metrics = _engine_pool_stats(pool_engine)
+    assert (metrics["checked_out"], metrics["overflow"], metrics["size"]) == (3, 1, 2)
+    assert metrics["wait_seconds_avg"] == pytest.approx(stats["wait_seconds_total"] / 4)
+
+    for connection in held:
+        await connection.close()
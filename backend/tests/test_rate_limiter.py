@@ -0,0 +1,64 @@
+import pytest
+
+from rate_limiter import RateLimiter, account_identity, login_identity
+
+fakeredis = pytest.importorskip("fakeredis") # Lua-скрипты в fakeredis требуют пакет lupa (fakeredis[lua])
+
+
+@pytest.fixture
+async def redis():
+    client = fakeredis.FakeAsyncRedis()
+    yield client
+    await client.aclose()
+
+
+@pytest.mark.parametrize("policy", ["sliding_window", "token_bucket"])
+async def test_limit_is_enforced_per_identity(redis, policy):
+    limiter = RateLimiter("test", policy, limit=3, window_seconds=60)
+
+    results = [(await limiter.hit(redis, "alice")).allowed for _ in range(4)]
+    assert results == [True, True, True, False]
+    assert (await limiter.hit(redis, "bob")).allowed # Чужой лимит не тратится
+
+
+async def test_sliding_window_reports_remaining(redis):
+    limiter = RateLimiter("test", "sliding_window", limit=2, window_seconds=60)
+    assert (await limiter.hit(redis, "alice")).remaining == 1
+    assert (await limiter.hit(redis, "alice")).remaining == 0
+    assert (await limiter.hit(redis, "alice")).remaining == 0
+
+
+async def test_key_expires_with_window(redis):
+    limiter = RateLimiter("test", "sliding_window", limit=1, window_seconds=60)
+    await limiter.hit(redis, "alice")
+    assert 0 < await redis.pttl("ratelimit:test:alice") <= 60_000
+
+
+async def test_without_redis_policy_decides():
+    assert (await RateLimiter("test", "sliding_window", 1, 60, fail_open=True).hit(None, "alice")).allowed
+    assert not (await RateLimiter("test", "sliding_window", 1, 60, fail_open=False).hit(None, "alice")).allowed
+
+
+async def test_login_attempts_for_one_account_do_not_lock_out_others(redis):
+    limiter = RateLimiter("login", "sliding_window", limit=2, window_seconds=60)
+    for _ in range(5):
+        await limiter.hit(redis, login_identity("victim@example.com", "10.0.0.1"))
+
+    assert not (await limiter.hit(redis, login_identity("Victim@Example.com ", "10.0.0.1"))).allowed
+    assert (await limiter.hit(redis, login_identity("someone@example.com", "10.0.0.1"))).allowed
+    assert (await limiter.hit(redis, login_identity("victim@example.com", "10.0.0.2"))).allowed
+
+
+async def test_account_limit_stops_distributed_guessing(redis):
+    # Каждый адрес укладывается в лимит email + IP, общий лимит аккаунта — нет
+    per_ip = RateLimiter("login", "sliding_window", limit=2, window_seconds=60)
+    per_account = RateLimiter("login_account", "sliding_window", limit=5, window_seconds=60)
+
+    allowed = 0
+    for n in range(20):
+        ip = f"10.0.0.{n}"
+        if (await per_ip.hit(redis, login_identity("victim@example.com", ip))).allowed \
+                and (await per_account.hit(redis, account_identity("Victim@example.com"))).allowed:
+            allowed += 1
+    assert allowed == 5
+    assert (await per_account.hit(redis, account_identity("someone@example.com"))).allowed
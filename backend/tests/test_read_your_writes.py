@@ -0,0 +1,113 @@
+import os
+import time
+import uuid
+from http.cookies import SimpleCookie
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from starlette.requests import Request
+from starlette.responses import Response
+
+import database
+import main
+import message_handler
+from models import User
+from tests.test_message_handler import make_request
+
+# Сквозной тест на настоящей паре primary/реплика: TEST_POSTGRES_URL=<primary> TEST_REPLICA_URL=<реплика> pytest tests/test_read_your_writes.py
+# Схема primary должна быть на alembic head (реплика получает её через репликацию) | Тест создаёт и удаляет одного пользователя
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+TEST_REPLICA_URL = os.getenv("TEST_REPLICA_URL")
+
+
+def request_with_cookies(cookies: str = "") -> Request:
+    headers = [(b"cookie", cookies.encode())] if cookies else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+
+async def test_middleware_sets_cookie_after_write():
+    request = request_with_cookies()
+    request.state.db_written = True
+
+    async def call_next(request):
+        return Response("ok")
+
+    response = await main.read_your_writes(request, call_next)
+    assert database.READ_YOUR_WRITES_COOKIE in response.headers["set-cookie"]
+
+
+async def test_middleware_skips_cookie_for_reads():
+    async def call_next(request):
+        return Response("ok")
+
+    response = await main.read_your_writes(request_with_cookies(), call_next)
+    assert "set-cookie" not in response.headers
+
+
+async def test_stream_marks_request_as_written(db, conversation, monkeypatch):
+    # Сохранение идёт в конце стрима, когда заголовки уже ушли → флаг должен стоять до возврата StreamingResponse
+    async def prepared(db, chat_id, user, redis):
+        return conversation.id, None
+
+    monkeypatch.setattr(message_handler, "prepare_user_conversation", prepared)
+    request = make_request()
+
+    await message_handler.user_conversation_stream(request, db, conversation.id, "question", SimpleNamespace(id=conversation.user_id))
+    assert request.state.db_written is True
+
+
+async def test_recent_writer_reads_from_primary(monkeypatch):
+    replica = create_async_engine("sqlite+aiosqlite://") # Соединение не открывается — проверяем только выбор engine
+    monkeypatch.setattr(database, "replica_engines", [replica])
+    monkeypatch.setattr(database, "_replica_cycle", iter([replica, replica]))
+
+    async def bind_for(request):
+        async for session in database.get_read_db(request):
+            return session.bind
+
+    assert await bind_for(request_with_cookies()) is replica
+    fresh = f"{database.READ_YOUR_WRITES_COOKIE}={time.time() + 30}"
+    assert await bind_for(request_with_cookies(fresh)) is database.read_engine
+    expired = f"{database.READ_YOUR_WRITES_COOKIE}={time.time() - 1}"
+    assert await bind_for(request_with_cookies(expired)) is replica
+    await replica.dispose()
+
+
+@pytest.mark.skipif(not (TEST_POSTGRES_URL and TEST_REPLICA_URL), reason="TEST_POSTGRES_URL / TEST_REPLICA_URL не заданы")
+async def test_write_then_read_back_through_cookie(monkeypatch):
+    primary = create_async_engine(TEST_POSTGRES_URL)
+    replica = create_async_engine(TEST_REPLICA_URL).execution_options(postgresql_readonly=True)
+    monkeypatch.setattr(database, "async_session", async_sessionmaker(primary, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(database, "read_engine", primary.execution_options(postgresql_readonly=True))
+    monkeypatch.setattr(database, "replica_engines", [replica])
+    monkeypatch.setattr(database, "_replica_cycle", iter([replica, replica]))
+    email = f"ryw-{uuid.uuid4().hex}@example.com"
+
+    # Запрос на запись: get_db коммитит, middleware ставит cookie
+    write_request = request_with_cookies()
+
+    async def call_next(request):
+        async for db in database.get_db(request):
+            db.add(User(email=email, password="hashed"))
+        return Response("ok")
+
+    response = await main.read_your_writes(write_request, call_next)
+    cookie = SimpleCookie(response.headers["set-cookie"])[database.READ_YOUR_WRITES_COOKIE]
+
+    try:
+        # Следующий запрос с cookie читает с primary и сразу видит свою запись, как бы ни отставала реплика
+        read_request = request_with_cookies(f"{cookie.key}={cookie.value}")
+        async for db in database.get_read_db(read_request):
+            assert db.bind is database.read_engine
+            assert (await db.execute(select(User.id).where(User.email == email))).scalar_one_or_none() is not None
+
+        # Без cookie — реплика (строку не проверяем: реплика может ещё не догнать)
+        async for db in database.get_read_db(request_with_cookies()):
+            assert db.bind is replica
+    finally:
+        async with primary.begin() as conn:
+            await conn.execute(delete(User).where(User.email == email))
+        await primary.dispose()
+        await replica.dispose()
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from redis.asyncio import RedisError
+from starlette.requests import Request
+
+from redis_monitor import RedisHealthMonitor
+from utils import get_redis
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FlakyRedis:
+    # PING отвечает, пока up=True | Запоминаем, закрыт ли клиент
+    def __init__(self):
+        self.up = True
+        self.closed = False
+
+    async def ping(self):
+        if not self.up:
+            raise RedisError("connection refused")
+        return True
+
+    async def close(self):
+        self.closed = True
+
+
+def make_app(redis=None):
+    return SimpleNamespace(state=SimpleNamespace(redis=redis, redis_monitor=None))
+
+
+def request_for(app) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b"", "app": app})
+
+
+async def test_healthy_unhealthy_and_back():
+    redis = FlakyRedis()
+    app = make_app(redis)
+    monitor = RedisHealthMonitor(app, "redis://unused")
+
+    assert await monitor.check() is True
+    redis.up = False
+    assert await monitor.check() is False
+    redis.up = True
+    assert await monitor.check() is True
+    assert app.state.redis is redis # Тот же клиент — пул переподключается сам
+
+
+async def test_background_loop_notices_recovery():
+    redis = FlakyRedis()
+    redis.up = False
+    app = make_app(redis)
+    monitor = RedisHealthMonitor(app, "redis://unused", interval=0.01)
+    assert await monitor.check() is False
+
+    monitor.start()
+    redis.up = True
+    await asyncio.sleep(0.05)
+    assert monitor.healthy
+    await monitor.stop()
+
+
+async def test_client_is_created_when_redis_was_down_at_startup(monkeypatch):
+    app = make_app(redis=None)
+    monitor = RedisHealthMonitor(app, "redis://unused")
+    client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(monitor, "_create_client", lambda: client)
+
+    assert await monitor.check() is True
+    assert app.state.redis is client
+
+
+async def test_get_redis_returns_503_while_flag_is_down():
+    redis = FlakyRedis()
+    app = make_app(redis)
+    app.state.redis_monitor = RedisHealthMonitor(app, "redis://unused")
+    await app.state.redis_monitor.check()
+    assert await get_redis(request_for(app)) is redis
+
+    redis.up = False
+    await app.state.redis_monitor.check()
+    with pytest.raises(HTTPException) as error:
+        await get_redis(request_for(app))
+    assert error.value.status_code == 503
+
+    redis.up = True
+    await app.state.redis_monitor.check()
+    assert await get_redis(request_for(app)) is redis
+
+
+async def test_stop_closes_client():
+    redis = FlakyRedis()
+    app = make_app(redis)
+    monitor = RedisHealthMonitor(app, "redis://unused", interval=0.01)
+    monitor.start()
+    await monitor.stop()
+    assert redis.closed and app.state.redis is None
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+import main
+import sidebar_cache
+from crud import ChatCRUD
+from models import Conversation
+from tests.test_message_handler import make_request
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture(autouse=True)
+def clear_versions():
+    sidebar_cache._changed_at.clear()
+    sidebar_cache._pending_deletes.clear()
+
+
+async def titles(db, redis, user_id):
+    items, _, _ = await sidebar_cache.get_sidebar(db, redis, user_id)
+    return [item.title for item in items]
+
+
+async def test_invalidation_while_redis_is_unhealthy_is_not_lost(db, conversation):
+    redis = fakeredis.FakeAsyncRedis()
+    user_id = conversation.user_id
+    assert await titles(db, redis, user_id) == ["Test"] # Список закэширован
+
+    await ChatCRUD.create_new_conversation(db, user_id, "Second")
+    await db.commit()
+    await sidebar_cache.invalidate(None, user_id) # Флаг здоровья Redis опущен — удалить ключ сейчас нельзя
+
+    # Redis снова доступен: в этом процессе устаревший список не отдаётся, а ключ удаляется для остальных
+    assert set(await titles(db, redis, user_id)) == {"Test", "Second"}
+    assert not sidebar_cache._pending_deletes
+
+
+async def test_pending_delete_reaches_other_processes(db, conversation):
+    redis = fakeredis.FakeAsyncRedis()
+    user_id = conversation.user_id
+    await titles(db, redis, user_id)
+
+    await sidebar_cache.invalidate(None, user_id)
+    await sidebar_cache.invalidate(redis, conversation.user_id + 1) # Следующий успешный сброс заодно удаляет отложенные ключи
+    assert await redis.get(sidebar_cache.cache_key(user_id)) is None
+
+
+async def test_conversations_page_opens_active_chat_without_deleting_it(db, conversation, monkeypatch):
+    captured = {}
+    monkeypatch.setattr(main.templates, "TemplateResponse", lambda name, context: captured.update(context))
+    user = SimpleNamespace(id=conversation.user_id)
+
+    await main.root(make_request(), active_chat_id=conversation.id, user_data=user, db=db)
+    assert captured["active_conversation_id"] == conversation.id
+    assert (await db.execute(select(Conversation.id))).scalars().all() == [conversation.id]
+
+    # Чужой чат не открывается — как без параметра
+    await main.root(make_request(), active_chat_id=conversation.id, user_data=SimpleNamespace(id=conversation.user_id + 1), db=db)
+    assert captured["active_conversation_id"] != conversation.id
+    assert await ChatCRUD.get_conversation_data(db, conversation.id, conversation.user_id) is not None
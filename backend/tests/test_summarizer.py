@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+import summarizer
+from config import settings
+from models import Base
+from crud import ChatCRUD
+
+
+async def test_count_unsummarized_skips_folded_messages(db, conversation):
+    for number in range(3):
+        await ChatCRUD.add_exchange(db, conversation.id, f"q{number}", f"a{number}")
+    await db.commit()
+    assert await ChatCRUD.count_unsummarized(db, conversation.id) == 6
+
+    messages = await ChatCRUD.get_messages_after(db, conversation.id, 0)
+    await ChatCRUD.save_summary(db, conversation.id, "summary", last_message_id=messages[3][0])
+    await db.commit()
+    assert await ChatCRUD.count_unsummarized(db, conversation.id) == 2
+
+
+@pytest.fixture
+async def sqlite_engine(tmp_path):
+    # Файловая база вместо общей из conftest: у неё настоящий пул — видно, держит ли задача соединение
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'summary.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def summary_env(sqlite_engine, monkeypatch):
+    # Фоновая задача открывает свои сессии — подменяем фабрику на SQLite и сжимаем пороги
+    monkeypatch.setattr(summarizer, "async_session", async_sessionmaker(sqlite_engine, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(settings, "SUMMARY_TRIGGER_MESSAGES", 4)
+    monkeypatch.setattr(settings, "SUMMARY_KEEP_RECENT", 2)
+    calls = []
+
+    async def fake_answer(text, history=None, role="answer"):
+        calls.append(role)
+        assert sqlite_engine.pool.checkedout() == 0 # Пока LLM думает, соединение из пула не занято
+        return f"summary {len(calls)}"
+
+    monkeypatch.setattr(summarizer, "groq_ai_answer", fake_answer)
+    return calls
+
+
+async def add_exchanges(db, conversation, count):
+    for number in range(count):
+        await ChatCRUD.add_exchange(db, conversation.id, f"q{number}", f"a{number}")
+    await db.commit()
+    messages = await ChatCRUD.get_messages_after(db, conversation.id, 0)
+    await db.commit() # Сессия теста не держит соединение
+    return messages
+
+
+async def test_summary_is_built_without_holding_a_connection(db, conversation, summary_env):
+    messages = await add_exchanges(db, conversation, 3)
+
+    await summarizer.update_summary(conversation.id)
+
+    assert summary_env == ["summary"] # Отдельная роль роутера, не answer
+    row = await ChatCRUD.get_summary(db, conversation.id)
+    await db.refresh(row) # Строку сохранила другая сессия
+    assert (row.summary, row.last_message_id) == ("summary 1", messages[3][0]) # Последние 2 остались дословно
+
+
+async def test_keep_recent_zero_folds_everything(db, conversation, summary_env, monkeypatch):
+    monkeypatch.setattr(settings, "SUMMARY_KEEP_RECENT", 0)
+    messages = await add_exchanges(db, conversation, 3)
+
+    await summarizer.update_summary(conversation.id)
+
+    row = await ChatCRUD.get_summary(db, conversation.id)
+    assert row.last_message_id == messages[-1][0]
+
+
+async def test_summary_moved_by_another_worker_is_not_overwritten(db, conversation, summary_env, sqlite_engine, monkeypatch):
+    messages = await add_exchanges(db, conversation, 3)
+
+    async def racing_answer(text, history=None, role="answer"):
+        # Другой воркер успел сохранить summary, пока этот ждал LLM
+        async with async_sessionmaker(sqlite_engine, expire_on_commit=False)() as other:
+            await ChatCRUD.save_summary(other, conversation.id, "newer", messages[-1][0])
+            await other.commit()
+        return "stale"
+
+    monkeypatch.setattr(summarizer, "groq_ai_answer", racing_answer)
+    await summarizer.update_summary(conversation.id)
+
+    row = await ChatCRUD.get_summary(db, conversation.id)
+    await db.refresh(row) # Строку сохранила другая сессия
+    assert (row.summary, row.last_message_id) == ("newer", messages[-1][0])
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from config import settings
+import topic_classifier
+
+
+@pytest.fixture
+def training_file(tmp_path, monkeypatch):
+    path = tmp_path / "labels.jsonl"
+    monkeypatch.setattr(settings, "CLASSIFIER_TRAINING_FILE", str(path))
+    monkeypatch.setattr(topic_classifier, "_recorded", None)
+    return path
+
+
+def rows(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+async def test_record_label_skips_duplicates(training_file):
+    await topic_classifier.record_label("Мне тревожно", True)
+    await topic_classifier.record_label("  мне ТРЕВОЖНО!!! ", True)
+    await topic_classifier.record_label("Рецепт борща", False)
+
+    assert [row["text"] for row in rows(training_file)] == ["Мне тревожно", "Рецепт борща"]
+
+
+async def test_record_label_caps_the_file(training_file, monkeypatch):
+    monkeypatch.setattr(settings, "CLASSIFIER_TRAINING_MAX", 3)
+    for i in range(7):
+        await topic_classifier.record_label(f"сообщение {i}", True)
+
+    # На седьмой записи файл превысил 2 × лимит и сжался до трёх самых свежих
+    assert [row["text"] for row in rows(training_file)] == ["сообщение 4", "сообщение 5", "сообщение 6"]
+
+
+def test_training_set_takes_latest_unique_history(training_file, monkeypatch):
+    monkeypatch.setattr(settings, "CLASSIFIER_TRAINING_MAX", 2)
+    monkeypatch.setattr(topic_classifier, "read_examples", lambda path: [("a", True), ("b", False), ("A!", False), ("c", True)]
+                        if path == str(training_file) else [("corpus", True)])
+    training_file.write_text("")
+
+    assert topic_classifier.load_training_examples() == [("corpus", True), ("A!", False), ("c", True)]
@@ -0,0 +1,113 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+import user_cache
+from crud import UserCRUD
+from models import User
+
+fakeredis = pytest.importorskip("fakeredis")
+
+EMAIL = "user@example.com"
+
+
+@pytest.fixture(autouse=True)
+def clear_user_cache():
+    user_cache._id_by_email.clear()
+    user_cache._user_by_id.clear()
+    yield
+    user_cache._id_by_email.clear()
+    user_cache._user_by_id.clear()
+
+
+@pytest.fixture
+async def cached_user(db):
+    db.add(User(email=EMAIL, password="hashed", user_free_tokens=3, subscription_status="inactive"))
+    await db.commit()
+    db.expunge_all()
+    return await user_cache.get_user(db, EMAIL) # Промах → снимок в кэше
+
+
+async def reload(db):
+    db.expunge_all() # Как новый запрос: новая сессия, объект берётся из кэша
+    return await user_cache.get_user(db, EMAIL)
+
+
+async def test_subscription_change_invalidates_snapshot(db, cached_user):
+    await UserCRUD.update_subscription(db, cached_user, "sub_1", "active", None)
+    await db.commit()
+
+    assert cached_user.id not in user_cache._user_by_id
+    assert (await reload(db)).subscription_status == "active"
+
+
+async def test_token_change_reaches_snapshot(db, cached_user):
+    assert await UserCRUD.update_user_tokens(db, cached_user)
+    await db.commit()
+
+    hits = user_cache._stats["hits"]
+    assert (await reload(db)).user_free_tokens == 2
+    assert user_cache._stats["hits"] == hits + 1 # Снимок обновлён на месте, без повторного SELECT
+
+
+async def test_merged_snapshot_is_never_written_back(db, cached_user, sqlite_engine):
+    statements = []
+    event.listen(sqlite_engine.sync_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+
+    user = await reload(db)
+    user_id = user.id
+    await db.commit()
+    assert not any(statement.lstrip().upper().startswith("UPDATE") for statement in statements) # merge(load=False) — объект «чистый»
+
+    # Изменение объекта в сессии запроса не попадает в общий снимок
+    user.subscription_status = "changed in request"
+    await db.rollback()
+    assert user_cache._user_by_id[user_id].subscription_status == "inactive"
+
+
+async def test_invalidation_is_broadcast_to_other_processes(db, cached_user):
+    server = fakeredis.FakeServer()
+    app = SimpleNamespace(state=SimpleNamespace(redis=fakeredis.FakeAsyncRedis(server=server, decode_responses=True)))
+    other_process = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+    user_cache.start_listener(app, retry_interval=0.01)
+    try:
+        for _ in range(100): # Ждём подписку (при подписке кэш процесса сбрасывается)
+            if (await other_process.pubsub_numsub(user_cache.CHANNEL))[0][1]:
+                break
+            await asyncio.sleep(0.01)
+        user = await reload(db)
+        assert user.id in user_cache._user_by_id
+
+        # Webhook в другом процессе обновил подписку → сообщение в канал → наш снимок сброшен
+        await other_process.publish(user_cache.CHANNEL, str(user.id))
+        for _ in range(100):
+            if user.id not in user_cache._user_by_id:
+                break
+            await asyncio.sleep(0.01)
+        assert user.id not in user_cache._user_by_id
+
+        # И в обратную сторону: наш commit рассылает id изменённого пользователя
+        pubsub = other_process.pubsub()
+        await pubsub.subscribe(user_cache.CHANNEL)
+        user = await reload(db)
+        await UserCRUD.update_subscription(db, user, "sub_1", "active", None)
+        await db.commit()
+        message = None
+        for _ in range(100):
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.01)
+            if message is not None:
+                break
+        assert message["data"] == str(user.id)
+        await pubsub.aclose()
+    finally:
+        await user_cache.stop_listener()
+
+
+async def test_rolled_back_invalidation_is_not_broadcast(db, cached_user):
+    await UserCRUD.update_subscription(db, cached_user, "sub_1", "active", None)
+    assert db.sync_session.info["user_cache_invalidations"] == {cached_user.id}
+    await db.rollback()
+    assert "user_cache_invalidations" not in db.sync_session.info
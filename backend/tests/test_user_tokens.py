@@ -0,0 +1,92 @@
+# Списание бесплатных токенов: атомарность под параллельными запросами и обновление кэша пользователей только после commit
+# Параллельный тест — на настоящем Postgres (SQLite сериализует запись и гонку не покажет): TEST_POSTGRES_URL=... pytest tests/test_user_tokens.py
+# Таблицы создаются в отдельной схеме test_user_tokens — базу можно делить с test_query_plans
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from crud import UserCRUD
+from models import Base, User
+import user_cache
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+PARALLEL = 20
+SCHEMA = "test_user_tokens"
+
+
+@pytest.fixture(autouse=True)
+def clear_user_cache():
+    user_cache._id_by_email.clear()
+    user_cache._user_by_id.clear()
+    yield
+    user_cache._id_by_email.clear()
+    user_cache._user_by_id.clear()
+
+
+@pytest.fixture
+async def postgres_engine():
+    if not TEST_POSTGRES_URL:
+        pytest.skip("TEST_POSTGRES_URL не задан")
+    admin = create_async_engine(TEST_POSTGRES_URL)
+    async with admin.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    await admin.dispose()
+
+    engine = create_async_engine(TEST_POSTGRES_URL, pool_size=PARALLEL, connect_args={"server_settings": {"search_path": SCHEMA}})
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    await engine.dispose()
+
+
+async def test_parallel_decrements_spend_the_last_token_once(postgres_engine):
+    session_factory = async_sessionmaker(postgres_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        user = User(email="user@example.com", password="hashed", user_free_tokens=1)
+        db.add(user)
+        await db.commit()
+        user_id = user.id
+
+    start = asyncio.Event()
+
+    async def spend():
+        async with session_factory() as db:
+            user = await db.get(User, user_id) # Каждый запрос видит user_free_tokens=1 до списания
+            await start.wait()
+            spent = await UserCRUD.update_user_tokens(db, user)
+            await asyncio.sleep(0.05) # Держим блокировку строки, пока остальные UPDATE ждут
+            await db.commit()
+            return spent
+
+    tasks = [asyncio.create_task(spend()) for _ in range(PARALLEL)]
+    await asyncio.sleep(0.2)
+    start.set()
+    results = await asyncio.gather(*tasks)
+
+    assert results.count(True) == 1
+    async with session_factory() as db:
+        assert (await db.get(User, user_id)).user_free_tokens == 0
+
+
+async def test_cache_changes_only_after_commit(db):
+    db.add(User(email="user@example.com", password="hashed", user_free_tokens=3))
+    await db.commit()
+
+    user = await user_cache.get_user(db, "user@example.com") # Кладёт снимок в кэш
+    assert await UserCRUD.update_user_tokens(db, user)
+    await db.rollback()
+    db.expunge_all()
+    assert (await user_cache.get_user(db, "user@example.com")).user_free_tokens == 3
+
+    db.expunge_all()
+    user = await user_cache.get_user(db, "user@example.com")
+    assert await UserCRUD.update_user_tokens(db, user)
+    await db.commit()
+    db.expunge_all()
+    assert (await user_cache.get_user(db, "user@example.com")).user_free_tokens == 2
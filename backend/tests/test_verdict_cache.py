@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from cachetools import TTLCache
+
+import verdict_cache
+from config import settings
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(verdict_cache, "_local_cache", TTLCache(maxsize=2, ttl=60, timer=clock))
+    return clock
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis(decode_responses=True) # Как клиент приложения (RedisHealthMonitor)
+
+
+def test_variants_of_a_phrase_share_one_key():
+    key = verdict_cache.cache_key("Спасибо за помощь")
+    assert verdict_cache.cache_key("  спасибо   ЗА помощь!!! ") == key
+    assert verdict_cache.cache_key("Спасибо, за помощь?") == key
+    assert verdict_cache.cache_key("Спасибо за помощь, друг") != key
+
+
+async def test_local_tier_is_checked_before_redis(clock, redis):
+    await verdict_cache.set_remote(redis, "Привет", True)
+    assert verdict_cache.get_local("привет!") is True
+    assert await redis.get(verdict_cache.cache_key("Привет")) == "1"
+
+    # Фраза вытеснена из LRU (maxsize=2) → её отдаёт Redis и поднимает обратно в память процесса
+    verdict_cache.set_local("раз", False)
+    verdict_cache.set_local("два", False)
+    assert verdict_cache.get_local("Привет") is None
+    assert await verdict_cache.get_remote(redis, "Привет") is True
+    assert verdict_cache.get_local("Привет") is True
+
+
+async def test_verdicts_expire(clock, redis, monkeypatch):
+    monkeypatch.setattr(settings, "VERDICT_CACHE_TTL", 60)
+    await verdict_cache.set_remote(redis, "Рецепт борща", False)
+    assert 0 < await redis.ttl(verdict_cache.cache_key("Рецепт борща")) <= 60
+
+    clock.now += 61
+    assert verdict_cache.get_local("Рецепт борща") is None
+
+    await redis.pexpire(verdict_cache.cache_key("Рецепт борща"), 1) # Досрочно истекаем ключ в Redis
+    await asyncio.sleep(0.01)
+    assert await verdict_cache.get_remote(redis, "Рецепт борща") is None
+
+
+async def test_without_redis_only_local_tier_is_used(clock):
+    await verdict_cache.set_remote(None, "Пока", True)
+    assert verdict_cache.get_local("пока") is True
+    assert await verdict_cache.get_remote(None, "Другое") is None
@@ -0,0 +1,82 @@
+import datetime
+
+from crud import StripeEventCRUD, utcnow
+from models import StripeEvent
+import webhook_worker
+
+T0 = datetime.datetime(2026, 1, 1, 12, 0, 0)
+
+
+def add_event(db, event_id, customer_id, created, received_offset):
+    db.add(StripeEvent(id=event_id, type="invoice.paid", customer_id=customer_id, payload={}, created=created,
+                       status="pending", attempts=0, received_at=T0 + datetime.timedelta(seconds=received_offset)))
+
+
+async def test_heads_are_earliest_event_per_customer_in_arrival_order(db):
+    add_event(db, "evt_z1", "cus_z", created=100, received_offset=0) # Клиент с "поздним" id пришёл первым
+    add_event(db, "evt_a2", "cus_a", created=300, received_offset=5)
+    add_event(db, "evt_a1", "cus_a", created=200, received_offset=6) # Создан раньше, доставлен позже — всё равно голова
+    add_event(db, "evt_m1", "cus_m", created=150, received_offset=3)
+    await db.commit()
+
+    heads = await StripeEventCRUD.get_pending_heads(db, limit=10)
+    assert heads == [("evt_z1", "cus_z"), ("evt_m1", "cus_m"), ("evt_a1", "cus_a")]
+    assert await StripeEventCRUD.get_pending_heads(db, limit=2) == heads[:2]
+
+
+async def test_done_events_are_not_heads(db):
+    add_event(db, "evt_1", "cus_a", created=100, received_offset=0)
+    add_event(db, "evt_2", "cus_a", created=200, received_offset=1)
+    await db.commit()
+
+    event = await db.get(StripeEvent, "evt_1")
+    await StripeEventCRUD.mark_done(db, event)
+    await db.commit()
+    assert await StripeEventCRUD.get_pending_heads(db, limit=10) == [("evt_2", "cus_a")]
+
+
+async def test_failed_head_waits_for_backoff_and_blocks_its_customer(db):
+    add_event(db, "evt_1", "cus_a", created=100, received_offset=0)
+    add_event(db, "evt_2", "cus_a", created=200, received_offset=1)
+    add_event(db, "evt_3", "cus_b", created=300, received_offset=2)
+    await db.commit()
+
+    await StripeEventCRUD.mark_failed(db, "evt_1", "boom", max_attempts=5, retry_base=5, retry_max=600)
+    await db.commit()
+
+    # Во время паузы голова cus_a не выдаётся, а его следующее событие её не обгоняет
+    assert await StripeEventCRUD.get_pending_heads(db, limit=10) == [("evt_3", "cus_b")]
+    later = utcnow() + datetime.timedelta(seconds=6)
+    assert await StripeEventCRUD.get_pending_heads(db, limit=10, now=later) == [("evt_1", "cus_a"), ("evt_3", "cus_b")]
+
+
+async def test_backoff_grows_and_event_fails_after_max_attempts(db):
+    add_event(db, "evt_1", "cus_a", created=100, received_offset=0)
+    await db.commit()
+
+    delays = []
+    for _ in range(3):
+        before = utcnow()
+        await StripeEventCRUD.mark_failed(db, "evt_1", "boom", max_attempts=4, retry_base=5, retry_max=12)
+        event = await db.get(StripeEvent, "evt_1")
+        delays.append(round((event.next_attempt_at - before).total_seconds()))
+    assert delays == [5, 10, 12]
+
+    await StripeEventCRUD.mark_failed(db, "evt_1", "boom", max_attempts=4, retry_base=5, retry_max=12)
+    assert (await db.get(StripeEvent, "evt_1")).status == "failed"
+
+
+async def test_handled_failure_keeps_the_worker_busy(db, monkeypatch):
+    add_event(db, "evt_1", "cus_a", created=100, received_offset=0)
+    await db.commit()
+
+    async def failing_handler(payload, db):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(webhook_worker, "handle_webhook_event", failing_handler)
+    pool = webhook_worker.WebhookWorkerPool(workers=1, poll_interval=60, max_attempts=5, retry_base=5, retry_max=600)
+
+    # Ошибка обработана (событие на паузе) → True: воркер не засыпает, пока ждут другие клиенты
+    assert await pool._process_event(db, "evt_1") is True
+    event = await db.get(StripeEvent, "evt_1", populate_existing=True)
+    assert (event.status, event.attempts) == ("pending", 1)
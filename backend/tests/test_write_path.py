@@ -0,0 +1,70 @@
+# Микробенчмарк пути записи сообщения: сколько обращений к БД уходит на один обмен (вопрос + ответ)
+# pytest -s tests/test_write_path.py — печатает сравнение «до / после»
+from sqlalchemy import event, update, func
+
+from crud import ChatCRUD
+from models import Conversation, Message
+
+
+class RoundTripCounter:
+    def __init__(self, engine):
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_statement)
+        event.listen(engine.sync_engine, "commit", self._on_commit)
+
+    def _on_statement(self, *args):
+        self.statements += 1
+
+    def _on_commit(self, *args):
+        self.commits += 1
+
+    @property
+    def round_trips(self) -> int:
+        return self.statements + self.commits
+
+
+# Путь записи до user-008 (для сравнения): add_message на каждую реплику, commit + refresh в каждом шаге
+async def _legacy_update_conversation_time(db, conversation_id):
+    result = await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(updated_at=func.now()).returning(Conversation))
+    conversation = result.scalar_one_or_none()
+    if conversation:
+        await db.commit()
+        await db.refresh(conversation)
+    return conversation
+
+async def _legacy_add_message(db, conversation_id, role, content):
+    message = Message(conversation_id=conversation_id, role=role, content=content)
+    db.add(message)
+    await _legacy_update_conversation_time(db, conversation_id)
+    await db.commit()
+    await db.refresh(message)
+    return message
+
+
+async def _measure(sqlite_engine, write):
+    counter = RoundTripCounter(sqlite_engine)
+    await write()
+    return counter
+
+
+async def test_exchange_round_trips(db, conversation, sqlite_engine):
+    async def legacy():
+        await _legacy_add_message(db, conversation.id, "user", "question")
+        await _legacy_add_message(db, conversation.id, "assistant", "answer")
+
+    async def batched():
+        await ChatCRUD.add_exchange(db, conversation.id, "question", "answer")
+        await db.commit()
+
+    before = await _measure(sqlite_engine, legacy)
+    event.remove(sqlite_engine.sync_engine, "before_cursor_execute", before._on_statement)
+    event.remove(sqlite_engine.sync_engine, "commit", before._on_commit)
+    after = await _measure(sqlite_engine, batched)
+
+    print(f"\nround-trips per exchange: before={before.round_trips} ({before.statements} statements, {before.commits} commits) | "
+          f"after={after.round_trips} ({after.statements} statements, {after.commits} commits)")
+    assert after.commits == 1
+    assert after.round_trips < before.round_trips
+    # UPDATE conversations + INSERT сообщений (на Postgres — один INSERT ... VALUES (...), (...) RETURNING)
+    assert after.statements <= 3
@@ -0,0 +1,253 @@
+# Локальный классификатор тематики сообщений (работает в процессе, без запроса к LLM)
+# Хэшированные символьные n-граммы + логистическая регрессия, обучение на примерах при старте.
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Optional, Tuple, List
+
+from config import settings
+from verdict_cache import normalize
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# Размеченный RU/EN корпус для обучения и отложенная выборка для бенчмарка (не пересекаются) | JSONL: {"text": "...", "label": true/false}
+CORPUS_FILE = os.path.join(DATA_DIR, "topic_corpus.jsonl")
+BENCHMARK_FILE = os.path.join(DATA_DIR, "topic_benchmark.jsonl")
+
+# Пороги уверенности, из которых выбирается рабочий при обучении
+_THRESHOLD_GRID = [0.5 + step / 100 for step in range(50)]
+
+
+class LocalTopicClassifier:
+    def __init__(self):
+        self._vectorizers = None
+        self._model = None
+        self._weights = None
+        self._intercept = 0.0
+        self._analyzers = []
+        self._hash = None
+        self.threshold = 1.0 # Уверенность, начиная с которой верим модели без LLM (подбирается в fit)
+        self.calibration = {}
+
+    @property
+    def is_ready(self) -> bool:
+        return self._model is not None
+
+    def _transform(self, texts: List[str]):
+        from scipy.sparse import hstack
+        return hstack([vectorizer.transform(texts) for vectorizer in self._vectorizers]).tocsr()
+
+    @staticmethod
+    def _make_model():
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(C=10.0, class_weight="balanced", max_iter=1000)
+
+    def fit(self, examples: List[Tuple[str, bool]]) -> None:
+        # Импортируем scikit-learn лениво — если пакета нет, классификатор просто не используется
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.model_selection import StratifiedKFold, cross_val_predict
+        from sklearn.utils import murmurhash3_32
+
+        # Слова и пары слов ("boss yells") + символьные n-граммы внутри слов (устойчивы к опечаткам и окончаниям — важно для русского)
+        self._vectorizers = [
+            HashingVectorizer(analyzer="word", ngram_range=(1, 2), n_features=2 ** 18, alternate_sign=False, lowercase=True, norm="l2"),
+            HashingVectorizer(analyzer="char_wb", ngram_range=(2, 4), n_features=2 ** 18, alternate_sign=False, lowercase=True, norm="l2"),
+        ]
+        texts = [text for text, _ in examples]
+        labels = [int(label) for _, label in examples]
+        features = self._transform(texts)
+
+        # Порог калибруем на отложенных фолдах: каждый пример оценивает модель, которая его не видела
+        folds = StratifiedKFold(n_splits=5, shuffle=True, random_state=0)
+        held_out = cross_val_predict(self._make_model(), features, labels, cv=folds, method="predict_proba")[:, 1]
+        self.threshold, self.calibration = calibrate_threshold(held_out, labels, settings.CLASSIFIER_TARGET_ACCURACY)
+
+        model = self._make_model()
+        model.fit(features, labels)
+        self._model = model
+        # Для предсказания — веса обычным списком: одно сообщение считаем вручную, без накладных расходов sklearn/scipy
+        self._weights = model.coef_[0].tolist()
+        self._intercept = float(model.intercept_[0])
+        self._analyzers = [(vectorizer.build_analyzer(), vectorizer.n_features) for vectorizer in self._vectorizers]
+        self._hash = murmurhash3_32
+
+    def _probability(self, text: str) -> float:
+        # То же, что predict_proba(_transform([text])): хэш признака → индекс, L2-нормировка, логистическая функция
+        score = self._intercept
+        offset = 0
+        for analyzer, n_features in self._analyzers:
+            counts = Counter()
+            for token in analyzer(text):
+                hashed = self._hash(token, seed=0)
+                counts[(2147483647 if hashed == -2147483648 else abs(hashed)) % n_features] += 1
+            norm = math.sqrt(sum(count * count for count in counts.values()))
+            if norm:
+                score += sum(self._weights[offset + index] * count for index, count in counts.items()) / norm
+            offset += n_features
+        return 1 / (1 + math.exp(-score))
+
+    def predict(self, text: str) -> Tuple[bool, float]:
+        # Возвращает (относится ли к психологии, уверенность модели 0.5..1.0)
+        probability = self._probability(text)
+        return probability >= 0.5, max(probability, 1 - probability)
+
+    def is_confident(self, confidence: float) -> bool:
+        # CLASSIFIER_CONFIDENCE > 0 — ручной порог, иначе подобранный при обучении
+        return confidence >= (settings.CLASSIFIER_CONFIDENCE or self.threshold)
+
+
+def calibrate_threshold(probabilities, labels: List[int], target_accuracy: float) -> Tuple[float, dict]:
+    # Самый низкий порог, при котором точность уверенных ответов на отложенной выборке не ниже target_accuracy
+    # Ниже порог → больше сообщений обходятся без LLM | Если цель недостижима — 1.0 (все сомнительные идут в LLM)
+    scored = [(max(p, 1 - p), bool(p >= 0.5) == bool(label)) for p, label in zip(probabilities.tolist(), labels)]
+    for threshold in _THRESHOLD_GRID:
+        confident = [correct for confidence, correct in scored if confidence >= threshold]
+        if confident and sum(confident) / len(confident) >= target_accuracy:
+            return threshold, {"threshold": threshold, "held_out_accuracy": round(sum(confident) / len(confident), 4),
+                               "coverage": round(len(confident) / len(scored), 4), "samples": len(scored)}
+    return 1.0, {"threshold": 1.0, "held_out_accuracy": None, "coverage": 0.0, "samples": len(scored)}
+
+
+def read_examples(path: str) -> List[Tuple[str, bool]]:
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                examples.append((row["text"], bool(row["label"])))
+    return examples
+
+
+def latest_unique(examples: List[Tuple[str, bool]], limit: int) -> List[Tuple[str, bool]]:
+    # Один пример на нормализованный текст (побеждает последний вердикт), не больше limit самых свежих
+    unique = {}
+    for text, label in examples:
+        key = normalize(text)
+        unique.pop(key, None)
+        unique[key] = (text, label)
+    return list(unique.values())[-limit:] if limit > 0 else []
+
+
+def load_training_examples() -> List[Tuple[str, bool]]:
+    # Размеченный корпус + история: вердикты LLM по сообщениям, в которых модель сомневалась (см. record_label)
+    # Из истории — не больше CLASSIFIER_TRAINING_MAX примеров: время обучения с кросс-валидацией при старте не растёт вместе с файлом
+    examples = read_examples(CORPUS_FILE)
+    path = settings.CLASSIFIER_TRAINING_FILE
+    if path and os.path.exists(path):
+        examples.extend(latest_unique(read_examples(path), settings.CLASSIFIER_TRAINING_MAX))
+    return examples
+
+
+_labels_lock = threading.Lock()
+_recorded: Optional[set] = None # Нормализованные тексты, которые уже есть в CLASSIFIER_TRAINING_FILE
+
+
+def _write_label(path: str, text: str, label: bool) -> None:
+    global _recorded
+    with _labels_lock:
+        if _recorded is None:
+            _recorded = {normalize(example) for example, _ in read_examples(path)} if os.path.exists(path) else set()
+        key = normalize(text)
+        if key in _recorded:
+            return # Повторяющиеся фразы не раздувают файл и не перевешивают остальные примеры
+
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"text": text, "label": label}, ensure_ascii=False) + "\n")
+        _recorded.add(key)
+
+        # Файл вырос вдвое больше лимита → оставляем CLASSIFIER_TRAINING_MAX самых свежих (перезапись раз в MAX записей, а не на каждой)
+        limit = settings.CLASSIFIER_TRAINING_MAX
+        if len(_recorded) > 2 * limit:
+            kept = latest_unique(read_examples(path), limit)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                for example, example_label in kept:
+                    f.write(json.dumps({"text": example, "label": example_label}, ensure_ascii=False) + "\n")
+            os.replace(path + ".tmp", path)
+            _recorded = {normalize(example) for example, _ in kept}
+
+
+async def record_label(text: str, label: bool) -> None:
+    # Вердикт LLM → в CLASSIFIER_TRAINING_FILE, модель дообучится на нём при следующем старте
+    # Пишем только сомнительные для модели сообщения — именно на них она ошибается | Файл пишем в потоке, не блокируя event loop
+    path = settings.CLASSIFIER_TRAINING_FILE
+    if not path:
+        return
+    try:
+        await asyncio.to_thread(_write_label, path, text, label)
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить пример для классификатора: {e}")
+
+
+_classifier = LocalTopicClassifier()
+_unavailable = False
+
+
+def get_classifier() -> Optional[LocalTopicClassifier]:
+    global _unavailable
+    if _classifier.is_ready:
+        return _classifier
+    if _unavailable:
+        return None
+
+    # Обучаем модель при первом обращении (доли секунды)
+    try:
+        _classifier.fit(load_training_examples())
+        return _classifier
+    except Exception as e:
+        print(f"⚠️ Локальный классификатор недоступен: {e}")
+        _unavailable = True
+        return None
+
+
+def classify(text: str) -> Optional[Tuple[bool, float, bool]]:
+    # (относится ли к психологии, уверенность, можно ли верить без LLM) или None, если модели нет
+    classifier = get_classifier()
+    if classifier is None:
+        return None
+    is_related, confidence = classifier.predict(text)
+    return is_related, confidence, classifier.is_confident(confidence)
+
+
+def run_benchmark(with_llm: bool = False) -> None:
+    classifier = get_classifier()
+    if classifier is None:
+        print("scikit-learn не установлен — бенчмарк невозможен")
+        return
+
+    corpus = read_examples(BENCHMARK_FILE)
+    correct = 0
+    confident = 0
+    confident_correct = 0
+    started = time.perf_counter()
+    for text, label in corpus:
+        predicted, confidence = classifier.predict(text)
+        correct += predicted == label
+        if classifier.is_confident(confidence):
+            confident += 1
+            confident_correct += predicted == label
+    elapsed_ms = (time.perf_counter() - started) * 1000 / len(corpus)
+    print(f"calibration: {classifier.calibration}")
+    print(f"local: accuracy={correct / len(corpus):.2%} | confident={confident}/{len(corpus)} "
+          f"(accuracy {confident_correct / max(confident, 1):.2%}) | {elapsed_ms:.3f} ms/message")
+
+    if with_llm:
+        from question_control import llm_is_psychology_related
+
+        async def run_llm():
+            llm_correct = 0
+            llm_started = time.perf_counter()
+            for llm_text, llm_label in corpus:
+                llm_correct += await llm_is_psychology_related(llm_text) == llm_label
+            llm_elapsed_ms = (time.perf_counter() - llm_started) * 1000 / len(corpus)
+            print(f"llm:   accuracy={llm_correct / len(corpus):.2%} | {llm_elapsed_ms:.1f} ms/message")
+
+        asyncio.run(run_llm())
+
+
+if __name__ == "__main__":
+    # python topic_classifier.py [--llm]
+    import sys
+    run_benchmark(with_llm="--llm" in sys.argv)
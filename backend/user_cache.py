@@ -0,0 +1,147 @@
+# Кэш строки пользователя между запросами (в памяти процесса, короткий TTL)
+# В кэше лежит отсоединённая копия User — в сессию запроса она попадает через merge(load=False), без SELECT.
+# Записи в подписку / токены / пароль сбрасывают кэш (см. UserCRUD).
+# Сброс после commit рассылается остальным процессам через Redis pub/sub — подписка из webhook видна везде сразу, а не через USER_CACHE_TTL.
+import asyncio
+from typing import Optional
+
+from cachetools import TTLCache
+from redis.asyncio import RedisError
+from sqlalchemy import event, select, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from config import settings
+from models import User
+
+_id_by_email = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+_user_by_id = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+_stats = {"hits": 0, "misses": 0}
+
+CHANNEL = "user_cache:invalidate"
+_app = None # Приложение с клиентом Redis в app.state.redis (задаёт start_listener) | None — только локальный сброс
+_listener_task: Optional[asyncio.Task] = None
+_publish_tasks = set()
+
+
+def _snapshot(user: User) -> User:
+    # Копия только с колонками: объект из сессии запроса может меняться, а кэш — нет
+    copy = User(**{attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+async def get_user(db: AsyncSession, email: str) -> Optional[User]:
+    user_id = _id_by_email.get(email)
+    cached = _user_by_id.get(user_id) if user_id is not None else None
+    if cached is not None:
+        _stats["hits"] += 1
+        return await db.merge(cached, load=False)
+
+    _stats["misses"] += 1
+    result = await db.execute(select(User).where(User.email == email))
+    user = result.scalar_one_or_none()
+    if user is not None:
+        _id_by_email[email] = user.id
+        _user_by_id[user.id] = _snapshot(user)
+    return user
+
+
+def invalidate(db: AsyncSession, user: User) -> None:
+    # Сразу — для этого процесса, после commit — ещё раз и для остальных процессов
+    _user_by_id.pop(user.id, None)
+    _id_by_email.pop(user.email, None)
+    db.sync_session.info.setdefault("user_cache_invalidations", set()).add(user.id)
+
+
+def set_committed(db: AsyncSession, user: User, key: str, value) -> None:
+    # Точечно обновляем поле в кэше, не сбрасывая запись целиком | Только после commit сессии: при rollback в кэше остаётся прежнее значение
+    db.sync_session.info.setdefault("user_cache_updates", []).append((user.id, key, value))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed(session):
+    for user_id, key, value in session.info.pop("user_cache_updates", []):
+        cached = _user_by_id.get(user_id)
+        if cached is not None:
+            set_committed_value(cached, key, value)
+
+    invalidated = session.info.pop("user_cache_invalidations", None)
+    if invalidated:
+        for user_id in invalidated:
+            _user_by_id.pop(user_id, None) # Пока шла транзакция, параллельный запрос мог закэшировать старую строку
+        _broadcast(invalidated)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_uncommitted(session):
+    session.info.pop("user_cache_updates", None)
+    session.info.pop("user_cache_invalidations", None)
+
+
+def _broadcast(user_ids) -> None:
+    # after_commit синхронный → публикуем отдельной задачей | Без Redis или вне event loop — только локальный сброс
+    redis = _app.state.redis if _app is not None else None
+    if redis is None:
+        return
+    try:
+        task = asyncio.get_running_loop().create_task(_publish(redis, list(user_ids)))
+    except RuntimeError:
+        return
+    _publish_tasks.add(task) # Держим ссылку, пока задача не завершится
+    task.add_done_callback(_publish_tasks.discard)
+
+
+async def _publish(redis, user_ids) -> None:
+    try:
+        for user_id in user_ids:
+            await redis.publish(CHANNEL, str(user_id))
+    except RedisError as e:
+        print(f"⚠️ User cache: не удалось разослать сброс кэша: {e}")
+
+
+async def _listen(app, retry_interval: float) -> None:
+    # Работаем, пока слушатель не остановлен (stop_listener сбрасывает _app) — не полагаемся только на отмену задачи
+    while _app is app:
+        redis = app.state.redis
+        if redis is not None:
+            try:
+                pubsub = redis.pubsub()
+                try:
+                    await pubsub.subscribe(CHANNEL)
+                    # Пока подписки не было (старт, обрыв связи), сбросы других процессов терялись — начинаем с пустого кэша
+                    _user_by_id.clear()
+                    while _app is app:
+                        # Короткий timeout ожидания — не упираемся в socket_timeout клиента на тихом канале
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message is not None:
+                            _user_by_id.pop(int(message["data"]), None)
+                finally:
+                    await pubsub.aclose()
+            except (RedisError, OSError) as e:
+                print(f"⚠️ User cache: подписка на сбросы прервана: {e}")
+        await asyncio.sleep(retry_interval)
+
+
+def start_listener(app, retry_interval: float = 5) -> None:
+    global _app, _listener_task
+    _app = app
+    _listener_task = asyncio.create_task(_listen(app, retry_interval))
+
+
+async def stop_listener() -> None:
+    global _app, _listener_task
+    _app = None
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+    _listener_task = None
+
+
+def get_stats() -> dict:
+    return {**_stats, "size": len(_user_by_id)}
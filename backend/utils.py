@@ -1,10 +1,14 @@
 #Для рещения проблемы с цикличным импортом
 import os
+import re
+from typing import Optional
+
 import jinja2
 import markdown
+from markdown.treeprocessors import Treeprocessor
 from fastapi.templating import Jinja2Templates
 from fastapi import Request, HTTPException
-from redis.asyncio import Redis, RedisError
+from redis.asyncio import Redis
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
@@ -25,21 +29,54 @@ templates = Jinja2Templates(
 )
 
 
+# Ответ ИИ — недоверенный текст (prompt injection может подсунуть в него разметку) → markdown без сырого HTML:
+# теги и комментарии из ответа выводятся как текст, ссылки — только http(s)/mailto, картинки заменяются их подписью
+_SAFE_URL = re.compile(r"^(https?://|mailto:)", re.IGNORECASE)
+
+class _SafeLinks(Treeprocessor):
+    def run(self, root):
+        for element in root.iter():
+            if element.tag == "img": # Внешняя картинка — это запрос к чужому серверу (утечка данных через URL)
+                alt = element.get("alt", "")
+                element.attrib.clear()
+                element.tag, element.text = "span", alt
+            elif element.tag == "a" and not _SAFE_URL.match("".join(element.get("href", "").split())):
+                element.attrib.pop("href", None) # javascript:, data: и т.п. — остаётся только текст ссылки
+
+class _NoRawHtml(markdown.Extension):
+    def extendMarkdown(self, md):
+        md.preprocessors.deregister("html_block")
+        md.inlinePatterns.deregister("html")
+        md.treeprocessors.register(_SafeLinks(md), "safe_links", 0)
+
+def render_markdown(text: str) -> str:
+    return markdown.markdown(text, extensions=["nl2br", "fenced_code", _NoRawHtml()])
+
 # Регистрация фильтра Markdown для красивого рендеринга ответов ИИ
-templates.env.filters["markdown"] = lambda text: markdown.markdown(
-    text,
-    extensions=["nl2br", "fenced_code"]
-)
+templates.env.filters["markdown"] = render_markdown
+
+
+# Версия рендера Message.html | Поменялся шаблон или markdown → увеличить: строки со старой версией рендерятся заново при показе
+MESSAGE_HTML_VERSION = 2
+templates.env.globals["MESSAGE_HTML_VERSION"] = MESSAGE_HTML_VERSION
+
+# HTML-блок сообщения для истории чата (как partials/message_block.html) | Считается один раз при сохранении и хранится в Message.html
+def render_message_html(role: str, content: str) -> str:
+    return templates.get_template("partials/message_block.html").render(role=role, content=content)
+
+
+#Redis клиент, если фоновый монитор считает его живым (без сетевого запроса), иначе None
+def get_healthy_redis(request: Request) -> Optional[Redis]:
+    monitor = getattr(request.app.state, 'redis_monitor', None)
+    if monitor is None or not monitor.healthy:
+        return None
+    return request.app.state.redis
 
 
 #Зависимость для получения Redis клиента
 async def get_redis(request: Request) -> Redis:
-    if not hasattr(request.app.state, 'redis') or request.app.state.redis is None:
+    # Живость проверяет фоновый RedisHealthMonitor (main.lifespan) — здесь только читаем флаг, без PING на каждый запрос
+    redis = get_healthy_redis(request)
+    if redis is None:
         raise HTTPException(status_code=503, detail="Redis unavailable")
-
-        # Дополнительная проверка живости (опционально, но полезно)
-    try:
-        await request.app.state.redis.ping()
-        return request.app.state.redis
-    except RedisError:
-        raise HTTPException(status_code=503, detail="Redis connection lost")
\ No newline at end of file
+    return redis
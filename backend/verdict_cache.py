@@ -0,0 +1,91 @@
+# Кэш вердиктов классификатора тематики (YES/NO) по нормализованному тексту сообщения
+# Два уровня: LRU в памяти процесса (горячие фразы) → Redis с TTL (общий для всех воркеров)
+import hashlib
+import re
+from typing import Optional
+
+from cachetools import TTLCache
+from redis.asyncio import Redis, RedisError
+
+from config import settings
+
+_local_cache = TTLCache(maxsize=settings.VERDICT_CACHE_LOCAL_SIZE, ttl=settings.VERDICT_CACHE_TTL)
+
+# Счётчики для /metrics: сколько запросов к LLM-классификатору сэкономил кэш
+_stats = {
+    "local_hits": 0,
+    "redis_hits": 0,
+    "misses": 0,
+    "llm_calls": 0,
+    "llm_seconds": 0.0,
+}
+
+
+def normalize(text: str) -> str:
+    # "  Спасибо за помощь!!! " → "спасибо за помощь"
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def cache_key(text: str) -> str:
+    digest = hashlib.sha256(normalize(text).encode()).hexdigest()[:32]
+    return f"classifier:verdict:{digest}"
+
+
+def get_local(text: str) -> Optional[bool]:
+    verdict = _local_cache.get(cache_key(text))
+    if verdict is not None:
+        _stats["local_hits"] += 1
+    return verdict
+
+
+def set_local(text: str, verdict: bool) -> None:
+    _local_cache[cache_key(text)] = verdict
+
+
+async def get_remote(redis: Optional[Redis], text: str) -> Optional[bool]:
+    key = cache_key(text)
+    if redis is not None:
+        try:
+            value = await redis.get(key)
+        except RedisError as e:
+            print(f"⚠️ Кэш вердиктов: Redis недоступен: {e}")
+            value = None
+
+        if value is not None:
+            _stats["redis_hits"] += 1
+            verdict = value == "1"
+            _local_cache[key] = verdict # Поднимаем фразу в локальный уровень
+            return verdict
+
+    _stats["misses"] += 1
+    return None
+
+
+async def set_remote(redis: Optional[Redis], text: str, verdict: bool) -> None:
+    key = cache_key(text)
+    _local_cache[key] = verdict
+    if redis is None:
+        return
+    try:
+        await redis.set(key, "1" if verdict else "0", ex=settings.VERDICT_CACHE_TTL)
+    except RedisError as e:
+        print(f"⚠️ Кэш вердиктов: не удалось сохранить в Redis: {e}")
+
+
+def record_llm_call(seconds: float) -> None:
+    _stats["llm_calls"] += 1
+    _stats["llm_seconds"] += seconds
+
+
+def get_stats() -> dict:
+    hits = _stats["local_hits"] + _stats["redis_hits"]
+    total = hits + _stats["misses"]
+    avg_llm_ms = _stats["llm_seconds"] * 1000 / _stats["llm_calls"] if _stats["llm_calls"] else 0.0
+    return {
+        **_stats,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+        "avg_llm_ms": round(avg_llm_ms, 1),
+        "saved_llm_ms_estimate": round(hits * avg_llm_ms, 1), # Верхняя оценка: часть локальных попаданий решила бы и локальная модель
+        "local_size": len(_local_cache),
+    }
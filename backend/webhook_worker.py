@@ -0,0 +1,97 @@
+# Пул воркеров, которые разбирают очередь webhook-событий Stripe (таблица stripe_events)
+# /webhook/stripe только проверяет подпись и кладёт событие в очередь — вся работа с БД идёт здесь, вне HTTP-запроса.
+# Порядок: у каждого клиента берётся только самое раннее событие, и только под advisory-локом этого клиента.
+import asyncio
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from billing import handle_webhook_event
+from config import settings
+from crud import StripeEventCRUD
+from database import direct_engine
+from models import StripeEvent
+
+
+class WebhookWorkerPool:
+    def __init__(self, workers: int, poll_interval: float, max_attempts: int, retry_base: float, retry_max: float):
+        self.workers = workers
+        self.poll_interval = poll_interval # Опрос БД на случай событий, положенных другим процессом (и повторов после паузы)
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run(n)) for n in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        # Новое событие в очереди → будим воркеров, не дожидаясь poll_interval
+        self._wakeup.set()
+
+    async def _run(self, worker_number: int):
+        while True:
+            try:
+                processed = await self.process_next()
+            except Exception as e:
+                print(f"Webhook worker {worker_number}: ошибка {e}")
+                processed = False
+
+            if not processed:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_next(self) -> bool:
+        # Сессия привязана к одному соединению — advisory-лок живёт на нём между commit-ами (поэтому в обход PgBouncer)
+        async with direct_engine.connect() as conn:
+            async with AsyncSession(bind=conn, expire_on_commit=False) as db:
+                heads = await StripeEventCRUD.get_pending_heads(db, limit=self.workers * 4)
+                await db.commit()
+
+                for event_id, customer_id in heads:
+                    if not await StripeEventCRUD.try_lock_customer(db, customer_id):
+                        continue # Клиентом уже занимается другой воркер
+                    await db.commit()
+                    try:
+                        return await self._process_event(db, event_id)
+                    finally:
+                        await StripeEventCRUD.unlock_customer(db, customer_id)
+                        await db.commit()
+        return False
+
+    async def _process_event(self, db: AsyncSession, event_id: str) -> bool:
+        event: Optional[StripeEvent] = await db.get(StripeEvent, event_id, populate_existing=True)
+        if event is None or event.status != "pending":
+            return True # Уже обработано другим воркером, пока мы брали лок
+
+        try:
+            # Изменения пользователя и статус события — одной транзакцией
+            await handle_webhook_event(event.payload, db)
+            await StripeEventCRUD.mark_done(db, event)
+            await db.commit()
+            return True
+        except Exception as e:
+            await db.rollback()
+            print(f"Ошибка обработки события Stripe {event_id}: {e}")
+            await StripeEventCRUD.mark_failed(db, event_id, str(e), self.max_attempts, self.retry_base, self.retry_max)
+            await db.commit()
+            return True # Событие ушло на паузу, очередь не пуста — воркер сразу берёт головы других клиентов, а не спит poll_interval
+
+
+webhook_workers = WebhookWorkerPool(
+    workers=settings.WEBHOOK_WORKERS,
+    poll_interval=settings.WEBHOOK_POLL_INTERVAL,
+    max_attempts=settings.WEBHOOK_MAX_ATTEMPTS,
+    retry_base=settings.WEBHOOK_RETRY_BASE,
+    retry_max=settings.WEBHOOK_RETRY_MAX,
+)